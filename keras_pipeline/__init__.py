@@ -1,5 +1,6 @@
 # Data
 from . import generators
+from . import datasets
 
 # Model
 from . import (
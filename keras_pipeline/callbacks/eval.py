@@ -1,3 +1,5 @@
+import threading
+
 import keras
 from ..evaluation.eval import evaluate_detection
 
@@ -12,10 +14,22 @@ class EvaluateDetection(keras.callbacks.Callback):
         max_plots=5,
         save_path=None,
         tensorboard=None,
+        every_n_epochs=1,
+        background=False,
+        custom_objects=None,
+        batch_size=None,
+        workers=2,
         verbose=1
     ):
         """ Evaluate a given dataset using a given model at the end of every epoch during training.
 
+        In blocking mode, the mAP is added to the logs (as mAP) of the epochs which are evaluated.
+        In background mode, the weights at the end of an epoch are copied into a clone of the model
+        which is evaluated on a separate thread while training continues.
+        Results are only written to TensorBoard (under the evaluated epoch) and kept as the mean_ap attribute
+        once the evaluation finishes, they are not added to the logs as they would belong to an earlier epoch.
+        An epoch is not evaluated if the evaluation of a previous epoch is still running.
+
         # Arguments
             generator       : The generator that represents the dataset to evaluate.
             iou_threshold   : The threshold used to consider when a detection is positive or negative.
@@ -25,34 +39,54 @@ class EvaluateDetection(keras.callbacks.Callback):
             max_plots       : The maximum number of images to visualize with detections.
             save_path       : The path to save images with visualized detections to.
             tensorboard     : Instance of keras.callbacks.TensorBoard used to log the mAP value.
+            every_n_epochs  : Only evaluate every n epochs (at least 1).
+            background      : Flag to evaluate on a separate thread without blocking training.
+            custom_objects  : Custom objects of the model, required to clone it in background mode.
+            batch_size      : The number of images predicted at once (defaults to the batch_size of the generator).
+            workers         : The number of threads loading images ahead of the model.
             verbose         : Set the verbosity level, by default this is set to 1.
         """
+        assert every_n_epochs >= 1, 'every_n_epochs must be at least 1, got {}'.format(every_n_epochs)
+
         self.generator       = generator
         self.iou_threshold   = iou_threshold
         self.score_threshold = score_threshold
         self.max_detections  = max_detections
-        self.max_images      = max_images,
-        self.max_plots       = max_plots,
+        self.max_images      = max_images
+        self.max_plots       = max_plots
         self.save_path       = save_path
         self.tensorboard     = tensorboard
+        self.every_n_epochs  = every_n_epochs
+        self.background      = background
+        self.custom_objects  = custom_objects or {}
+        self.batch_size      = batch_size
+        self.workers         = workers
         self.verbose         = verbose
 
-        super(EvaluateDetection, self).__init__()
+        # Latest evaluation result
+        self.mean_ap = None
 
-    def on_epoch_end(self, epoch, logs=None):
-        logs = logs or {}
+        # Model copy and thread used in background mode
+        self.eval_model  = None
+        self.eval_thread = None
 
-        # run evaluation
-        average_precisions = evaluate_detection(
-            self.generator, self.model,
+        super(EvaluateDetection, self).__init__()
+
+    def _evaluate(self, model):
+        return evaluate_detection(
+            self.generator, model,
             iou_threshold=self.iou_threshold,
             score_threshold=self.score_threshold,
             max_detections=self.max_detections,
             max_images=self.max_images,
             max_plots=self.max_plots,
-            save_path=self.save_path
+            save_path=self.save_path,
+            batch_size=self.batch_size,
+            workers=self.workers
         )
 
+    def _publish(self, epoch, average_precisions):
+        """ Records the results of the evaluation of an epoch and writes them to TensorBoard """
         self.mean_ap = sum(average_precisions.values()) / len(average_precisions)
 
         if self.tensorboard is not None and self.tensorboard.writer is not None:
@@ -63,9 +97,51 @@ class EvaluateDetection(keras.callbacks.Callback):
             summary_value.tag = "mAP"
             self.tensorboard.writer.add_summary(summary, epoch)
 
-        logs['mAP'] = self.mean_ap
-
         if self.verbose == 1:
             for label, average_precision in average_precisions.items():
                 print(self.generator.label_to_name(label), '{:.4f}'.format(average_precision))
             print('mAP: {:.4f}'.format(self.mean_ap))
+
+    def _start_background_evaluation(self, epoch):
+        """ Evaluates a snapshot of the current weights on a separate thread """
+        import tensorflow as tf
+
+        if self.eval_thread is not None and self.eval_thread.is_alive():
+            if self.verbose == 1:
+                print('Skipping evaluation of epoch {}, a previous evaluation is still running'.format(epoch + 1))
+            return
+
+        if self.eval_model is None:
+            with keras.utils.CustomObjectScope(self.custom_objects):
+                self.eval_model = keras.models.clone_model(self.model)
+            self.eval_model._make_predict_function()
+
+        # The model copy is only written to while no evaluation is running
+        self.eval_model.set_weights(self.model.get_weights())
+        graph = tf.get_default_graph()
+
+        def evaluate():
+            with graph.as_default():
+                average_precisions = self._evaluate(self.eval_model)
+            self._publish(epoch, average_precisions)
+
+        self.eval_thread = threading.Thread(target=evaluate, name='EvaluateDetection')
+        self.eval_thread.daemon = True
+        self.eval_thread.start()
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+
+        if (epoch + 1) % self.every_n_epochs != 0:
+            return
+
+        if self.background:
+            self._start_background_evaluation(epoch)
+        else:
+            self._publish(epoch, self._evaluate(self.model))
+            logs['mAP'] = self.mean_ap
+
+    def on_train_end(self, logs=None):
+        # Wait for the last evaluation so that its results are not lost
+        if self.eval_thread is not None:
+            self.eval_thread.join()
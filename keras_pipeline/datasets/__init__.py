@@ -0,0 +1,3 @@
+from .shards import ShardDataset, write_shards
+from .image_index import ImageIndex, build_image_index, open_image_index
+from .manifest import Manifest, build_manifest, build_dataset_manifest
@@ -0,0 +1,169 @@
+""" A persistent index of the size, aspect ratio and number of annotations of every image in a dataset
+
+Generators need the shape of every image to group images, computing it from the dataset
+one image at a time on every epoch is slow for large datasets.
+The index is built once (in parallel) and stored as a .npz file holding one column per value.
+
+The key of an index covers the image ids, and the path, size and modification time
+of every image file if the dataset has the function get_image_path (replaced images are only noticed then).
+"""
+
+import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ..preprocessing.image import get_image_size, get_image_file_stats
+
+
+_INDEX_VERSION = 2
+
+
+def compute_index_key(image_ids, file_stats=None):
+    """ Computes the key of an index, the key changes if the image ids or image files change
+    file_stats are the stats of the image files (see get_image_file_stats), image files are not tracked if None
+    """
+    key = json.dumps({
+        'version'    : _INDEX_VERSION,
+        'image_ids'  : [str(image_id) for image_id in image_ids],
+        'file_stats' : file_stats,
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _read_image_info(dataset, image_index):
+    """ Returns the width, height and number of annotations of an image
+    Only reads the image header if the dataset has get_image_path or get_image_size
+    """
+    if hasattr(dataset, 'get_image_path'):
+        width, height = get_image_size(dataset.get_image_path(image_index))
+    elif hasattr(dataset, 'get_image_size'):
+        width, height = dataset.get_image_size(image_index)
+    else:
+        height, width = dataset.load_image(image_index).shape[:2]
+
+    num_annotations = -1
+    if hasattr(dataset, 'get_annotations_array'):
+        num_annotations = dataset.get_annotations_array(image_index).shape[0]
+
+    return width, height, num_annotations
+
+
+class ImageIndex(object):
+    """ Columns of image information in the order of the image ids of a dataset
+
+    Args
+        image_ids       : The image ids the index was built with (in the same order)
+        width           : (N,) array of image widths
+        height          : (N,) array of image heights
+        num_annotations : (N,) array of the number of annotations of every image (-1 if unknown)
+        file_stats      : Stats of the image files the index was built from (see get_image_file_stats)
+
+    """
+    def __init__(self, image_ids, width, height, num_annotations, file_stats=None):
+        self.image_ids       = list(image_ids)
+        self.width           = np.asarray(width, dtype=np.int32)
+        self.height          = np.asarray(height, dtype=np.int32)
+        self.aspect_ratio    = self.width / np.maximum(self.height, 1).astype(np.float64)
+        self.num_annotations = np.asarray(num_annotations, dtype=np.int32)
+        self.file_stats      = file_stats
+        self.rows            = {image_id: row for row, image_id in enumerate(image_ids)}
+
+        # Image ids sorted by aspect ratio (stable), the order never changes so it is only sorted once
+        self.ratio_order = [self.image_ids[row] for row in np.argsort(self.aspect_ratio, kind='mergesort')]
+
+    def get_image_size(self, image_index):
+        """ Returns the (width, height) of an image """
+        row = self.rows[image_index]
+        return int(self.width[row]), int(self.height[row])
+
+    def get_image_aspect_ratio(self, image_index):
+        """ Returns the aspect ratio (width / height) of an image """
+        return float(self.aspect_ratio[self.rows[image_index]])
+
+    def get_num_annotations(self, image_index):
+        return int(self.num_annotations[self.rows[image_index]])
+
+    def save(self, path):
+        """ Writes the index to path (written to a temporary file first so that an interrupted save is never read) """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                key             = compute_index_key(self.image_ids, self.file_stats),
+                width           = self.width,
+                height          = self.height,
+                num_annotations = self.num_annotations
+            )
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path, image_ids, file_stats=None):
+        """ Reads an index from path, returns None if it was built for other images or image files """
+        with np.load(path) as data:
+            if str(data['key']) != compute_index_key(image_ids, file_stats):
+                return None
+            return cls(image_ids, data['width'], data['height'], data['num_annotations'], file_stats=file_stats)
+
+    def __len__(self):
+        return len(self.image_ids)
+
+
+def build_image_index(dataset, workers=8, image_ids=None):
+    """ Reads the size and number of annotations of every image in a dataset in parallel
+
+    Args
+        dataset   : Dataset with the function list_all_image_index and one of get_image_path,
+                    get_image_size or load_image (in order of preference)
+        workers   : Number of threads used to read image information
+        image_ids : The images to index (defaults to dataset.list_all_image_index()),
+                    eg. the image ids of a generator which left out invalid images
+
+    Returns
+        An ImageIndex of the dataset
+
+    """
+    if image_ids is None:
+        image_ids = dataset.list_all_image_index()
+
+    # Files are checked before they are read so that files changed during the build are noticed next time
+    file_stats = get_image_file_stats(dataset, image_ids)
+
+    pool = ThreadPool(workers)
+    try:
+        infos = pool.map(lambda image_index: _read_image_info(dataset, image_index), image_ids, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+
+    infos = np.array(infos, dtype=np.int64).reshape((-1, 3))
+    return ImageIndex(image_ids, infos[:, 0], infos[:, 1], infos[:, 2], file_stats=file_stats)
+
+
+def open_image_index(dataset, path, workers=8, image_ids=None):
+    """ Loads an index, (re)building and saving it if it does not exist or was built for other images
+    Image files are only checked for changes if the dataset has the function get_image_path
+
+    Args
+        dataset   : Dataset as in build_image_index
+        path      : Path of the .npz file of the index
+        workers   : Number of threads used to read image information if the index has to be built
+        image_ids : The images to index (defaults to dataset.list_all_image_index())
+
+    Returns
+        An ImageIndex
+
+    """
+    if image_ids is None:
+        image_ids = dataset.list_all_image_index()
+
+    if os.path.isfile(path):
+        image_index = ImageIndex.load(path, image_ids, file_stats=get_image_file_stats(dataset, image_ids))
+        if image_index is not None:
+            return image_index
+
+    image_index = build_image_index(dataset, workers=workers, image_ids=image_ids)
+    image_index.save(path)
+    return image_index
@@ -0,0 +1,234 @@
+""" A manifest of the format, file size and dimensions of image files
+
+Scanning only reads image headers (and the end of JPEG and PNG files to detect truncation)
+with a pool of threads, so that a full dataset can be checked for unreadable files before training.
+The manifest is stored as a .npz file holding one column per value.
+
+Can be run as a script
+    python -m keras_pipeline.datasets.manifest IMAGE_DIR [IMAGE_DIR ...] -O manifest.npz
+"""
+
+import os
+import sys
+import time
+import struct
+import argparse
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from ..preprocessing.image import get_image_info
+
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff']
+
+# Number of bytes at the end of a file searched first for the end of image marker
+_TAIL_SIZE = 1024
+
+# Markers which have to be found at the end of complete files
+_END_MARKERS = {
+    'jpeg' : b'\xff\xd9',
+    'png'  : b'IEND',
+}
+
+
+def _find_jpeg_scan_start(f):
+    """ Returns the offset of the first start of scan marker of a JPEG file object, -1 if there is none
+    Segments before it are skipped by their length, so markers of embedded thumbnails (eg. in EXIF) are not matched
+    """
+    offset = 2
+    while True:
+        f.seek(offset)
+        header = f.read(4)
+        if len(header) < 4 or header[:1] != b'\xff':
+            return -1
+
+        marker = header[1:2]
+        if marker == b'\xff':
+            # Fill byte
+            offset += 1
+        elif marker == b'\xda':
+            return offset
+        else:
+            offset += 2 + struct.unpack('>H', header[2:4])[0]
+
+
+def _is_truncated(path, image_format, file_size):
+    """ Checks if a JPEG or PNG file is missing its end of image marker
+    The end of a JPEG may be followed by other data (eg. appended by cameras), if the marker is not in the last bytes
+    the whole file is searched for it after the start of the image data.
+    The marker of a JPEG only counts after the start of the image data, as embedded thumbnails have one too.
+    """
+    end_marker = _END_MARKERS.get(image_format)
+    if end_marker is None:
+        return False
+
+    with open(path, 'rb') as f:
+        tail_offset = max(0, file_size - _TAIL_SIZE)
+        f.seek(tail_offset)
+        end = f.read().rfind(end_marker)
+        if image_format != 'jpeg':
+            return end < 0
+
+        scan_start = _find_jpeg_scan_start(f)
+        if scan_start < 0:
+            return True
+        if end >= 0 and tail_offset + end > scan_start:
+            return False
+
+        f.seek(scan_start)
+        return end_marker not in f.read()
+
+
+def scan_image(path):
+    """ Reads the header of an image file
+
+    Args
+        path : Path to an image file
+
+    Returns
+        (format, file_size, width, height, valid)
+        where valid is False if the file can not be read, has an unknown format or is truncated
+
+    """
+    try:
+        image_format, file_size, width, height = get_image_info(path)
+        valid = (width > 0) and (height > 0) and not _is_truncated(path, image_format, file_size)
+    except Exception:
+        image_format = 'unknown'
+        file_size    = os.path.getsize(path) if os.path.isfile(path) else -1
+        width        = -1
+        height       = -1
+        valid        = False
+
+    return image_format, file_size, width, height, valid
+
+
+class Manifest(object):
+    """ Columns of image file information
+
+    Args
+        paths     : (N,) array of image paths
+        formats   : (N,) array of image formats
+        file_size : (N,) array of file sizes in bytes
+        width     : (N,) array of image widths (-1 if unreadable)
+        height    : (N,) array of image heights (-1 if unreadable)
+        valid     : (N,) bool array, False for unreadable or truncated files
+
+    """
+    def __init__(self, paths, formats, file_size, width, height, valid):
+        self.paths     = np.asarray(paths, dtype=str)
+        self.formats   = np.asarray(formats, dtype=str)
+        self.file_size = np.asarray(file_size, dtype=np.int64)
+        self.width     = np.asarray(width, dtype=np.int32)
+        self.height    = np.asarray(height, dtype=np.int32)
+        self.valid     = np.asarray(valid, dtype=bool)
+        self.rows      = {os.path.abspath(path): row for row, path in enumerate(self.paths)}
+
+    def is_valid(self, path):
+        """ Returns False if path is in the manifest and could not be read """
+        row = self.rows.get(os.path.abspath(path))
+        return row is None or bool(self.valid[row])
+
+    def get_invalid_paths(self):
+        return list(self.paths[~self.valid])
+
+    def save(self, path):
+        """ Writes the manifest to path (written to a temporary file first so that an interrupted save is never read) """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                paths     = self.paths,
+                formats   = self.formats,
+                file_size = self.file_size,
+                width     = self.width,
+                height    = self.height,
+                valid     = self.valid
+            )
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['paths'], data['formats'], data['file_size'], data['width'], data['height'], data['valid'])
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def build_manifest(paths, workers=32):
+    """ Scans image files in parallel
+
+    Args
+        paths   : List of image paths
+        workers : Number of threads used to read image headers
+
+    Returns
+        A Manifest of the images
+
+    """
+    pool = ThreadPool(workers)
+    try:
+        infos = pool.map(scan_image, paths, chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+
+    if len(infos) == 0:
+        return Manifest([], [], [], [], [], [])
+
+    formats, file_size, width, height, valid = zip(*infos)
+    return Manifest(paths, formats, file_size, width, height, valid)
+
+
+def build_dataset_manifest(dataset, workers=32):
+    """ Scans the images of a dataset with the functions list_all_image_index and get_image_path """
+    assert hasattr(dataset, 'get_image_path'), 'dataset must have the function get_image_path to be scanned'
+    paths = [dataset.get_image_path(image_index) for image_index in dataset.list_all_image_index()]
+    return build_manifest(paths, workers=workers)
+
+
+def list_image_files(image_dirs, extensions=IMAGE_EXTENSIONS):
+    """ Lists the image files (by extension) in image_dirs and their subdirectories """
+    paths = []
+    for image_dir in image_dirs:
+        for root, _, file_names in os.walk(image_dir):
+            for file_name in sorted(file_names):
+                if os.path.splitext(file_name)[1].lower() in extensions:
+                    paths.append(os.path.join(root, file_name))
+    return paths
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Scans image files and writes a manifest of their sizes and validity.')
+
+    parser.add_argument(metavar='IMAGE_DIR', dest='image_dirs', nargs='+',
+        help='Directories to scan for images (recursively)',
+        type=str)
+    parser.add_argument('-O', '--outfile',
+        help='File to store the manifest in, default is manifest.npz',
+        default='manifest.npz', type=str)
+    parser.add_argument('--workers',
+        help='Number of threads used to read image headers',
+        default=32, type=int)
+
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(sys.argv[1:] if args is None else args)
+
+    t = time.time()
+    paths = list_image_files(args.image_dirs)
+    manifest = build_manifest(paths, workers=args.workers)
+    manifest.save(args.outfile)
+
+    invalid_paths = manifest.get_invalid_paths()
+    print('{} images scanned in {}s, {} invalid'.format(len(manifest), time.time() - t, len(invalid_paths)))
+    for path in invalid_paths:
+        print('    {}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+""" Packed shard dataset format
+
+A shard holds the encoded images, annotations and image information of many images in a single file
+so that reading a dataset does not require one file open per image.
+
+Shard layout
+    magic                  : b'KPSHARD1'
+    records                : For each image, the encoded image bytes followed by
+                             its annotations as a float32 array of shape (num_annotations, 5)
+    index                  : A .npy serialized structured array with one row per image
+    meta                   : JSON with the image ids and class names
+    trailer                : uint64 offsets/lengths of index and meta followed by the magic
+
+Any dataset object with the functions required by DetectionGeneratorConfig can be written to shards,
+the resulting shards can be read with ShardDataset which implements the same functions.
+"""
+
+import io
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+from PIL import Image
+
+from ..preprocessing.image import read_image, get_image_size
+
+
+_MAGIC = b'KPSHARD1'
+
+# footer_offset, index_length, meta_length, magic
+_TRAILER_FORMAT = '<QQQ8s'
+_TRAILER_SIZE   = struct.calcsize(_TRAILER_FORMAT)
+
+_INDEX_DTYPE = np.dtype([
+    ('image_offset'      , np.int64),
+    ('image_length'      , np.int64),
+    ('annotations_offset', np.int64),
+    ('num_annotations'   , np.int32),
+    ('width'             , np.int32),
+    ('height'            , np.int32),
+    ('aspect_ratio'      , np.float64),
+])
+
+
+def _to_json_id(image_id):
+    """ Converts numpy scalars (also inside of tuples) to python types so that they can be stored as JSON """
+    if isinstance(image_id, (tuple, list)):
+        return [_to_json_id(part) for part in image_id]
+    return image_id.item() if hasattr(image_id, 'item') else image_id
+
+
+def _from_json_id(image_id):
+    """ Converts the lists JSON returns for tuple image ids back to (hashable) tuples """
+    if isinstance(image_id, list):
+        return tuple(_from_json_id(part) for part in image_id)
+    return image_id
+
+
+def _encode_image(dataset, image_index, image_format, quality):
+    """ Returns the encoded bytes, width and height of an image
+    Uses the original file if the dataset has a get_image_path function, otherwise encodes the decoded image
+    """
+    if hasattr(dataset, 'get_image_path'):
+        image_path = dataset.get_image_path(image_index)
+        width, height = get_image_size(image_path)
+        with open(image_path, 'rb') as f:
+            return f.read(), width, height
+
+    image  = dataset.load_image(image_index)
+    buffer = io.BytesIO()
+    if image_format == 'jpeg':
+        Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    else:
+        Image.fromarray(image).save(buffer, format='PNG')
+
+    return buffer.getvalue(), image.shape[1], image.shape[0]
+
+
+def _write_shard(dataset, path, image_ids, class_names, image_format, quality):
+    index = np.zeros((len(image_ids),), dtype=_INDEX_DTYPE)
+
+    with open(path, 'wb') as f:
+        f.write(_MAGIC)
+        offset = len(_MAGIC)
+
+        for row, image_index in enumerate(image_ids):
+            image_bytes, width, height = _encode_image(dataset, image_index, image_format, quality)
+            annotations = np.ascontiguousarray(dataset.get_annotations_array(image_index), dtype=np.float32)
+
+            f.write(image_bytes)
+            f.write(annotations.tobytes())
+
+            index[row] = (
+                offset,
+                len(image_bytes),
+                offset + len(image_bytes),
+                annotations.shape[0],
+                width,
+                height,
+                dataset.get_image_aspect_ratio(image_index)
+            )
+            offset += len(image_bytes) + annotations.nbytes
+
+        # Write footer and trailer
+        index_buffer = io.BytesIO()
+        np.save(index_buffer, index)
+        index_bytes = index_buffer.getvalue()
+
+        meta_bytes = json.dumps({
+            'image_ids'   : [_to_json_id(image_index) for image_index in image_ids],
+            'class_names' : class_names,
+        }).encode('utf-8')
+
+        f.write(index_bytes)
+        f.write(meta_bytes)
+        f.write(struct.pack(_TRAILER_FORMAT, offset, len(index_bytes), len(meta_bytes), _MAGIC))
+
+
+def write_shards(dataset, output_prefix, images_per_shard=1000, image_format='jpeg', quality=95):
+    """ Converts a dataset into packed shards
+
+    Args
+        dataset          : Dataset with the functions list_all_image_index, get_num_classes, get_image_aspect_ratio,
+                           load_image, get_annotations_array and label_to_name.
+                           If it also has get_image_path, the original image files are stored without re-encoding
+        output_prefix    : Shards are written to '{output_prefix}-{shard:05d}-of-{num_shards:05d}.shard'
+        images_per_shard : Maximum number of images in each shard
+        image_format     : Format images are encoded with if they have to be re-encoded, one of 'jpeg', 'png'
+        quality          : JPEG quality used if images have to be re-encoded
+
+    Returns
+        List of paths of the written shards
+
+    """
+    assert image_format in ['jpeg', 'png'], 'image_format must be one of jpeg, png, got {}'.format(image_format)
+
+    output_dir = os.path.dirname(output_prefix)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    image_ids   = dataset.list_all_image_index()
+    class_names = [dataset.label_to_name(label) for label in range(dataset.get_num_classes())]
+    num_shards  = max(1, int(np.ceil(len(image_ids) / float(images_per_shard))))
+
+    shard_paths = []
+    for shard in range(num_shards):
+        path = '{}-{:05d}-of-{:05d}.shard'.format(output_prefix, shard, num_shards)
+        shard_image_ids = image_ids[shard * images_per_shard:(shard + 1) * images_per_shard]
+        _write_shard(dataset, path, shard_image_ids, class_names, image_format, quality)
+        shard_paths.append(path)
+
+    return shard_paths
+
+
+class _ShardReader(object):
+    """ Memory mapped reader of a single shard """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        assert self.data[:len(_MAGIC)] == _MAGIC, '{} is not a valid shard'.format(path)
+        footer_offset, index_length, meta_length, magic = struct.unpack(
+            _TRAILER_FORMAT, self.data[-_TRAILER_SIZE:])
+        assert magic == _MAGIC, '{} is not a valid shard'.format(path)
+
+        index_end  = footer_offset + index_length
+        self.index = np.load(io.BytesIO(self.data[footer_offset:index_end]))
+        self.meta  = json.loads(self.data[index_end:index_end + meta_length].decode('utf-8'))
+
+    def read_image_bytes(self, row):
+        entry = self.index[row]
+        start = int(entry['image_offset'])
+        return self.data[start:start + int(entry['image_length'])]
+
+    def read_annotations(self, row):
+        entry = self.index[row]
+        start = int(entry['annotations_offset'])
+        count = int(entry['num_annotations'])
+        annotations = np.frombuffer(self.data[start:start + count * 5 * 4], dtype=np.float32)
+        return annotations.reshape((count, 5)).astype(np.float64)
+
+
+class ShardDataset(object):
+    """ Dataset reading images and annotations from shards written with write_shards
+    Can be used directly as the dataset of a DetectionGeneratorConfig
+
+    Args
+        shard_paths : List of paths of shards (or a single path)
+
+    """
+    def __init__(self, shard_paths):
+        if isinstance(shard_paths, str):
+            shard_paths = [shard_paths]
+        self.shard_paths = list(shard_paths)
+        self._open()
+
+    def _open(self):
+        self.shards    = [_ShardReader(path) for path in self.shard_paths]
+        self.image_ids = []
+        self.locations = {}
+
+        for shard_index, shard in enumerate(self.shards):
+            for row, image_index in enumerate(shard.meta['image_ids']):
+                image_index = _from_json_id(image_index)
+                self.image_ids.append(image_index)
+                self.locations[image_index] = (shard_index, row)
+
+        self.class_names = self.shards[0].meta['class_names'] if len(self.shards) else []
+
+    def list_all_image_index(self):
+        return list(self.image_ids)
+
+    def get_size(self):
+        return len(self.image_ids)
+
+    def get_num_classes(self):
+        return len(self.class_names)
+
+    def label_to_name(self, label):
+        return self.class_names[label]
+
+    def get_image_aspect_ratio(self, image_index):
+        shard_index, row = self.locations[image_index]
+        return float(self.shards[shard_index].index[row]['aspect_ratio'])
+
+    def get_image_size(self, image_index):
+        """ Returns the (width, height) of the stored image """
+        shard_index, row = self.locations[image_index]
+        entry = self.shards[shard_index].index[row]
+        return int(entry['width']), int(entry['height'])
+
+    def load_image(self, image_index, size_hint=None):
+        shard_index, row = self.locations[image_index]
+        return read_image(io.BytesIO(self.shards[shard_index].read_image_bytes(row)), size_hint=size_hint)
+
+    def get_annotations_array(self, image_index):
+        shard_index, row = self.locations[image_index]
+        return self.shards[shard_index].read_annotations(row)
+
+    def __getstate__(self):
+        # Memory maps are opened again instead of being copied
+        return {'shard_paths': self.shard_paths}
+
+    def __setstate__(self, state):
+        self.shard_paths = state['shard_paths']
+        self._open()
@@ -2,14 +2,29 @@ from __future__ import division
 
 import os
 import tqdm
+from collections import deque, OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import cv2
 import numpy as np
 
+from .store import DetectionStore, build_detection_store, compute_detection_store_key
 from ..utils.anchors import compute_overlap
 from ..utils.visualization import draw_detections, draw_annotations
 
 
+# IoU thresholds of the COCO mAP, 0.5 to 0.95 in steps of 0.05
+COCO_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# Object size ranges of the COCO evaluation as (min_area, max_area) in squared pixels
+AREA_RANGES = OrderedDict([
+    ('all'    , (-np.inf, np.inf)),
+    ('small'  , (0      , 32 ** 2)),
+    ('medium' , (32 ** 2, 96 ** 2)),
+    ('large'  , (96 ** 2, np.inf)),
+])
+
+
 def _compute_ap(recall, precision):
     """ Compute the average precision, given the recall and precision curves.
 
@@ -27,8 +42,7 @@ def _compute_ap(recall, precision):
     mpre = np.concatenate(([0.], precision, [0.]))
 
     # compute the precision envelope
-    for i in range(mpre.size - 1, 0, -1):
-        mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
 
     # to calculate area under PR curve, look for points
     # where X axis (recall) changes value
@@ -39,30 +53,178 @@ def _compute_ap(recall, precision):
     return ap
 
 
-def _get_annotations_and_detections(
+def _compute_ap_from_matches(true_positives, false_positives, num_annotations):
+    """ Computes the average precision of detections sorted by score
+
+    Args
+        true_positives  : (D,) bool array, True for true positives
+        false_positives : (D,) bool array, True for false positives
+        num_annotations : Number of annotations
+
+    Returns
+        The average precision
+
+    """
+    # compute false positives and true positives
+    false_positives = np.cumsum(false_positives)
+    true_positives  = np.cumsum(true_positives)
+
+    # compute recall and precision
+    recall    = true_positives / num_annotations
+    precision = true_positives / np.maximum(true_positives + false_positives, np.finfo(np.float64).eps)
+
+    # compute average precision
+    return _compute_ap(recall, precision)
+
+
+def _match_detections(detections, annotations, iou_thresholds):
+    """ Matches the detections of an image to its annotations of the same class at several thresholds
+
+    Every detection is assigned the annotation it overlaps the most with.
+    In the order of the detections (sorted by score), the first detection assigned to an annotation
+    with an overlap of at least the threshold is a true positive, all other detections are false positives.
+    The overlaps are only computed once for all thresholds.
+
+    Args
+        detections     : (D, 4 + score) array of detections sorted by score
+        annotations    : (A, 4) array of annotations
+        iou_thresholds : List-like of T thresholds used to consider if detection is positive or negative
+
+    Returns
+        true_positives       : (T, D) bool array, True for true positives at every threshold
+        assigned_annotations : (D,) array of the index of the annotation every detection is assigned to
+
+    """
+    true_positives       = np.zeros((len(iou_thresholds), detections.shape[0]), dtype=bool)
+    assigned_annotations = np.zeros((detections.shape[0],), dtype=int)
+    if detections.shape[0] == 0 or annotations.shape[0] == 0:
+        return true_positives, assigned_annotations
+
+    # One overlap matrix for all detections and annotations
+    overlaps             = compute_overlap(detections[:, :4], annotations)
+    assigned_annotations = np.argmax(overlaps, axis=1)
+    max_overlaps         = overlaps[np.arange(detections.shape[0]), assigned_annotations]
+
+    for t, iou_threshold in enumerate(iou_thresholds):
+        # Only the first detection above the threshold is matched to an annotation
+        candidates = np.flatnonzero(max_overlaps >= iou_threshold)
+        _, first_candidates = np.unique(assigned_annotations[candidates], return_index=True)
+        true_positives[t, candidates[first_candidates]] = True
+
+    return true_positives, assigned_annotations
+
+
+def _compute_areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def _load_eval_batch(generator, image_ids):
+    """ Loads and resizes a batch of images for evaluation
+
+    Returns
+        The loaded images, their annotations, the padded model input, the scale of every image
+        and the (x, y) scale from every original image to its loaded image (see generator.get_load_scale)
+
+    """
+    image_group, annotations_group = generator.load_group(image_ids)
+
+    resized_group = [None] * len(image_ids)
+    scales        = [None] * len(image_ids)
+    load_scales   = [None] * len(image_ids)
+    for index, (image_index, image) in enumerate(zip(image_ids, image_group)):
+        resized_group[index], scales[index] = generator.resize_image(image.copy())
+        load_scales[index] = generator.get_load_scale(image_index, image)
+
+    # Pad images the same way the generator does in training
+    inputs = generator.compute_inputs(resized_group)
+
+    return image_group, annotations_group, inputs, scales, load_scales
+
+
+def _filter_image_detections(boxes, scores, labels, score_threshold=0.05, max_detections=100):
+    """ Selects the max_detections highest scoring detections of an image with a score above score_threshold
+
+    Returns
+        (K, 4 + score + label) array of detections sorted by score
+
+    """
+    # Select scores above the threshold
+    indices = np.where(scores > score_threshold)[0]
+
+    # Find the order to sort the scores
+    scores_sort = np.argsort(-scores[indices])[:max_detections]
+    indices     = indices[scores_sort]
+
+    return np.concatenate([
+        boxes[indices, :],
+        np.expand_dims(scores[indices], axis=1),
+        np.expand_dims(labels[indices], axis=1)
+    ], axis=1)
+
+
+def _save_detections_plot(generator, image, boxes, scores, labels, path, score_threshold=0.05, max_detections=100):
+    """ Draws the detections of a loaded image (boxes in loaded image coordinates) and writes it to path """
+    image = image.astype('uint8')
+    image_detections = _filter_image_detections(
+        boxes, scores, labels,
+        score_threshold=score_threshold,
+        max_detections=max_detections
+    )
+    # draw_annotations(image, annotations, label_to_name=generator.label_to_name)
+    draw_detections(image, image_detections[:, :4], image_detections[:, 4], image_detections[:, 5],
+        label_to_name=generator.label_to_name, score_threshold=score_threshold)
+    cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+
+def _plot_stored_detections(generator, store, max_plots=5, save_path=None, score_threshold=0.05, max_detections=100):
+    """ Visualizes the detections of the first max_plots images of a store the same way _predict_detections does """
+    for i, image_index in enumerate(generator.all_image_index[:min(max_plots, len(store))]):
+        image_group, _ = generator.load_group([image_index])
+        boxes, scores, labels = store.get_detections(i)
+
+        # Stored boxes are in original image coordinates
+        x_scale, y_scale = generator.get_load_scale(image_index, image_group[0])
+        boxes = boxes * np.array([x_scale, y_scale, x_scale, y_scale])
+
+        _save_detections_plot(
+            generator, image_group[0], boxes, scores, labels,
+            os.path.join(save_path, '{}.png'.format(i)),
+            score_threshold=score_threshold,
+            max_detections=max_detections
+        )
+
+
+def _predict_detections(
     generator, model,
     score_threshold=0.05,
     max_detections=100,
     max_images=None,
     max_plots=5,
-    save_path=None
+    save_path=None,
+    batch_size=None,
+    workers=2,
+    key=None
 ):
-    """ Get the annotations and detections from the model using the generator.
+    """ Get the raw detections of the model and the annotations using the generator.
 
-    Annotations (and detections) are list of lists in the format
-        annotations[num_images][num_classes] = annotations[num_annotations, 4 + label]
-        annotations[num_images][num_classes] = annotations[num_annotations, 4 + score + label]
+    Images are sorted by aspect ratio and predicted in batches,
+    the next batches are loaded and resized on background threads while the current batch is predicted.
+    score_threshold and max_detections are only used to visualize detections, all detections are kept.
 
     Args
         generator       : Generator for your dataset
         model           : Model to perform detection
-        score_threshold : Score threshold used for detection
-        max_detections  : Max number of detections to use per image
+        score_threshold : Score threshold used to visualize detections
+        max_detections  : Max number of detections to visualize per image
         max_images      : Max number of images to extract
         max_plots       : Max number of images to visualize with detections
         save_path       : Path to save images with visualized detections
+        batch_size      : Number of images predicted at once (defaults to the batch_size of the generator)
+        workers         : Number of threads loading batches ahead of the model
+        key             : Key of the returned DetectionStore
 
     Returns
+        A DetectionStore of the detections and annotations of every image
 
     """
     # Get number of images to extract on
@@ -71,70 +233,183 @@ def _get_annotations_and_detections(
     else:
         num_images = min(max_images, len(generator))
 
+    if batch_size is None:
+        batch_size = generator.batch_size
+
+    # Batch images of similar shapes, positions are the indices of images in generator.all_image_index
+    image_ids = generator.all_image_index[:num_images]
+    positions = {image_index: i for i, image_index in enumerate(image_ids)}
+    image_ids = generator._sort_image_ids_by_ratio(image_ids)
+    batches   = deque(image_ids[start:start + batch_size] for start in range(0, num_images, batch_size))
+
     # Create blob to store annotations and detections
-    all_annotations = [[None for label in range(generator.num_classes)] for i in range(num_images)]
-    all_detections  = [[None for label in range(generator.num_classes)] for i in range(num_images)]
+    boxes_group       = [None] * num_images
+    scores_group      = [None] * num_images
+    labels_group      = [None] * num_images
+    annotations_group = [None] * num_images
 
     # Create progress bar
     pbar = tqdm.tqdm(total=num_images, desc='Getting annotations and detections')
 
-    for i in range(num_images):
-        pbar.update(1)
-        image_index = generator.all_image_index[i]
+    pool           = ThreadPool(max(1, workers))
+    prefetch_queue = deque()
+
+    try:
+        while batches or prefetch_queue:
+            # Keep the next batches loading in the background
+            while batches and len(prefetch_queue) <= workers:
+                batch_ids = batches.popleft()
+                prefetch_queue.append((batch_ids, pool.apply_async(_load_eval_batch, (generator, batch_ids))))
+
+            batch_ids, result = prefetch_queue.popleft()
+            image_group, batch_annotations, inputs, scales, load_scales = result.get()
+
+            # Perform predictions
+            boxes_batch, scores_batch, labels_batch = model.predict_on_batch(inputs)
+
+            for j, image_index in enumerate(batch_ids):
+                pbar.update(1)
+                i = positions[image_index]
+
+                # Remove padding detections and correct boxes for scale
+                valid = labels_batch[j] >= 0
+                boxes = boxes_batch[j][valid] / scales[j]
+                scores_group[i] = scores_batch[j][valid]
+                labels_group[i] = labels_batch[j][valid]
+
+                # Map boxes and annotations back to the original image (IoU is unchanged, areas are not)
+                x_scale, y_scale = load_scales[j]
+                load_scale = np.array([x_scale, y_scale, x_scale, y_scale])
+                boxes_group[i] = boxes / load_scale
+                annotations_group[i] = np.array(batch_annotations[j], dtype=np.float64)
+                annotations_group[i][:, :4] /= load_scale
+
+                # Save detections if necessary
+                if (save_path is not None) and (i < max_plots):
+                    _save_detections_plot(
+                        generator, image_group[j], boxes, scores_group[i], labels_group[i],
+                        os.path.join(save_path, '{}.png'.format(i)),
+                        score_threshold=score_threshold,
+                        max_detections=max_detections
+                    )
+    finally:
+        pool.close()
+        pool.join()
 
-        # load group X and Y
-        X_group = generator.load_X_group([image_index])
-        Y_group = generator.load_Y_group([image_index])
+    pbar.close()
 
-        # Get original image and annotations
-        image       = X_group[0]
-        annotations = Y_group[0]
+    return build_detection_store(key, boxes_group, scores_group, labels_group, annotations_group)
 
-        # Get model input and scale
-        image_input, image_scale = generator.resize_image(image.copy())
-        image_input = np.expand_dims(image_input, 0)
 
-        # Force correct types
-        image = image.astype('uint8')
+def _open_detection_store(
+    generator, model,
+    store_path=None,
+    max_images=None,
+    **kwargs
+):
+    """ Gets the raw detections and annotations of an evaluation
 
-        # Perform predictions
-        boxes, scores, labels = model.predict(image_input)
+    If store_path is given, detections are loaded from the store at store_path if it was built
+    with the same model weights and images, otherwise they are predicted and saved to store_path.
+    Detections loaded from a store are still visualized if save_path is given.
+    If model is None, the store at store_path is loaded without checking its key and nothing is visualized.
 
-        # Correct boxes for scale
-        boxes /= image_scale
+    Returns
+        A DetectionStore
 
-        # Select scores above the threshold
-        indices = np.where(scores[0, :] > score_threshold)[0]
-        scores = scores[0][indices]
+    """
+    if model is None:
+        assert store_path is not None and os.path.isfile(store_path), 'Evaluating without a model requires an existing store_path'
+        return DetectionStore.load(store_path)
+
+    if store_path is None:
+        return _predict_detections(generator, model, max_images=max_images, **kwargs)
+
+    num_images = len(generator) if max_images is None else min(max_images, len(generator))
+    key        = compute_detection_store_key(model, generator, num_images)
+
+    if os.path.isfile(store_path):
+        store = DetectionStore.load(store_path, key=key)
+        if store is not None:
+            if kwargs.get('save_path') is not None:
+                _plot_stored_detections(
+                    generator, store,
+                    max_plots=kwargs.get('max_plots', 5),
+                    save_path=kwargs['save_path'],
+                    score_threshold=kwargs.get('score_threshold', 0.05),
+                    max_detections=kwargs.get('max_detections', 100)
+                )
+            return store
+
+    store = _predict_detections(generator, model, max_images=max_images, key=key, **kwargs)
+    store.save(store_path)
+    return store
 
-        # Find the order to sort the scores
-        scores_sort = np.argsort(-scores)[:max_detections]
 
-        # Select detections
-        image_boxes      = boxes[0, indices[scores_sort], :]
-        image_scores     = scores[scores_sort]
-        image_labels     = labels[0, indices[scores_sort]]
-        image_detections = np.concatenate([
-            image_boxes,
-            np.expand_dims(image_scores, axis=1),
-            np.expand_dims(image_labels, axis=1)
-        ], axis=1)
+def _get_annotations_and_detections(
+    generator, model,
+    score_threshold=0.05,
+    max_detections=100,
+    max_images=None,
+    max_plots=5,
+    save_path=None,
+    batch_size=None,
+    workers=2,
+    store_path=None
+):
+    """ Get the annotations and detections from the model using the generator.
 
-        # Save detections if necessary
-        if (save_path is not None) and (i < max_plots):
-            image = image.copy()
-            # draw_annotations(image, annotations, label_to_name=generator.label_to_name)
-            draw_detections(image, image_boxes, image_scores, image_labels,
-                label_to_name=generator.label_to_name, score_threshold=score_threshold)
-            cv2.imwrite(os.path.join(save_path, '{}.png'.format(i)), cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    Annotations (and detections) are list of lists in the format
+        annotations[num_images][num_classes] = annotations[num_annotations, 4 + label]
+        annotations[num_images][num_classes] = annotations[num_annotations, 4 + score + label]
 
+    Args
+        generator       : Generator for your dataset
+        model           : Model to perform detection (if None, detections are loaded from store_path)
+        score_threshold : Score threshold used for detection
+        max_detections  : Max number of detections to use per image
+        max_images      : Max number of images to extract
+        max_plots       : Max number of images to visualize with detections
+        save_path       : Path to save images with visualized detections
+        batch_size      : Number of images predicted at once (defaults to the batch_size of the generator)
+        workers         : Number of threads loading batches ahead of the model
+        store_path      : Path of a .npz store of raw detections, reused if built with the same model and images
+
+    Returns
+
+    """
+    store = _open_detection_store(
+        generator, model,
+        store_path=store_path,
+        max_images=max_images,
+        score_threshold=score_threshold,
+        max_detections=max_detections,
+        max_plots=max_plots,
+        save_path=save_path,
+        batch_size=batch_size,
+        workers=workers
+    )
+
+    num_images = len(store)
+    if max_images is not None:
+        num_images = min(max_images, num_images)
+
+    # Create blob to store annotations and detections
+    all_annotations = [[None for label in range(generator.num_classes)] for i in range(num_images)]
+    all_detections  = [[None for label in range(generator.num_classes)] for i in range(num_images)]
+
+    for i in range(num_images):
+        annotations      = store.get_annotations(i)
+        image_detections = _filter_image_detections(
+            *store.get_detections(i),
+            score_threshold=score_threshold,
+            max_detections=max_detections
+        )
 
         for label in range(generator.num_classes):
             all_annotations[i][label] = annotations[annotations[:, 4] == label, :4].copy()
             all_detections[i][label]  = image_detections[image_detections[:, -1] == label, :-1].copy()
 
-    pbar.close()
-
     return all_annotations, all_detections
 
 def evaluate_detection(
@@ -145,20 +420,26 @@ def evaluate_detection(
     max_detections=100,
     max_images=None,
     max_plots=5,
-    save_path=None
+    save_path=None,
+    batch_size=None,
+    workers=2,
+    store_path=None
 ):
     """ Evaluate a detection model on a dataset
-    At present evaluation is working only at batch sizes of 1
 
     Args
         generator       : Generator for your dataset
-        model           : Model to evaluate
+        model           : Model to evaluate (if None, detections are loaded from store_path)
         iou_threshold   : Threshold used to consider if detection is positive or negative
         score_threshold : Score threshold used for detection
         max_detections  : Max number of detections to use per image
         max_images      : Max number of images to evaluate on (if None will evaluate on entire dataset)
         max_plots       : Max number of images to visualize with detections
         save_path       : Path to save images with visualized detections
+        batch_size      : Number of images predicted at once (defaults to the batch_size of the generator)
+        workers         : Number of threads loading batches ahead of the model
+        store_path      : Path of a .npz store of raw detections, evaluations with the same model and images
+                          only compute metrics from the store (if model is None the store is always used)
 
     Returns
         A dict containing AP scores for each class
@@ -174,66 +455,192 @@ def evaluate_detection(
         max_detections=max_detections,
         max_images=max_images,
         max_plots=max_plots,
-        save_path=save_path
+        save_path=save_path,
+        batch_size=batch_size,
+        workers=workers,
+        store_path=store_path
     )
 
     # Record number of images to be used in evaluation
     num_images = len(all_annotations)
 
     for label in range(generator.num_classes):
-        false_positives = np.zeros((0,))
-        true_positives  = np.zeros((0,))
-        scores          = np.zeros((0,))
-        num_annotations = 0.
-
-
-        for i in range(num_images):
-            detections           = all_detections[i][label]
-            annotations          = all_annotations[i][label]
-            num_annotations     += len(annotations)
-            detected_annotations = []
-
-            for d in detections:
-                scores = np.append(scores, d[4])
-
-                if annotations.shape[0] == 0:
-                    false_positives = np.append(false_positives, 1)
-                    true_positives  = np.append(true_positives, 0)
-                    continue
-
-                overlaps = compute_overlap(np.expand_dims(d, axis=0), annotations)
-                assigned_annotation = np.argmax(overlaps, axis=1)
-                max_overlap = overlaps[0, assigned_annotation]
-
-                if max_overlap >= iou_threshold and assigned_annotation not in detected_annotations:
-                    false_positives = np.append(false_positives, 0)
-                    true_positives  = np.append(true_positives, 1)
-                    detected_annotations.append(assigned_annotation)
-                else:
-                    false_positives = np.append(false_positives, 1)
-                    true_positives  = np.append(true_positives, 0)
+        num_annotations = sum(len(all_annotations[i][label]) for i in range(num_images))
+        num_detections  = sum(len(all_detections[i][label]) for i in range(num_images))
 
         # If no annotations then AP will be 0
         if num_annotations == 0:
             average_precisions[label] = 0
             continue
 
-        # sort by score
-        indices         = np.argsort(-scores)
-        false_positives = false_positives[indices]
-        true_positives  = true_positives[indices]
+        # Match the detections of every image into preallocated arrays
+        scores         = np.zeros((num_detections,))
+        true_positives = np.zeros((num_detections,), dtype=bool)
+
+        offset = 0
+        for i in range(num_images):
+            detections = all_detections[i][label]
+            end        = offset + detections.shape[0]
+
+            scores[offset:end]         = detections[:, 4]
+            true_positives[offset:end] = _match_detections(detections, all_annotations[i][label], [iou_threshold])[0][0]
 
-        # compute false positives and true positives
-        false_positives = np.cumsum(false_positives)
-        true_positives  = np.cumsum(true_positives)
+            offset = end
 
-        # compute recall and precision
-        recall    = true_positives / num_annotations
-        precision = true_positives / np.maximum(true_positives + false_positives, np.finfo(np.float64).eps)
+        # sort by score
+        indices        = np.argsort(-scores)
+        true_positives = true_positives[indices]
 
         # compute average precision
-        average_precision  = _compute_ap(recall, precision)
-        average_precisions[label] = average_precision
+        average_precisions[label] = _compute_ap_from_matches(true_positives, ~true_positives, num_annotations)
 
 
     return average_precisions
+
+
+def _mean_ap(average_precisions):
+    """ Mean of the average precisions which are not nan (nan if there are none) """
+    valid = average_precisions[~np.isnan(average_precisions)]
+    return float(np.mean(valid)) if valid.size else float('nan')
+
+
+def evaluate_detection_coco(
+    generator,
+    model,
+    iou_thresholds=COCO_IOU_THRESHOLDS,
+    score_threshold=0.05,
+    max_detections=100,
+    max_images=None,
+    max_plots=5,
+    save_path=None,
+    batch_size=None,
+    workers=2,
+    store_path=None
+):
+    """ Evaluate a detection model on a dataset at several IoU thresholds and object sizes in a single pass
+    Inference runs once and the overlaps of every image and class are computed once for all thresholds
+
+    Object sizes follow the COCO area ranges in AREA_RANGES (measured on the original images,
+    boxes of images read from a resized image store or decoded with a size hint are scaled back first).
+    Within an area range, annotations outside of the range are not counted,
+    true positives are only counted if their annotation is in the range
+    and false positives are only counted if the detection is in the range.
+
+    Args
+        generator       : Generator for your dataset
+        model           : Model to evaluate (if None, detections are loaded from store_path)
+        iou_thresholds  : List-like of thresholds used to consider if detection is positive or negative
+        score_threshold : Score threshold used for detection
+        max_detections  : Max number of detections to use per image
+        max_images      : Max number of images to evaluate on (if None will evaluate on entire dataset)
+        max_plots       : Max number of images to visualize with detections
+        save_path       : Path to save images with visualized detections
+        batch_size      : Number of images predicted at once (defaults to the batch_size of the generator)
+        workers         : Number of threads loading batches ahead of the model
+        store_path      : Path of a .npz store of raw detections, evaluations with the same model and images
+                          only compute metrics from the store (if model is None the store is always used)
+
+    Returns
+        A dict containing
+            iou_thresholds     : The IoU thresholds as an array
+            average_precisions : Dict of (num_classes, num_thresholds) arrays of AP scores for each area range,
+                                 nan for classes without annotations in the area range
+            mAP                : AP averaged over classes and thresholds
+            AP50, AP75         : AP averaged over classes at IoU 0.5 and 0.75 (if in iou_thresholds)
+            APsmall, APmedium,
+            APlarge            : AP averaged over classes and thresholds for each object size
+
+    """
+    iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    num_thresholds = len(iou_thresholds)
+
+    # Gather all detections and annotations
+    all_annotations, all_detections = _get_annotations_and_detections(
+        generator, model,
+        score_threshold=score_threshold,
+        max_detections=max_detections,
+        max_images=max_images,
+        max_plots=max_plots,
+        save_path=save_path,
+        batch_size=batch_size,
+        workers=workers,
+        store_path=store_path
+    )
+
+    # Record number of images to be used in evaluation
+    num_images = len(all_annotations)
+
+    # Create blob for average_precision
+    average_precisions = {
+        area: np.full((generator.num_classes, num_thresholds), np.nan)
+        for area in AREA_RANGES
+    }
+
+    for label in range(generator.num_classes):
+        num_detections  = sum(len(all_detections[i][label]) for i in range(num_images))
+        num_annotations = dict.fromkeys(AREA_RANGES, 0)
+
+        # Match the detections of every image into preallocated arrays
+        scores         = np.zeros((num_detections,))
+        true_positives = np.zeros((num_thresholds, num_detections), dtype=bool)
+        counted        = {area: np.zeros((num_thresholds, num_detections), dtype=bool) for area in AREA_RANGES}
+
+        offset = 0
+        for i in range(num_images):
+            detections  = all_detections[i][label]
+            annotations = all_annotations[i][label]
+            end         = offset + detections.shape[0]
+
+            image_true_positives, assigned_annotations = _match_detections(detections, annotations, iou_thresholds)
+            scores[offset:end]            = detections[:, 4]
+            true_positives[:, offset:end] = image_true_positives
+
+            detection_areas  = _compute_areas(detections)
+            annotation_areas = _compute_areas(annotations)
+
+            for area, (min_area, max_area) in AREA_RANGES.items():
+                annotations_in_range = (annotation_areas >= min_area) & (annotation_areas < max_area)
+                detections_in_range  = (detection_areas >= min_area) & (detection_areas < max_area)
+                num_annotations[area] += np.sum(annotations_in_range)
+
+                # true positives are counted by the size of their annotation, false positives by their own size
+                if annotations.shape[0]:
+                    matches_in_range = annotations_in_range[assigned_annotations]
+                    counted[area][:, offset:end] = np.where(image_true_positives, matches_in_range, detections_in_range)
+                else:
+                    counted[area][:, offset:end] = detections_in_range
+
+            offset = end
+
+        # sort by score
+        indices        = np.argsort(-scores)
+        true_positives = true_positives[:, indices]
+
+        for area in AREA_RANGES:
+            # If no annotations then AP is left out
+            if num_annotations[area] == 0:
+                continue
+
+            area_counted = counted[area][:, indices]
+            for t in range(num_thresholds):
+                average_precisions[area][label, t] = _compute_ap_from_matches(
+                    true_positives[t] & area_counted[t],
+                    ~true_positives[t] & area_counted[t],
+                    num_annotations[area]
+                )
+
+    results = {
+        'iou_thresholds'     : iou_thresholds,
+        'average_precisions' : average_precisions,
+        'mAP'                : _mean_ap(average_precisions['all']),
+    }
+
+    for name, iou_threshold in [('AP50', 0.5), ('AP75', 0.75)]:
+        matches = np.flatnonzero(np.isclose(iou_thresholds, iou_threshold))
+        if len(matches):
+            results[name] = _mean_ap(average_precisions['all'][:, matches[0]])
+
+    for area in ['small', 'medium', 'large']:
+        results['AP' + area] = _mean_ap(average_precisions[area])
+
+    return results
@@ -0,0 +1,160 @@
+""" A persistent store of the raw detections and annotations of an evaluation
+
+Inference is the slow part of an evaluation, metrics with other thresholds (iou_threshold, score_threshold,
+max_detections) can be computed again from the stored detections without running the model.
+The store is a .npz file holding one column per value, detections and annotations of all images
+are concatenated and sliced per image with offsets.
+
+The key of a store is a hash of the model weights, the dataset annotations, the evaluated images
+and the way they are loaded, a store is only reused for the same model and dataset.
+"""
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+
+_STORE_VERSION = 2
+
+
+def compute_detection_store_key(model, generator, num_images):
+    """ Computes the key of a store, the key changes if the model weights, dataset, images or loading parameters change
+
+    The dataset is identified by its class and the annotations of the evaluated images,
+    images are identified by their ids and the way they are loaded (resize parameters,
+    resized image store and decode_size_hint).
+
+    Args
+        model      : Model used for inference
+        generator  : Generator of the evaluated dataset
+        num_images : Number of images evaluated (the first num_images of generator.all_image_index)
+
+    Returns
+        The key as a hex string
+
+    """
+    key = hashlib.sha1()
+
+    image_ids   = generator.all_image_index[:num_images]
+    dataset     = generator.dataset
+    image_store = getattr(generator, 'image_store', None)
+
+    key.update(json.dumps({
+        'version'             : _STORE_VERSION,
+        'dataset'             : '{}.{}'.format(type(dataset).__module__, type(dataset).__name__),
+        'min_side'            : getattr(generator, 'image_min_side', None),
+        'max_side'            : getattr(generator, 'image_max_side', None),
+        'resized_image_store' : None if image_store is None else [os.path.abspath(image_store.path), image_store.key],
+        'decode_size_hint'    : bool(getattr(generator, 'decode_size_hint', False)),
+        'image_ids'           : [str(image_id) for image_id in image_ids],
+    }, sort_keys=True).encode('utf-8'))
+
+    for image_id in image_ids:
+        annotations = np.asarray(dataset.get_annotations_array(image_id), dtype=np.float64)
+        key.update(str(annotations.shape).encode('utf-8'))
+        key.update(np.ascontiguousarray(annotations).tobytes())
+
+    for weights in model.get_weights():
+        key.update(np.ascontiguousarray(weights).tobytes())
+
+    return key.hexdigest()
+
+
+class DetectionStore(object):
+    """ Columns of the raw detections and annotations of every evaluated image
+
+    Args
+        key                : Key of the store (see compute_detection_store_key)
+        detection_offsets  : (num_images + 1,) array, detections of image i are rows offsets[i] to offsets[i + 1]
+        boxes              : (N, 4) array of detected boxes in original image coordinates
+        scores             : (N,) array of detection scores
+        labels             : (N,) array of detection labels
+        annotation_offsets : (num_images + 1,) array, annotations of image i are rows offsets[i] to offsets[i + 1]
+        annotations        : (M, 5) array of annotations as [x1, y1, x2, y2, label]
+
+    """
+    def __init__(self, key, detection_offsets, boxes, scores, labels, annotation_offsets, annotations):
+        self.key                = key
+        self.detection_offsets  = np.asarray(detection_offsets, dtype=np.int64)
+        self.boxes              = np.asarray(boxes, dtype=np.float32).reshape((-1, 4))
+        self.scores             = np.asarray(scores, dtype=np.float32)
+        self.labels             = np.asarray(labels, dtype=np.int32)
+        self.annotation_offsets = np.asarray(annotation_offsets, dtype=np.int64)
+        self.annotations        = np.asarray(annotations, dtype=np.float64).reshape((-1, 5))
+
+    def get_detections(self, i):
+        """ Returns the boxes, scores and labels of the detections of image i """
+        start, end = self.detection_offsets[i], self.detection_offsets[i + 1]
+        return self.boxes[start:end], self.scores[start:end], self.labels[start:end]
+
+    def get_annotations(self, i):
+        """ Returns the (K, 5) annotations of image i """
+        return self.annotations[self.annotation_offsets[i]:self.annotation_offsets[i + 1]]
+
+    def save(self, path):
+        """ Writes the store to path (written to a temporary file first so that an interrupted save is never read) """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                key                = self.key,
+                detection_offsets  = self.detection_offsets,
+                boxes              = self.boxes,
+                scores             = self.scores,
+                labels             = self.labels,
+                annotation_offsets = self.annotation_offsets,
+                annotations        = self.annotations
+            )
+        os.rename(temp_path, path)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """ Reads a store from path, returns None if key is given and the store was built with another key """
+        with np.load(path) as data:
+            if key is not None and str(data['key']) != key:
+                return None
+            return cls(
+                str(data['key']),
+                data['detection_offsets'],
+                data['boxes'],
+                data['scores'],
+                data['labels'],
+                data['annotation_offsets'],
+                data['annotations']
+            )
+
+    def __len__(self):
+        return len(self.detection_offsets) - 1
+
+
+def build_detection_store(key, boxes_group, scores_group, labels_group, annotations_group):
+    """ Concatenates the detections and annotations of every image into a DetectionStore
+
+    Args
+        key               : Key of the store
+        boxes_group       : List of (D, 4) arrays of detected boxes of every image
+        scores_group      : List of (D,) arrays of detection scores of every image
+        labels_group      : List of (D,) arrays of detection labels of every image
+        annotations_group : List of (K, 5) arrays of annotations of every image
+
+    Returns
+        A DetectionStore
+
+    """
+    detection_offsets  = np.cumsum([0] + [len(scores) for scores in scores_group])
+    annotation_offsets = np.cumsum([0] + [len(annotations) for annotations in annotations_group])
+
+    def concatenate(arrays, shape):
+        return np.concatenate(arrays) if len(arrays) else np.zeros(shape)
+
+    return DetectionStore(
+        key,
+        detection_offsets,
+        concatenate([np.reshape(boxes, (-1, 4)) for boxes in boxes_group], (0, 4)),
+        concatenate(scores_group, (0,)),
+        concatenate(labels_group, (0,)),
+        annotation_offsets,
+        concatenate([np.reshape(annotations, (-1, 5)) for annotations in annotations_group], (0, 5))
+    )
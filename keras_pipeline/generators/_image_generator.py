@@ -5,11 +5,78 @@ https://github.com/keras-team/keras/blob/master/keras/preprocessing/image.py
 import math
 import random
 import threading
+import multiprocessing
+from collections import deque
 
-from ..preprocessing.transform import random_transform_generator
+import numpy as np
+
+from ._sequence import ImageSequence
+from ._shared_memory import SharedBatchRing
+from ..preprocessing.transform import random_transform, random_transform_batch, random_transform_generator
+from ..utils.cache import LRUArrayCache
+from ..datasets.manifest import Manifest
+
+
+# Generator used by the worker processes of a worker pool
+_WORKER_GENERATOR = None
+
+
+def _init_worker(generator, batch_ring):
+    """ Stores the generator in a worker process and gives it a freshly seeded transform generator
+    (forked workers would otherwise all generate the same sequence of transformations)
+    The shared memory ring is passed separately as pickled generators do not keep it
+    """
+    global _WORKER_GENERATOR
+
+    generator.batch_ring = batch_ring
+    if generator.transform_kwargs is not None:
+        generator.transform_generator = generator._seed_transform_generator()
+
+    _WORKER_GENERATOR = generator
+
+
+def _worker_get_batches(group):
+    """ Computes the batch for a group inside of a worker process
+    The batch is pickled before the worker computes another batch, so its buffers can be released right away
+    """
+    inputs, targets = _WORKER_GENERATOR._get_batches_of_transformed_samples(group)
+    _WORKER_GENERATOR.release_batch_buffers(inputs, targets)
+    return inputs, targets
+
+
+def _worker_write_batches(group, slot):
+    """ Computes the batch for a group inside of a worker process and writes it into a shared memory slot
+    Only the shapes of the batch arrays are sent back to the main process
+    """
+    inputs, targets = _WORKER_GENERATOR._get_batches_of_transformed_samples(group)
+    shapes = _WORKER_GENERATOR.batch_ring.write(slot, _flatten_batch(inputs, targets))
+    _WORKER_GENERATOR.release_batch_buffers(inputs, targets)
+    return shapes
+
+
+def _flatten_batch(inputs, targets):
+    """ Flattens a batch into a list of arrays """
+    if isinstance(targets, list):
+        return [inputs] + list(targets)
+    return [inputs, targets]
 
 
 class ImageGenerator(object):
+    # Keyword arguments used to create the transform generator (None if transformations are not allowed)
+    transform_kwargs = None
+
+    # Random state shared by the transform generator and group transformations
+    transform_prng = None
+
+    # Worker pool used when workers > 0, created on the first call to next
+    pool = None
+
+    # Shared memory ring used when use_shared_memory is True, created along with the pool
+    batch_ring = None
+
+    # Pool of reused batch arrays (None if batch arrays are always newly allocated)
+    batch_buffers = None
+
     ###########################################################################
     #### This marks the start of uniquely defined functions
 
@@ -21,9 +88,21 @@ class ImageGenerator(object):
         self.size
         self.shuffle
         self.batch_size
+        self.workers
+        self.max_queue_size
+        self.use_shared_memory
+        self.shared_memory_zero_copy
+        self.decode_size_hint
 
         raise NotImplementedError('__init__ is not defined')
 
+        # Leave out invalid images
+        if config.manifest_path is not None:
+            self._remove_invalid_images(config.manifest_path)
+
+        # Create image cache
+        self.image_cache = self._make_image_cache(config)
+
         # Create transform generator
         self.transform_parameters = config.transform_parameters
         self.transform_generator = None
@@ -36,6 +115,8 @@ class ImageGenerator(object):
         # Tools which helps order the data generated
         self.lock = threading.Lock() # this is to allow for parrallel batch processing
         self.group_index_generator = self._make_index_generator()
+        self.prefetch_queue = deque()
+        self.batches_in_use = deque()
 
     def _validate_dataset(self):
         """ Dataset validator which validates the suitability of the dataset """
@@ -48,8 +129,14 @@ class ImageGenerator(object):
         """ Loads the raw inputs from the dataset """
         raise NotImplementedError('load_Y_group is not defined')
 
-    def preprocess_entry(self, X, Y):
-        """ Preprocesses an entry """
+    def compute_size_hint(self, image_index):
+        """ Compute the (width, height) an image has to be decoded at, used if decode_size_hint is True """
+        raise NotImplementedError('compute_size_hint is not defined')
+
+    def preprocess_entry(self, X, Y, transform=None):
+        """ Preprocesses an entry
+        If transformations are allowed, transform is applied (a random one is drawn if None)
+        """
         raise NotImplementedError('preprocess_entry is not defined')
 
     def compute_inputs(self, X_group):
@@ -60,16 +147,38 @@ class ImageGenerator(object):
         """ Compute the network outputs """
         raise NotImplementedError('compute_targets is not defined')
 
+    def compute_batch_specs(self):
+        """ Compute the largest shapes and dtypes of the network inputs and targets
+        Returned as (input_spec, target_specs) following the structure of (inputs, targets)
+        where each spec is a tuple of (max_shape, dtype)
+        (target_specs is a list if the targets are a list of arrays)
+        """
+        raise NotImplementedError('compute_batch_specs is not defined')
+
     def as_tf_generator(self):
         """ Creates a generator which generates data in a format suitable for tf.data.Dataset.from_generator """
         raise NotImplementedError('as_tf_generator is not defined')
 
+    def as_sequence(self, seed=None):
+        """ Creates a keras.utils.Sequence which can build any batch of an epoch independently
+        Suitable for fit_generator with use_multiprocessing and multiple workers
+
+        Args
+            seed : If provided, the grouping and random transformations of every batch are deterministic
+
+        Returns
+            An ImageSequence wrapping this generator
+
+        """
+        return ImageSequence(self, seed=seed)
+
 
     ###########################################################################
     #### This marks the start of helper functions
 
     def _make_transform_generator(self, config):
-        return random_transform_generator(
+        # Store the transform kwargs so that worker processes can create their own transform generator
+        self.transform_kwargs = dict(
             min_rotation    = config.min_rotation,
             max_rotation    = config.max_rotation,
             min_translation = config.min_translation,
@@ -81,16 +190,81 @@ class ImageGenerator(object):
             flip_x_chance   = config.flip_x_chance,
             flip_y_chance   = config.flip_y_chance,
         )
+        return self._seed_transform_generator()
+
+    def _seed_transform_generator(self):
+        """ Creates a freshly seeded random state and a transform generator drawing from it """
+        self.transform_prng = np.random.RandomState()
+        return random_transform_generator(prng=self.transform_prng, **self.transform_kwargs)
+
+    def _remove_invalid_images(self, manifest_path):
+        """ Removes the images marked as invalid in a manifest from all_image_index """
+        assert hasattr(self.dataset, 'get_image_path'), 'manifest_path requires the dataset to have get_image_path'
+        manifest = Manifest.load(manifest_path)
+
+        self.all_image_index = [image_index for image_index in self.all_image_index
+            if manifest.is_valid(self.dataset.get_image_path(image_index))]
+        self.size = len(self.all_image_index)
+
+    def _make_image_cache(self, config):
+        if not config.image_cache_size:
+            return None
+        return LRUArrayCache(config.image_cache_size)
+
+    def _load_image_from_dataset(self, image_index):
+        if self.decode_size_hint:
+            return self.dataset.load_image(image_index, size_hint=self.compute_size_hint(image_index))
+        return self.dataset.load_image(image_index)
+
+    def _load_image(self, image_index):
+        """ Loads a decoded image from the image cache or the dataset """
+        if self.image_cache is None:
+            return self._load_image_from_dataset(image_index)
+
+        image = self.image_cache.get(image_index)
+        if image is None:
+            image = self._load_image_from_dataset(image_index)
+            self.image_cache.put(image_index, image)
+
+        return image
+
+    def _make_batch_ring(self):
+        """ Creates a shared memory ring with one slot for the batch computed by every worker
+        and one for a finished batch waiting to be read, every slot holds the largest possible batch
+        """
+        self.batch_specs = self.compute_batch_specs()
+        input_spec, target_specs = self.batch_specs
+        return SharedBatchRing(
+            num_slots   = self.workers + 1,
+            array_specs = _flatten_batch(input_spec, target_specs)
+        )
 
-    def _group_image_ids(self):
-        """ Group img_ids according to batch_size """
+    def _unflatten_batch(self, arrays):
+        """ Reverses _flatten_batch based on the structure of the batch specs """
+        _, target_specs = self.batch_specs
+        if isinstance(target_specs, list):
+            return arrays[0], arrays[1:]
+        return arrays[0], arrays[1]
+
+    def _make_worker_pool(self):
+        """ Creates a pool of worker processes, each holding a copy of this generator """
+        return multiprocessing.Pool(
+            self.workers,
+            initializer = _init_worker,
+            initargs    = (self, self.batch_ring)
+        )
+
+    def _group_image_ids(self, prng=random):
+        """ Group img_ids according to batch_size
+        Returns the list of groups, prng is used for all shuffling
+        """
         # Retrieve all image ids and count number of groups
-        img_ids = self.all_image_index
+        img_ids = list(self.all_image_index)
         num_groups = math.ceil(len(img_ids) / self.batch_size)
 
         # Perform shuffling
         if self.shuffle:
-            random.shuffle(img_ids)
+            prng.shuffle(img_ids)
 
         # Group image ids
         groups = []
@@ -99,17 +273,48 @@ class ImageGenerator(object):
             end   = self.batch_size * (group_i + 1)
             groups.append(img_ids[start:end])
 
-        # Save groups
-        self.groups = groups
+        return groups
+
+    def _next_transform(self, prng=None):
+        """ Draws the next random transformation (None if transformations are not allowed)
+        Uses prng if provided instead of the generator's own transform generator
+        """
+        if self.transform_generator is None:
+            return None
+        if prng is None:
+            return next(self.transform_generator)
+        return random_transform(prng=prng, **self.transform_kwargs)
+
+    def _next_transforms(self, n, prng=None):
+        """ Draws the random transformations of a group of n entries at once
+        Uses prng if provided instead of the generator's own random state
+
+        Returns
+            A (n, 3, 3) array of transformations (a list of None if transformations are not allowed)
+
+        """
+        if self.transform_generator is None:
+            return [None] * n
+        if prng is None:
+            prng = self.transform_prng
+        return random_transform_batch(n, prng=prng, **self.transform_kwargs)
 
 
     ###########################################################################
     #### This marks the start of essential functions
 
-    def preprocess_group(self, X_group, Y_group):
+    def load_group(self, group):
+        """ Loads the raw inputs and outputs of a group from the dataset """
+        X_group = self.load_X_group(group)
+        Y_group = self.load_Y_group(group)
+        return X_group, Y_group
+
+    def preprocess_group(self, X_group, Y_group, prng=None):
+        transforms = self._next_transforms(len(X_group), prng=prng)
+
         for index, (X, Y) in enumerate(zip(X_group, Y_group)):
             # Preprocess single group entry
-            X, Y = self.preprocess_entry(X, Y)
+            X, Y = self.preprocess_entry(X, Y, transform=transforms[index])
 
             # Update group
             X_group[index] = X
@@ -117,13 +322,12 @@ class ImageGenerator(object):
 
         return X_group, Y_group
 
-    def _get_batches_of_transformed_samples(self, group):
+    def _get_batches_of_transformed_samples(self, group, prng=None):
         # load group X and Y
-        X_group = self.load_X_group(group)
-        Y_group = self.load_Y_group(group)
+        X_group, Y_group = self.load_group(group)
 
         # perform preprocessing
-        X_group, Y_group = self.preprocess_group(X_group, Y_group)
+        X_group, Y_group = self.preprocess_group(X_group, Y_group, prng=prng)
 
         # compuate network inputs
         inputs = self.compute_inputs(X_group)
@@ -136,7 +340,7 @@ class ImageGenerator(object):
     def _make_index_generator(self):
         """ Returns a generator which yields group index to train the model in """
         # Initialize a grouping order
-        self._group_image_ids()
+        self.groups = self._group_image_ids()
 
         # start group_index at -1 so that first group_index returned is 0
         num_groups = len(self.groups)
@@ -148,16 +352,123 @@ class ImageGenerator(object):
                 group_index += 1
             else:
                 if self.shuffle:
-                    self._group_image_ids()
+                    self.groups = self._group_image_ids()
                 group_index = 0
             yield group_index
 
+    def _next_from_pool(self):
+        """ Returns the next batch computed by the worker pool
+        The next max_queue_size groups are always being computed in the background
+        and batches are returned in the same order as their groups
+
+        If use_shared_memory is True, workers write batches into shared memory slots,
+        only as many groups as there are free slots (workers + 1) are computed ahead.
+        Batches are copied out of their slot which is then released immediately,
+        unless shared_memory_zero_copy is True in which case the returned arrays are views into the slot
+        and the slot is only reused after the consumer calls release_batch
+        """
+        with self.lock:
+            if self.pool is None:
+                if self.use_shared_memory:
+                    self.batch_ring = self._make_batch_ring()
+                self.pool = self._make_worker_pool()
+
+            # Fill up the prefetch queue (only as far as there are free slots)
+            while len(self.prefetch_queue) < self.max_queue_size:
+                if self.use_shared_memory and not len(self.batch_ring.free_slots):
+                    break
+
+                group_index = next(self.group_index_generator)
+                group = self.groups[group_index]
+
+                if self.use_shared_memory:
+                    slot = self.batch_ring.acquire()
+                    result = self.pool.apply_async(_worker_write_batches, (group, slot))
+                else:
+                    slot = None
+                    result = self.pool.apply_async(_worker_get_batches, (group,))
+
+                self.prefetch_queue.append((slot, result))
+
+            if not len(self.prefetch_queue):
+                raise RuntimeError('All shared memory slots are held by returned batches, ' + \
+                    'call release_batch once a batch is no longer in use')
+
+            slot, result = self.prefetch_queue.popleft()
+            if slot is not None and self.shared_memory_zero_copy:
+                self.batches_in_use.append(slot)
+
+        if slot is None:
+            return result.get()
+
+        arrays = self.batch_ring.get_arrays(slot, result.get())
+        if self.shared_memory_zero_copy:
+            return self._unflatten_batch(arrays)
+
+        # Copy the batch out so that the slot can be written to again right away
+        arrays = [np.array(array) for array in arrays]
+        with self.lock:
+            self.batch_ring.release(slot)
+        return self._unflatten_batch(arrays)
+
+    def release_batch(self):
+        """ Releases the shared memory slot of the oldest batch returned as views (shared_memory_zero_copy only)
+        Batches are released in the order they were returned, the views of a released batch must no longer be used
+        """
+        with self.lock:
+            assert len(self.batches_in_use), 'There are no batches to release'
+            self.batch_ring.release(self.batches_in_use.popleft())
+
+    def release_batch_buffers(self, inputs, targets):
+        """ Gives the arrays of a batch back to the batch buffer pool so that they can be reused for later batches
+        Only needed if reuse_batch_buffers is True, the arrays of a released batch must no longer be used
+        """
+        if self.batch_buffers is None:
+            return
+        for array in _flatten_batch(inputs, targets):
+            self.batch_buffers.release(array)
+
     def next(self):
+        if self.workers > 0:
+            return self._next_from_pool()
+
         with self.lock:
             group_index = next(self.group_index_generator)
             group = self.groups[group_index]
         return self._get_batches_of_transformed_samples(group)
 
+    def close(self):
+        """ Terminates the worker pool (if any) and discards all prefetched batches """
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+            self.prefetch_queue.clear()
+            self.batches_in_use.clear()
+            self.batch_ring = None
+
+    def __getstate__(self):
+        # Locks, generators, pools and shared memory can not be pickled
+        # they are recreated in __setstate__, pools and shared memory lazily on the next call to next
+        state = self.__dict__.copy()
+        for attr in ['lock', 'group_index_generator', 'transform_generator', 'transform_prng', 'pool', 'batch_ring', 'prefetch_queue', 'batches_in_use']:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.group_index_generator = self._make_index_generator()
+        self.prefetch_queue = deque()
+        self.batches_in_use = deque()
+        self.pool = None
+        self.batch_ring = None
+        self.transform_prng = None
+        self.transform_generator = None
+        if self.transform_kwargs is not None:
+            self.transform_generator = self._seed_transform_generator()
+
     def __len__(self):
         return self.size
 
@@ -0,0 +1,46 @@
+""" keras.utils.Sequence adapter for the ImageGenerator """
+
+import numpy as np
+
+import keras
+
+
+class ImageSequence(keras.utils.Sequence):
+    """ Index addressable view of an ImageGenerator
+
+    Every batch is built from a group computed by the generator's _group_image_ids.
+    Batches do not share any state, each one is computed with its own random number generator,
+    which allows keras to build batches in parallel with multiple workers.
+
+    Args
+        generator : An ImageGenerator (eg. DetectionGenerator or ImageClassGenerator)
+        seed      : If provided, the groups and random transformations of each (epoch, batch index)
+                    are deterministic, otherwise they are randomly seeded
+
+    """
+    def __init__(self, generator, seed=None):
+        self.generator = generator
+        self.seed      = seed
+        self.epoch     = 0
+        self.groups    = self._make_groups()
+
+    def _make_prng(self, *keys):
+        """ Creates a random number generator seeded based on self.seed and keys """
+        if self.seed is None:
+            return np.random.RandomState()
+        return np.random.RandomState([self.seed] + list(keys))
+
+    def _make_groups(self):
+        return self.generator._group_image_ids(prng=self._make_prng(self.epoch))
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __getitem__(self, index):
+        group = self.groups[index]
+        prng  = self._make_prng(self.epoch, index)
+        return self.generator._get_batches_of_transformed_samples(group, prng=prng)
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.groups = self._make_groups()
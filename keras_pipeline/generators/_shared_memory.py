@@ -0,0 +1,83 @@
+""" Shared memory transport of batches between worker processes and the main process """
+
+import ctypes
+import multiprocessing
+from collections import deque
+
+import numpy as np
+
+
+class SharedBatchRing(object):
+    """ A ring of preallocated batch slots in shared memory
+
+    Every slot holds one buffer per batch array (eg. images, labels and regression)
+    large enough to store the largest batch that can be generated.
+    Worker processes write batches directly into a slot and the main process
+    reads them back as zero-copy numpy views.
+
+    The ring has to be created before the worker processes are started,
+    the shared buffers can only be passed to workers through inheritance.
+
+    Args
+        num_slots   : Number of batch slots in the ring
+        array_specs : List of (max_shape, dtype) for each array in a batch
+
+    """
+    def __init__(self, num_slots, array_specs):
+        self.num_slots   = num_slots
+        self.array_specs = [(tuple(int(d) for d in shape), np.dtype(dtype)) for shape, dtype in array_specs]
+
+        # Allocate the shared buffers of every slot
+        self.buffers = [
+            [multiprocessing.RawArray(ctypes.c_char, int(np.prod(shape)) * dtype.itemsize)
+                for shape, dtype in self.array_specs]
+            for slot in range(num_slots)
+        ]
+
+        # Slots which are not written to by workers or in use by the consumer
+        # only tracked in the main process
+        self.free_slots = deque(range(num_slots))
+
+    def acquire(self):
+        """ Reserves a free slot and returns its index """
+        assert len(self.free_slots), 'No free slots left in SharedBatchRing, release slots before acquiring new ones'
+        return self.free_slots.popleft()
+
+    def release(self, slot):
+        """ Returns a slot to the ring so that it can be written to again """
+        self.free_slots.append(slot)
+
+    def get_arrays(self, slot, shapes):
+        """ Returns zero-copy views of the arrays stored in a slot
+
+        Args
+            slot   : Index of the slot
+            shapes : List of shapes of the arrays written to the slot
+
+        Returns
+            List of np.ndarray views into the shared buffers of the slot
+
+        """
+        arrays = []
+        for buffer, (max_shape, dtype), shape in zip(self.buffers[slot], self.array_specs, shapes):
+            assert len(shape) == len(max_shape) and all(d <= m for d, m in zip(shape, max_shape)), \
+                'Array of shape {} does not fit in slot of shape {}'.format(shape, max_shape)
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(buffer, dtype=dtype, count=count).reshape(shape))
+        return arrays
+
+    def write(self, slot, arrays):
+        """ Copies arrays into a slot, done by the worker processes
+
+        Args
+            slot   : Index of the slot
+            arrays : List of arrays to write, must follow array_specs
+
+        Returns
+            The shapes of the arrays written, used to read them back with get_arrays
+
+        """
+        shapes = [tuple(array.shape) for array in arrays]
+        for view, array in zip(self.get_arrays(slot, shapes), arrays):
+            view[...] = array
+        return shapes
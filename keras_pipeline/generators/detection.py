@@ -6,27 +6,42 @@ import math
 import numpy as np
 import random
 import threading
+import multiprocessing
+from collections import deque
 
 import keras
 
 from ._image_generator import ImageGenerator
 
 from ..utils.anchors import (
-    anchor_targets_bbox,
+    AnchorCache,
     bbox_transform,
-    compute_all_anchors
+    compact_anchor_targets_bbox,
+    compute_anchor_labels,
+    compute_anchor_states
 )
 
 from ..preprocessing.image_transform import (
     adjust_transform_for_image,
     apply_transform,
+    compute_resize_scale,
+    compute_resize_transform,
     resize_image_1
 )
 
-from ..preprocessing.transform import transform_aabb
+from ..preprocessing.transform import transform_aabbs
+from ..utils.cache import BatchBufferPool
+from ..preprocessing.image_store import open_resized_image_store
+from ..datasets.image_index import open_image_index
 
 
 class DetectionGenerator(ImageGenerator):
+    # Predicted resized (height, width) of images, filled in as images are grouped
+    predicted_shapes = None
+
+    # Fraction of batch pixels which are image pixels in the current grouping (only computed for group_method bucket)
+    padding_efficiency = None
+
     def __init__(self, config):
         # Store general dataset info
         self.dataset         = config.dataset
@@ -35,13 +50,59 @@ class DetectionGenerator(ImageGenerator):
         self.num_classes     = config.dataset.get_num_classes()
         self.label_to_name   = config.dataset.label_to_name
 
+        # Leave out invalid images
+        if config.manifest_path is not None:
+            self._remove_invalid_images(config.manifest_path)
+
         # Typical generator config
         self.batch_size     = config.batch_size
+        self.pixel_budget   = config.batch_pixel_budget
         self.image_min_side = config.image_min_side
         self.image_max_side = config.image_max_side
         self.group_method   = config.group_method
+        self.bucket_stride  = config.bucket_stride or min(32, max(config.anchor_strides))
         self.shuffle        = config.shuffle_groups
 
+        # Target config
+        self.compact_targets = config.compact_targets
+
+        # Preprocessing config
+        self.fused_transform = config.fused_transform
+        self.image_dtype     = config.image_dtype or keras.backend.floatx()
+
+        # Decoding config
+        self.decode_size_hint = config.decode_size_hint
+
+        # Parallel processing config
+        self.workers                 = config.workers
+        self.max_queue_size          = config.max_queue_size
+        self.use_shared_memory       = config.use_shared_memory
+        self.shared_memory_zero_copy = config.shared_memory_zero_copy
+
+        # Open index of image sizes
+        self.image_index = None
+        if config.image_index_path is not None:
+            self.image_index = open_image_index(self.dataset, config.image_index_path, image_ids=self.all_image_index)
+
+        # Create image cache
+        self.image_cache = self._make_image_cache(config)
+
+        # Create pool of reused batch buffers
+        self.batch_buffers = None
+        if config.reuse_batch_buffers:
+            self.batch_buffers = BatchBufferPool()
+
+        # Open store of pre-resized images
+        self.image_store = None
+        if config.resized_image_store_path is not None:
+            self.image_store = open_resized_image_store(
+                self.dataset,
+                config.resized_image_store_path,
+                min_side  = self.image_min_side,
+                max_side  = self.image_max_side,
+                image_ids = self.all_image_index
+            )
+
         # Create transform generator
         self.transform_parameters = config.transform_parameters
         self.transform_generator = None
@@ -55,13 +116,24 @@ class DetectionGenerator(ImageGenerator):
         self.anchor_scales  = config.anchor_scales
         self.compute_pyramid_feature_shapes_for_img_shape = \
             config.compute_pyramid_feature_shapes_for_img_shape
+        self.anchor_cache = AnchorCache(
+            config.anchor_cache_size,
+            sizes           = self.anchor_sizes,
+            strides         = self.anchor_strides,
+            ratios          = self.anchor_ratios,
+            scales          = self.anchor_scales,
+            shapes_callback = self.compute_pyramid_feature_shapes_for_img_shape,
+        )
 
         # Validate dataset
         self._validate_dataset()
+        self.max_batch_size = self.compute_max_batch_size()
 
         # Tools which helps order the data generated
         self.lock = threading.Lock() # this is to allow for parrallel batch processing
         self.group_index_generator = self._make_index_generator()
+        self.prefetch_queue = deque()
+        self.batches_in_use = deque()
 
 
     ###########################################################################
@@ -69,7 +141,7 @@ class DetectionGenerator(ImageGenerator):
 
     def _validate_dataset(self):
         """ Dataset validator which validates the suitability of the dataset """
-        img_id = self.dataset.list_all_image_index()[0]
+        img_id = self.all_image_index[0]
 
         size         = self.dataset.get_size()
         num_classes  = self.dataset.get_num_classes()
@@ -81,46 +153,213 @@ class DetectionGenerator(ImageGenerator):
         img = self.dataset.load_image(img_id)
         assert (len(img.shape) == 3) and (img.shape[-1] == 3), 'img is of wrong shape, got {}'.format(img.shape)
 
+        if self.decode_size_hint:
+            assert hasattr(self.dataset, 'get_image_size'), 'decode_size_hint requires the dataset to have get_image_size'
+            self.dataset.load_image(img_id, size_hint=self.compute_size_hint(img_id))
+
         ann = self.dataset.get_annotations_array(img_id)
         assert ann.shape[1] == 5, 'get_annotations_array should return a (None, 5) shaped array, got {}'.format(ann.shape)
 
         self.dataset.label_to_name(num_classes - 1)
 
-    def _group_image_ids(self):
-        """ Group img_ids according to batch_size and group_method """
-        # Retrieve all image ids and count number of groups
-        img_ids = self.all_image_index
-        num_groups = math.ceil(len(img_ids) / self.batch_size)
+    def _group_image_ids(self, prng=random):
+        """ Group img_ids according to batch_size and group_method
+        Returns the list of groups, prng is used for all shuffling
+        """
+        # Retrieve all image ids
+        img_ids = list(self.all_image_index)
 
         # Perform grouping
         if self.group_method == 'random':
-            random.shuffle(img_ids)
+            prng.shuffle(img_ids)
         elif self.group_method == 'ratio':
-            img_ids.sort(key=lambda x: self.dataset.get_image_aspect_ratio(x))
+            img_ids = self._sort_image_ids_by_ratio(img_ids)
 
         # Group image ids
-        groups = []
-        for group_i in range(num_groups):
-            start = self.batch_size * group_i
-            end   = self.batch_size * (group_i + 1)
-            groups.append(img_ids[start:end])
+        if self.group_method == 'bucket':
+            groups = self._group_image_ids_by_bucket(img_ids, prng=prng)
+        else:
+            groups = self._split_image_ids(img_ids)
 
         # Perform shuffing
         if self.shuffle:
-            random.shuffle(groups)
+            prng.shuffle(groups)
+
+        # Predicting the shape of every image on every reshuffle is costly, only bucket grouping reports it
+        if self.group_method == 'bucket':
+            self.padding_efficiency = self.compute_padding_efficiency(groups)
+
+        return groups
+
+    def _sort_image_ids_by_ratio(self, img_ids):
+        if self.image_index is None:
+            return sorted(img_ids, key=lambda x: self.dataset.get_image_aspect_ratio(x))
+
+        # Grouping all images in ratio order reuses the order sorted when the index was loaded
+        if list(img_ids) == self.image_index.image_ids:
+            return list(self.image_index.ratio_order)
+
+        rows  = [self.image_index.rows[image_index] for image_index in img_ids]
+        order = np.argsort(self.image_index.aspect_ratio[rows], kind='mergesort')
+        return [img_ids[i] for i in order]
+
+    def _group_image_ids_by_bucket(self, img_ids, prng=random):
+        """ Groups images within buckets of the same snapped resized shape """
+        buckets = {}
+        for image_index in img_ids:
+            bucket_shape = self.snap_shape(self.predict_resized_shape(image_index))
+            buckets.setdefault(bucket_shape, []).append(image_index)
+
+        groups = []
+        for bucket_shape in sorted(buckets.keys()):
+            bucket_ids = buckets[bucket_shape]
+            if self.shuffle:
+                prng.shuffle(bucket_ids)
+            groups += self._split_image_ids(bucket_ids)
+
+        return groups
+
+    def _split_image_ids(self, img_ids):
+        """ Splits ordered img_ids into groups of batch_size images
+        or groups within the pixel budget if batch_pixel_budget is provided
+        """
+        if self.pixel_budget is None:
+            return [img_ids[start:start + self.batch_size] for start in range(0, len(img_ids), self.batch_size)]
+
+        groups = []
+        group  = []
+        max_height, max_width = 0, 0
+
+        for image_index in img_ids:
+            height, width = self.snap_shape(self.predict_resized_shape(image_index))
+            height, width = max(max_height, height), max(max_width, width)
+
+            # Start a new group if the image does not fit in the budget
+            if group and (len(group) + 1) * height * width > self.pixel_budget:
+                groups.append(group)
+                group = []
+                height, width = self.snap_shape(self.predict_resized_shape(image_index))
+
+            group.append(image_index)
+            max_height, max_width = height, width
+
+        if group:
+            groups.append(group)
+
+        return groups
+
+    def compute_max_batch_size(self):
+        """ Computes the largest number of images a group can hold """
+        if self.pixel_budget is None:
+            return self.batch_size
+
+        if self.image_index is not None:
+            # The image index covers all_image_index, all shapes are predicted at once from its size columns
+            heights, widths = self.predict_snapped_shapes(self.image_index.height, self.image_index.width)
+            min_pixels = int(np.min(heights * widths))
+        else:
+            min_pixels = min(
+                height * width for height, width in
+                (self.snap_shape(self.predict_resized_shape(image_index)) for image_index in self.all_image_index)
+            )
+        return max(1, self.pixel_budget // min_pixels)
+
+    def predict_snapped_shapes(self, heights, widths):
+        """ Vectorized snap_shape(predict_resized_shape) of images of the given heights and widths
+
+        Args
+            heights : (N,) array of image heights
+            widths  : (N,) array of image widths
+
+        Returns
+            (N,) arrays of the resized (and snapped) heights and widths
+
+        """
+        heights = np.asarray(heights, dtype=np.float64)
+        widths  = np.asarray(widths, dtype=np.float64)
+
+        # Same as compute_resize_scale
+        smallest_side = np.minimum(heights, widths)
+        largest_side  = np.maximum(heights, widths)
+        scale = self.image_min_side / smallest_side
+        scale = np.where(largest_side * scale > self.image_max_side, self.image_max_side / largest_side, scale)
+
+        heights = np.round(heights * scale).astype(np.int64)
+        widths  = np.round(widths * scale).astype(np.int64)
+
+        if self.group_method == 'bucket':
+            stride  = self.bucket_stride
+            heights = -(-heights // stride) * stride
+            widths  = -(-widths // stride) * stride
 
-        # Save groups
-        self.groups = groups
+        return heights, widths
+
+    def predict_resized_shape(self, image_index):
+        """ Predicts the (height, width) of an image after resizing without loading it
+        Uses the image index or get_image_size if the dataset has it, otherwise the aspect ratio (width / height)
+        """
+        if self.predicted_shapes is None:
+            self.predicted_shapes = {}
+
+        shape = self.predicted_shapes.get(image_index)
+        if shape is None:
+            if self.image_index is not None or hasattr(self.dataset, 'get_image_size'):
+                width, height = self.get_image_size(image_index)
+            else:
+                width, height = self.dataset.get_image_aspect_ratio(image_index), 1.0
+
+            scale = compute_resize_scale(height, width, min_side=self.image_min_side, max_side=self.image_max_side)
+            shape = (int(round(height * scale)), int(round(width * scale)))
+            self.predicted_shapes[image_index] = shape
+
+        return shape
+
+    def snap_shape(self, shape):
+        """ Rounds the (height, width) of shape up to multiples of bucket_stride if group_method is bucket """
+        if self.group_method != 'bucket':
+            return tuple(shape)
+        stride = self.bucket_stride
+        return tuple(int(math.ceil(x / stride)) * stride for x in shape[:2]) + tuple(shape[2:])
+
+    def compute_padding_efficiency(self, groups):
+        """ Computes the fraction of batch pixels which are image pixels (rather than padding)
+        based on the predicted resized shapes of the images of every group
+        """
+        image_pixels = 0
+        batch_pixels = 0
+        for group in groups:
+            shapes = [self.predict_resized_shape(image_index) for image_index in group]
+            max_height, max_width = self.snap_shape((max(shape[0] for shape in shapes), max(shape[1] for shape in shapes)))
+
+            image_pixels += sum(shape[0] * shape[1] for shape in shapes)
+            batch_pixels += len(group) * max_height * max_width
+
+        return image_pixels / max(batch_pixels, 1)
+
+    def compute_anchor_set(self, image_shape):
+        """ Returns the (cached) AnchorSet of image_shape """
+        return self.anchor_cache.get(image_shape)
 
     def compute_anchors(self, image_shape):
-        return compute_all_anchors(
-            image_shape,
-            sizes = self.anchor_sizes,
-            strides = self.anchor_strides,
-            ratios = self.anchor_ratios,
-            scales = self.anchor_scales,
-            shapes_callback = self.compute_pyramid_feature_shapes_for_img_shape,
-        )
+        return self.compute_anchor_set(image_shape).anchors
+
+    def compute_batch_specs(self):
+        # Resized images never have a side larger than max(image_min_side, image_max_side)
+        max_side    = max(self.image_min_side, self.image_max_side)
+        max_shape   = self.snap_shape((max_side, max_side, 3))
+        num_anchors = self.compute_anchors(max_shape).shape[0]
+
+        input_spec   = ((self.max_batch_size,) + max_shape, self.image_dtype)
+        target_specs = [
+            ((self.max_batch_size, num_anchors, self.num_classes), keras.backend.floatx()),
+            ((self.max_batch_size, num_anchors, 5), keras.backend.floatx())
+        ]
+
+        # At most every anchor is positive
+        if self.compact_targets:
+            target_specs[0] = ((self.max_batch_size, num_anchors, 2), np.int32)
+
+        return input_spec, target_specs
 
     def as_tf_generator(self):
         """ Creates a generator which generates data in a format suitable for tf.data.Dataset.from_generator """
@@ -128,20 +367,198 @@ class DetectionGenerator(ImageGenerator):
             image_batch, (labels_batch, regression_batch) = self.next()
             yield image_batch, labels_batch, regression_batch
 
+    def as_tf_dataset(self, num_parallel_calls=None, prefetch_size=None):
+        """ Creates a tf.data.Dataset which computes batches with parallel map stages
+
+        Images are loaded and preprocessed individually by a parallel map,
+        then padded into batches and the targets of each batch are computed by a second parallel map.
+        Groups follow the same order as the generator, groups smaller than batch_size
+        are filled up with images from the first group of the epoch.
+
+        Args
+            num_parallel_calls : Number of elements processed in parallel in each map stage
+                                 (defaults to workers or the number of cpus if workers is 0)
+            prefetch_size      : Number of batches to prefetch (defaults to max_queue_size)
+
+        Returns
+            A tf.data.Dataset with elements (image_batch, (labels_batch, regression_batch))
+
+        """
+        import tensorflow as tf
+
+        assert self.pixel_budget is None, 'as_tf_dataset requires batches of batch_size images, batch_pixel_budget is not supported'
+
+        if num_parallel_calls is None:
+            num_parallel_calls = self.workers or multiprocessing.cpu_count()
+        if prefetch_size is None:
+            prefetch_size = self.max_queue_size
+
+        floatx = keras.backend.floatx()
+        labels_dtype, labels_channels = floatx, self.num_classes
+        if self.compact_targets:
+            labels_dtype, labels_channels = tf.int32, 2
+
+        def load_entry(position):
+            image, annotations = self._tf_load_entry(position)
+            return image, annotations, np.array(image.shape, dtype=np.int32)
+
+        def compute_targets(annotations_batch, image_shapes, max_shape):
+            return self._tf_compute_targets(annotations_batch, image_shapes, max_shape)
+
+        # Stage 1 : load and preprocess each image in parallel
+        dataset = tf.data.Dataset.from_generator(self._tf_position_generator, tf.int64, tf.TensorShape([]))
+        dataset = dataset.map(
+            lambda position: tuple(tf.py_func(load_entry, [position], [self.image_dtype, floatx, tf.int32])),
+            num_parallel_calls=num_parallel_calls
+        )
+
+        # Stage 2 : pad each group into a batch
+        # annotations are padded with -1 so that padding can be removed again
+        dataset = dataset.padded_batch(
+            self.batch_size,
+            padded_shapes  = ([None, None, 3], [None, 5], [3]),
+            padding_values = (
+                tf.constant(0, dtype=self.image_dtype),
+                tf.constant(-1, dtype=floatx),
+                tf.constant(0, dtype=tf.int32)
+            )
+        )
+
+        # Stage 3 : compute the targets of each batch in parallel
+        def compute_batch_targets(image_batch, annotations_batch, image_shapes):
+            # Pad batches up to multiples of bucket_stride
+            if self.group_method == 'bucket':
+                batch_shape = tf.shape(image_batch)
+                pad_height  = (self.bucket_stride - batch_shape[1] % self.bucket_stride) % self.bucket_stride
+                pad_width   = (self.bucket_stride - batch_shape[2] % self.bucket_stride) % self.bucket_stride
+                image_batch = tf.pad(image_batch, [[0, 0], [0, pad_height], [0, pad_width], [0, 0]])
+
+            labels_batch, regression_batch = tf.py_func(
+                compute_targets,
+                [annotations_batch, image_shapes, tf.shape(image_batch)[1:]],
+                [labels_dtype, floatx]
+            )
+
+            image_batch.set_shape([self.batch_size, None, None, 3])
+            labels_batch.set_shape([self.batch_size, None, labels_channels])
+            regression_batch.set_shape([self.batch_size, None, 5])
+
+            return image_batch, (labels_batch, regression_batch)
+
+        dataset = dataset.map(compute_batch_targets, num_parallel_calls=num_parallel_calls)
+
+        return dataset.prefetch(prefetch_size)
+
+
+    ###########################################################################
+    #### This marks the start of as_tf_dataset helper functions
+
+    def _tf_position_generator(self):
+        """ Yields the positions of images in all_image_index in group order
+        Every group is filled up to batch_size so that tf.data can batch a fixed number of images
+        """
+        groups = self._group_image_ids()
+        positions = {image_index: position for position, image_index in enumerate(self.all_image_index)}
+
+        while True:
+            for group in groups:
+                group = list(group)
+                while len(group) < self.batch_size:
+                    group += groups[0][:self.batch_size - len(group)]
+
+                for image_index in group:
+                    yield positions[image_index]
+
+            if self.shuffle:
+                groups = self._group_image_ids()
+
+    def _tf_load_entry(self, position):
+        """ Loads and preprocesses a single image, called from the parallel tf.data map """
+        image_index = self.all_image_index[position]
+        image_group, annotations_group = self.load_group([image_index])
+        image, annotations = image_group[0], annotations_group[0]
+
+        # The transform generator can not be shared by parallel calls so every entry uses its own prng
+        transform = self._next_transform(np.random.RandomState())
+        image, annotations = self.preprocess_entry(image, annotations, transform=transform)
+
+        return image.astype(self.image_dtype), annotations.astype(keras.backend.floatx())
+
+    def _tf_compute_targets(self, annotations_batch, image_shapes, max_shape):
+        """ Computes the targets of a padded batch, called from the parallel tf.data map """
+        # Remove the annotations padding
+        annotations_group = [annotations[annotations[:, 4] >= 0] for annotations in annotations_batch]
+        image_shapes      = [tuple(image_shape) for image_shape in image_shapes]
+
+        return self.compute_targets_for_shapes(tuple(max_shape), image_shapes, annotations_group)
+
 
     ###########################################################################
     #### This marks the start of _get_batches_of_transformed_samples helper functions
 
     def load_X_group(self, group):
-        """ Loads the raw group images from the dataset """
-        return [self.dataset.load_image(image_index) for image_index in group]
+        """ Loads the raw group images from the dataset
+        If a resized image store is used, images are already resized
+        """
+        if self.image_store is not None:
+            return [self.image_store.load_image(image_index) for image_index in group]
+        return [self._load_image(image_index) for image_index in group]
 
     def load_Y_group(self, group):
         """ Loads the raw group annotations from the dataset
         Annotations are of the shape (None, 5),
         each detection is in the format (x1, y1, x2, y2, class)
+        If a resized image store is used, annotations are scaled to the resized images
         """
-        return [self.dataset.get_annotations_array(image_index) for image_index in group]
+        annotations_group = [self.dataset.get_annotations_array(image_index) for image_index in group]
+
+        if self.image_store is not None:
+            for index, (image_index, annotations) in enumerate(zip(group, annotations_group)):
+                annotations = annotations.astype(keras.backend.floatx())
+                annotations[:, :4] *= self.image_store.get_scale(image_index)
+                annotations_group[index] = annotations
+
+        return annotations_group
+
+    def get_image_size(self, image_index):
+        """ Returns the (width, height) of an image from the image index if available, otherwise from the dataset """
+        if self.image_index is not None:
+            return self.image_index.get_image_size(image_index)
+        return self.dataset.get_image_size(image_index)
+
+    def compute_size_hint(self, image_index):
+        """ Compute the size the image will be resized to by resize_image """
+        width, height = self.get_image_size(image_index)
+        scale = compute_resize_scale(height, width, min_side=self.image_min_side, max_side=self.image_max_side)
+        return width * scale, height * scale
+
+    def get_load_scale(self, image_index, image):
+        """ Returns the (x, y) scale from the original image to the image returned by load_group
+        Loaded images are smaller than the original ones if read from a resized image store or decoded with a size hint
+        """
+        if self.image_store is not None:
+            scale = self.image_store.get_scale(image_index)
+            return scale, scale
+
+        if self.decode_size_hint:
+            width, height = self.get_image_size(image_index)
+            return image.shape[1] / width, image.shape[0] / height
+
+        return 1.0, 1.0
+
+    def load_group(self, group):
+        image_group, annotations_group = super(DetectionGenerator, self).load_group(group)
+
+        # Images may have been decoded at a reduced resolution, scale annotations accordingly
+        if self.decode_size_hint and self.image_store is None:
+            for index, (image_index, image, annotations) in enumerate(zip(group, image_group, annotations_group)):
+                x_scale, y_scale = self.get_load_scale(image_index, image)
+                annotations = annotations.astype(keras.backend.floatx())
+                annotations[:, [0, 2]] *= x_scale
+                annotations[:, [1, 3]] *= y_scale
+                annotations_group[index] = annotations
+
+        return image_group, annotations_group
 
     def filter_annotations(self, image, annotations):
         assert isinstance(annotations, np.ndarray)
@@ -161,28 +578,32 @@ class DetectionGenerator(ImageGenerator):
 
         return image, annotations
 
-    def random_transform_entry(self, image, annotations):
-        transformation = adjust_transform_for_image(next(self.transform_generator), image, self.transform_parameters.relative_translation)
+    def random_transform_entry(self, image, annotations, transform=None):
+        if transform is None:
+            transform = next(self.transform_generator)
+        transformation = adjust_transform_for_image(transform, image, self.transform_parameters.relative_translation)
 
         # Transform image and annotations
         image = apply_transform(transformation, image, self.transform_parameters)
         annotations = annotations.copy()
-        for index in range(annotations.shape[0]):
-            annotations[index, :4] = transform_aabb(transformation, annotations[index, :4])
+        annotations[:, :4] = transform_aabbs(transformation, annotations[:, :4])
 
         return image, annotations
 
     def resize_image(self, image):
+        # Images loaded from a resized image store are already resized
+        if self.image_store is not None:
+            return image, 1.0
         return resize_image_1(image, min_side=self.image_min_side, max_side=self.image_max_side)
 
-    def preprocess_entry(self, image, annotations):
+    def preprocess_entry(self, image, annotations, transform=None):
         """ Preprocesses an entry """
         # Filter invalid annotations
         image, annotations = self.filter_annotations(image, annotations)
 
         # Apply transformation
         if self.transform_generator:
-            image, annotations = self.random_transform_entry(image, annotations)
+            image, annotations = self.random_transform_entry(image, annotations, transform)
 
         # resize image and annotations
         image, image_scale = self.resize_image(image)
@@ -190,46 +611,177 @@ class DetectionGenerator(ImageGenerator):
 
         return image, annotations
 
+    def compute_fused_transform(self, image, annotations, transform=None):
+        """ Computes the single transformation which applies transform and resizes an image
+        Annotations are transformed and resized accordingly
+
+        Returns
+            The transformation matrix, the annotations and the shape of the generated image
+
+        """
+        # Filter invalid annotations
+        image, annotations = self.filter_annotations(image, annotations)
+        annotations = annotations.astype(keras.backend.floatx())
+
+        # Apply transformation
+        matrix = np.eye(3)
+        if self.transform_generator:
+            if transform is None:
+                transform = next(self.transform_generator)
+            matrix = adjust_transform_for_image(transform, image, self.transform_parameters.relative_translation)
+            annotations[:, :4] = transform_aabbs(matrix, annotations[:, :4])
+
+        # Images loaded from a resized image store are already resized
+        height, width = image.shape[:2]
+        scale = 1.0
+        if self.image_store is None:
+            scale = compute_resize_scale(height, width, min_side=self.image_min_side, max_side=self.image_max_side)
+        annotations[:, :4] *= scale
+
+        matrix = compute_resize_transform(scale).dot(matrix)
+        output_shape = (int(round(height * scale)), int(round(width * scale)), image.shape[2])
+
+        return matrix, annotations, output_shape
+
+    def compute_fused_inputs(self, image_group, matrices, image_shapes, max_shape):
+        """ Warps every image with its fused transformation directly into the image batch """
+        image_batch = self._allocate_batch_array((len(image_group),) + max_shape, self.image_dtype)
+
+        for index, (image, matrix, image_shape) in enumerate(zip(image_group, matrices, image_shapes)):
+            self._zero_padding(image_batch[index], image_shape)
+            output = image_batch[index, :image_shape[0], :image_shape[1], :image_shape[2]]
+
+            # Images which are neither transformed nor resized are only copied
+            if np.allclose(matrix, np.eye(3)) and image.shape == output.shape:
+                output[...] = image
+                continue
+
+            # cv2 only writes into the batch directly if it has the same dtype as the image
+            warped_image = apply_transform(
+                matrix,
+                image,
+                self.transform_parameters,
+                output_shape = image_shape,
+                output       = output if output.dtype == image.dtype else None
+            )
+            if warped_image is not output:
+                output[...] = warped_image
+
+        return image_batch
+
+    def _get_batches_of_transformed_samples(self, group, prng=None):
+        if not self.fused_transform:
+            return super(DetectionGenerator, self)._get_batches_of_transformed_samples(group, prng=prng)
+
+        # load group X and Y
+        image_group, annotations_group = self.load_group(group)
+
+        # compute the fused transformation of every image
+        transforms   = self._next_transforms(len(group), prng=prng)
+        matrices     = [None] * len(group)
+        image_shapes = [None] * len(group)
+        for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
+            matrices[index], annotations_group[index], image_shapes[index] = self.compute_fused_transform(
+                image,
+                annotations,
+                transform = transforms[index]
+            )
+
+        max_shape = self.compute_max_shape(image_shapes)
+
+        # compute network inputs and targets
+        inputs  = self.compute_fused_inputs(image_group, matrices, image_shapes, max_shape)
+        targets = self.compute_targets_for_shapes(max_shape, image_shapes, annotations_group)
+
+        return inputs, targets
+
+    def compute_max_shape(self, image_shapes):
+        """ Compute the shape a batch of images of image_shapes is padded to """
+        max_shape = tuple(max(image_shape[x] for image_shape in image_shapes) for x in range(3))
+        return self.snap_shape(max_shape)
+
+    def _allocate_batch_array(self, shape, dtype):
+        """ Returns an uninitialized batch array, taken from the batch buffer pool if reuse_batch_buffers is True """
+        if self.batch_buffers is None:
+            return np.empty(shape, dtype=dtype)
+        return self.batch_buffers.get(shape, dtype)
+
+    def _zero_padding(self, image, image_shape):
+        """ Zeros the area of a batch entry outside of an image of image_shape in its upper left part """
+        image[image_shape[0]:] = 0
+        image[:image_shape[0], image_shape[1]:] = 0
+
     def compute_inputs(self, image_group):
         # Get the max image shape
-        max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        max_shape = self.compute_max_shape([image.shape for image in image_group])
 
         # Construct an image batch object
-        image_batch = np.zeros((self.batch_size,) + max_shape, dtype=keras.backend.floatx())
+        image_batch = self._allocate_batch_array((len(image_group),) + max_shape, self.image_dtype)
 
         # Copy all images to the upper left part of the image batch object
         for image_index, image in enumerate(image_group):
+            self._zero_padding(image_batch[image_index], image.shape)
             image_batch[image_index, :image.shape[0], :image.shape[1], :image.shape[2]] = image
 
         return image_batch
 
     def compute_targets(self, image_group, annotations_group):
         # Get the max image shape
-        max_shape = tuple(max(image.shape[x] for image in image_group) for x in range(3))
+        max_shape = self.compute_max_shape([image.shape for image in image_group])
 
-        # Compute labels and regression targets
-        labels_group     = [None] * self.batch_size
-        regression_group = [None] * self.batch_size
-        for index, (image, annotations) in enumerate(zip(image_group, annotations_group)):
-            labels_group[index], annotations, anchors = anchor_targets_bbox(
-                max_shape,
-                annotations,
-                self.num_classes,
-                mask_shape = image.shape,
-                compute_anchors = self.compute_anchors
-            )
-            regression_group[index] = bbox_transform(anchors, annotations)
+        return self.compute_targets_for_shapes(max_shape, [image.shape for image in image_group], annotations_group)
+
+    def compute_targets_for_shapes(self, max_shape, image_shapes, annotations_group):
+        """ Compute the network outputs for images of image_shapes padded to max_shape """
+        # All images are padded to max_shape so they share the same anchors
+        anchor_set = self.compute_anchor_set(max_shape)
+        if self.compact_targets:
+            return self.compute_compact_targets(max_shape, image_shapes, annotations_group, anchor_set)
+
+        num_anchors = anchor_set.anchors.shape[0]
+
+        batch_size       = len(image_shapes)
+        labels_batch     = self._allocate_batch_array((batch_size, num_anchors, self.num_classes), keras.backend.floatx())
+        regression_batch = self._allocate_batch_array((batch_size, num_anchors, 5), keras.backend.floatx())
+
+        # Compute labels and regression targets directly into the batch blob
+        for index, (image_shape, annotations) in enumerate(zip(image_shapes, annotations_group)):
+            anchor_states, annotations = compute_anchor_states(anchor_set, annotations, image_shape)
+            compute_anchor_labels(anchor_states, annotations, self.num_classes, labels=labels_batch[index])
+            regression_batch[index, :, :4] = bbox_transform(anchor_set.anchors, annotations)
 
             # append anchor states to regression targets (necessary for filtering 'ignore', 'positive' and 'negative' anchors)
-            anchor_states           = np.max(labels_group[index], axis=1, keepdims=True)
-            regression_group[index] = np.append(regression_group[index], anchor_states, axis=1)
+            regression_batch[index, :, 4] = anchor_states
+
+        return [labels_batch, regression_batch]
+
+    def compute_compact_targets(self, max_shape, image_shapes, annotations_group, anchor_set):
+        """ Compute the network outputs in compact form, refer to the compact_targets config option """
+        num_anchors = anchor_set.anchors.shape[0]
 
-        labels_batch     = np.zeros((self.batch_size,) + labels_group[0].shape, dtype=keras.backend.floatx())
-        regression_batch = np.zeros((self.batch_size,) + regression_group[0].shape, dtype=keras.backend.floatx())
+        # anchor states and classes of every anchor
+        batch_size   = len(image_shapes)
+        labels_batch = self._allocate_batch_array((batch_size, num_anchors, 2), np.int32)
 
-        # copy all labels and regression values to the batch blob
-        for index, (labels, regression) in enumerate(zip(labels_group, regression_group)):
-            labels_batch[index, ...]     = labels
-            regression_batch[index, ...] = regression
+        positives_group = []
+        for index, (image_shape, annotations) in enumerate(zip(image_shapes, annotations_group)):
+            anchor_states, anchor_classes, positive_indices, regression = compact_anchor_targets_bbox(
+                max_shape,
+                annotations,
+                mask_shape = image_shape,
+                anchor_set = anchor_set
+            )
+            labels_batch[index, :, 0] = anchor_states
+            labels_batch[index, :, 1] = anchor_classes
+            positives_group.append((positive_indices, regression))
+
+        # regression targets of positive anchors only, padded with anchor index -1
+        max_positives    = max([1] + [len(positive_indices) for positive_indices, _ in positives_group])
+        regression_batch = np.zeros((batch_size, max_positives, 5), dtype=keras.backend.floatx())
+        regression_batch[:, :, 0] = -1
+
+        for index, (positive_indices, regression) in enumerate(positives_group):
+            regression_batch[index, :len(positive_indices), 0]  = positive_indices
+            regression_batch[index, :len(positive_indices), 1:] = regression
 
         return [labels_batch, regression_batch]
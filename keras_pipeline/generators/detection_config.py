@@ -1,6 +1,7 @@
 from collections import OrderedDict
 
 from ..utils._config_template import ConfigTemplate
+from ..utils._validation import is_positive, is_non_negative
 from ..preprocessing.image_transform import TransformParameters
 
 
@@ -32,12 +33,22 @@ class DetectionGeneratorConfig(ConfigTemplate):
 
         self.add(
             'batch_size',
-            'Number of images to be processed in parallel during training recommended 1 for ' + \
-            'detection due to the high memory cost',
+            'Number of images in every batch. Ignored if batch_pixel_budget is provided, ' + \
+            'groups then hold as many images as fit in the budget (eg. many small images or a single large one). ' + \
+            'Without a pixel budget, memory grows with batch_size x the largest image shape of a batch',
             default = 1,
             accepted_types = 'int-like'
         )
 
+        self.add(
+            'batch_pixel_budget',
+            'If provided, groups are filled with images (in group_method order) as long as the padded batch ' + \
+            'has at most this many pixels (batch images x max height x max width) instead of holding batch_size images. ' + \
+            'Image shapes are predicted from get_image_size or get_image_aspect_ratio',
+            accepted_types = 'int-like',
+            condition = is_positive
+        )
+
         self.add(
             'allow_transform',
             'Flag that allows the generator to perform transformation on images',
@@ -80,6 +91,33 @@ class DetectionGeneratorConfig(ConfigTemplate):
             required = True
         )
 
+        self.add(
+            'fused_transform',
+            'Flag to apply the random transformation and the resize of an image with a single cv2.warpAffine ' + \
+            'which writes directly into the image batch, instead of transforming at full resolution and resizing afterwards. ' + \
+            'Images are then resized with the interpolation of the transform parameters (linear by default)',
+            default = False,
+            accepted_types = bool
+        )
+
+        self.add(
+            'image_dtype',
+            'Data type of the image batches, defaults to keras.backend.floatx(). ' + \
+            'uint8 batches are 4 times smaller than float32 batches, the model has to cast them to float in its first layer ' + \
+            '(eg. a model built with input_dtype=\'uint8\')',
+            valid_options = [None, 'uint8', 'float16', 'float32', 'float64']
+        )
+
+        self.add(
+            'compact_targets',
+            'Flag to compute targets in a compact form, classification targets become (batch, num_anchors, 2) ' + \
+            'arrays of [anchor_state, class] and regression targets become (batch, max_positives, 5) arrays of ' + \
+            '[anchor_index, regression] for positive anchors only (padded with anchor_index -1). ' + \
+            'Requires a model compiled with the compact detection losses (RetinaNetConfig compact_targets)',
+            default = False,
+            accepted_types = bool
+        )
+
         # Training input size Parameters
 
         self.add(
@@ -105,9 +143,132 @@ class DetectionGeneratorConfig(ConfigTemplate):
 
         self.add(
             'group_method',
-            'Order to group images recommended ratio to reduce blacked out areas of images',
+            'Order to group images recommended ratio to reduce blacked out areas of images, ' + \
+            'bucket groups images whose resized shapes snap to the same multiple of bucket_stride ' + \
+            'so that batches come in a small set of shapes',
             default = 'ratio',
-            valid_options = [None, 'random', 'ratio']
+            valid_options = [None, 'random', 'ratio', 'bucket']
+        )
+
+        self.add(
+            'bucket_stride',
+            'Used if group_method is bucket, batches are padded to shapes which are multiples of bucket_stride ' + \
+            '(defaults to 32, or the largest anchor stride if smaller). Smaller strides waste less padding ' + \
+            '(about 98% of batch pixels are image pixels at 32 against 85% at 128 for images of random sizes) ' + \
+            'but give more distinct batch shapes, so groups are filled less often and anchors are cached for more shapes ' + \
+            '(see anchor_cache_size)',
+            accepted_types = 'int-like',
+            condition = is_positive
+        )
+
+        self.add(
+            'image_index_path',
+            'Path of a .npz file of an ImageIndex holding the size of every image, used to group images ' + \
+            'without querying the dataset for every image on every epoch. ' + \
+            'The index is built on first use and rebuilt if the image ids change, ' + \
+            'or if an image file changes (path, size or modification time) when the dataset has the function get_image_path',
+            accepted_types = str
+        )
+
+        self.add(
+            'manifest_path',
+            'Path of a .npz file written by keras_pipeline.datasets.manifest, ' + \
+            'images marked as unreadable or truncated in the manifest are left out. ' + \
+            'Requires the dataset to have the function get_image_path',
+            accepted_types = str
+        )
+
+        # Decoding parameters
+
+        self.add(
+            'decode_size_hint',
+            'Flag to pass the size an image will be resized to as dataset.load_image(image_index, size_hint=(width, height)), ' + \
+            'allowing JPEG images to be decoded at a reduced resolution (eg. with preprocessing.image.read_image). ' + \
+            'Requires the dataset to accept size_hint and have the function get_image_size returning (width, height)',
+            default = False,
+            accepted_types = bool
+        )
+
+        # Caching parameters
+
+        self.add(
+            'image_cache_size',
+            'Size in bytes of an in-memory least recently used cache of decoded images, ' + \
+            'used to avoid decoding images again every epoch, 0 disables the cache. ' + \
+            'If workers > 0, every worker process holds its own cache',
+            default = 0,
+            accepted_types = 'int-like',
+            condition = is_non_negative
+        )
+
+        self.add(
+            'resized_image_store_path',
+            'Directory of a store of images pre-resized to image_min_side and image_max_side, ' + \
+            'images are read from memory mapped files instead of being decoded and resized every time. ' + \
+            'The store is built on first use and rebuilt if the image ids or resize parameters change, ' + \
+            'or if an image file changes (path, size or modification time) when the dataset has the function get_image_path',
+            accepted_types = str
+        )
+
+        self.add(
+            'anchor_cache_size',
+            'Number of image shapes whose anchors are kept in a least recently used cache, ' + \
+            'anchors of padded batches only depend on the batch shape so they are reused across batches. ' + \
+            '0 disables the cache',
+            default = 16,
+            accepted_types = 'int-like',
+            condition = is_non_negative
+        )
+
+        # Parallel processing parameters
+
+        self.add(
+            'workers',
+            'Number of worker processes used to compute batches in parallel, ' + \
+            'if 0 batches are computed on the thread calling next',
+            default = 0,
+            accepted_types = 'int-like',
+            condition = is_non_negative
+        )
+
+        self.add(
+            'max_queue_size',
+            'Maximum number of batches prefetched by the worker processes, only used if workers > 0',
+            default = 10,
+            accepted_types = 'int-like',
+            condition = is_positive
+        )
+
+        self.add(
+            'use_shared_memory',
+            'Flag to have worker processes write batches into a ring of preallocated shared memory slots ' + \
+            'instead of sending them back pickled, only used if workers > 0. ' + \
+            'The ring has workers + 1 slots (so at most workers + 1 batches are prefetched), ' + \
+            'every slot is allocated in /dev/shm for the largest possible batch (max_batch_size images padded to ' + \
+            'max(image_min_side, image_max_side) squared and their targets), which is tens to hundreds of MB per slot ' + \
+            'for large images or many classes. Batches are copied out of their slot unless shared_memory_zero_copy is True',
+            default = False,
+            accepted_types = bool
+        )
+
+        self.add(
+            'shared_memory_zero_copy',
+            'Flag to return batches as views into their shared memory slot instead of copies, only used if use_shared_memory is True. ' + \
+            'A slot is only written to again after generator.release_batch() is called, ' + \
+            'the consumer has to release every batch (in order) once it is no longer in use. ' + \
+            'Batches held by the consumer leave fewer slots to the workers, keras fit_generator never releases batches',
+            default = False,
+            accepted_types = bool
+        )
+
+        self.add(
+            'reuse_batch_buffers',
+            'Flag to write batches into preallocated buffers which are reused instead of allocating new arrays for every batch. ' + \
+            'A buffer is only reused once its batch is given back with generator.release_batch_buffers(inputs, targets), ' + \
+            'batches computed by worker processes are given back as soon as they are sent to the main process. ' + \
+            'Batches which are never given back are not reused',
+            default = False,
+            accepted_types = bool
         )
 
         # Transform Parameters
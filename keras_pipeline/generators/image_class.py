@@ -5,6 +5,7 @@ https://github.com/keras-team/keras/blob/master/keras/preprocessing/image.py
 import math
 import numpy as np
 import threading
+from collections import deque
 
 import keras
 
@@ -26,12 +27,29 @@ class ImageClassGenerator(ImageGenerator):
         self.num_classes     = config.dataset.get_num_classes()
         self.label_to_name   = config.dataset.label_to_name
 
+        # Leave out invalid images
+        if config.manifest_path is not None:
+            self._remove_invalid_images(config.manifest_path)
+
         # Typical generator config
         self.batch_size      = config.batch_size
         self.image_height    = config.image_height
         self.image_width     = config.image_width
         self.stretch_to_fill = config.stretch_to_fill
         self.shuffle         = config.shuffle
+        self.image_dtype     = config.image_dtype or keras.backend.floatx()
+
+        # Decoding config
+        self.decode_size_hint = config.decode_size_hint
+
+        # Parallel processing config
+        self.workers                 = config.workers
+        self.max_queue_size          = config.max_queue_size
+        self.use_shared_memory       = config.use_shared_memory
+        self.shared_memory_zero_copy = config.shared_memory_zero_copy
+
+        # Create image cache
+        self.image_cache = self._make_image_cache(config)
 
         # Create transform generator
         self.transform_parameters = config.transform_parameters
@@ -45,10 +63,12 @@ class ImageClassGenerator(ImageGenerator):
         # Tools which helps order the data generated
         self.lock = threading.Lock() # this is to allow for parrallel batch processing
         self.group_index_generator = self._make_index_generator()
+        self.prefetch_queue = deque()
+        self.batches_in_use = deque()
 
     def _validate_dataset(self):
         """ Dataset validator which validates the suitability of the dataset """
-        img_id = self.dataset.list_all_image_index()[0]
+        img_id = self.all_image_index[0]
 
         size         = self.dataset.get_size()
         num_classes  = self.dataset.get_num_classes()
@@ -58,6 +78,10 @@ class ImageClassGenerator(ImageGenerator):
         img = self.dataset.load_image(img_id)
         assert (len(img.shape) == 3) and (img.shape[-1] == 3), 'img is of wrong shape, got {}'.format(img.shape)
 
+        if self.decode_size_hint:
+            assert hasattr(self.dataset, 'get_image_size'), 'decode_size_hint requires the dataset to have get_image_size'
+            self.dataset.load_image(img_id, size_hint=self.compute_size_hint(img_id))
+
         bbox = self.dataset.get_image_bbox_array(img_id)
         assert bbox.shape == (4,), 'bbox generated must be of shape (4,), got {}'.format(bbox.shape)
 
@@ -66,18 +90,54 @@ class ImageClassGenerator(ImageGenerator):
 
         self.dataset.label_to_name(num_classes - 1)
 
+    def compute_batch_specs(self):
+        input_spec  = ((self.batch_size, self.image_height, self.image_width, 3), self.image_dtype)
+        target_spec = ((self.batch_size, self.num_classes), keras.backend.floatx())
+        return input_spec, target_spec
+
     def load_X_group(self, group):
         """ Loads the raw group images and bboxes from the dataset """
-        return [(self.dataset.load_image(image_index), self.dataset.get_image_bbox_array(image_index))
+        return [(self._load_image(image_index), self.dataset.get_image_bbox_array(image_index))
             for image_index in group]
 
     def load_Y_group(self, group):
         """ Loads the raw inputs from the dataset """
         return [self.dataset.get_image_class_array(image_index) for image_index in group]
 
-    def random_transform_image(self, image):
+    def compute_size_hint(self, image_index):
+        """ Compute the size the image has to be decoded at so that its bbox crop is not smaller than the input size """
+        width, height = self.dataset.get_image_size(image_index)
+        bbox = self.dataset.get_image_bbox_array(image_index)
+
+        scale_height = self.image_height / max(bbox[3] - bbox[1], 1)
+        scale_width  = self.image_width  / max(bbox[2] - bbox[0], 1)
+
+        # Images are decoded with the same scale on both axes
+        if self.stretch_to_fill:
+            scale = max(scale_height, scale_width)
+        else:
+            scale = min(scale_height, scale_width)
+
+        return width * scale, height * scale
+
+    def load_group(self, group):
+        X_group, labels_group = super(ImageClassGenerator, self).load_group(group)
+
+        # Images may have been decoded at a reduced resolution, scale bboxes accordingly
+        if self.decode_size_hint:
+            for index, (image_index, (image, bbox)) in enumerate(zip(group, X_group)):
+                width, height = self.dataset.get_image_size(image_index)
+                scale = np.array([image.shape[1] / width, image.shape[0] / height] * 2)
+                bbox  = np.round(bbox * scale).astype(int)
+                X_group[index] = (image, bbox)
+
+        return X_group, labels_group
+
+    def random_transform_image(self, image, transform=None):
         """ Apply a random transformation on an image """
-        transformation = adjust_transform_for_image(next(self.transform_generator), image, self.transform_parameters.relative_translation)
+        if transform is None:
+            transform = next(self.transform_generator)
+        transformation = adjust_transform_for_image(transform, image, self.transform_parameters.relative_translation)
         image = apply_transform(transformation, image, self.transform_parameters)
         return image
 
@@ -89,7 +149,7 @@ class ImageClassGenerator(ImageGenerator):
             stretch_to_fill=self.stretch_to_fill
         )
 
-    def preprocess_entry(self, X, labels):
+    def preprocess_entry(self, X, labels, transform=None):
         """ Preprocesses an entry """
         (image, bbox) = X
 
@@ -98,7 +158,7 @@ class ImageClassGenerator(ImageGenerator):
 
         # Apply transformation
         if self.transform_generator:
-            image = self.random_transform_image(image)
+            image = self.random_transform_image(image, transform)
 
         # resize image
         image = self.resize_image(image)
@@ -109,7 +169,7 @@ class ImageClassGenerator(ImageGenerator):
         """ Compute the network inputs """
         # Construct an image batch object
         batch_shape = (self.batch_size, self.image_height, self.image_width, 3)
-        image_batch = np.zeros(batch_shape, dtype=keras.backend.floatx())
+        image_batch = np.zeros(batch_shape, dtype=self.image_dtype)
 
         # Copy all images to the center of the image batch object
         for image_index, image in enumerate(image_group):
@@ -122,7 +182,7 @@ class ImageClassGenerator(ImageGenerator):
         return image_batch
 
 
-    def compute_targets(self, labels_group):
+    def compute_targets(self, image_group, labels_group):
         """ Compute the network outputs """
         # Construct a labels batch object
         batch_shape  = (self.batch_size, self.num_classes)
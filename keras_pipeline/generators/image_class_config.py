@@ -1,6 +1,7 @@
 from collections import OrderedDict
 
 from ..utils._config_template import ConfigTemplate
+from ..utils._validation import is_positive, is_non_negative
 from ..preprocessing.image_transform import TransformParameters
 
 
@@ -63,6 +64,85 @@ class ImageClassGeneratorConfig(ConfigTemplate):
             accepted_types = bool
         )
 
+        self.add(
+            'image_dtype',
+            'Data type of the image batches, defaults to keras.backend.floatx(). ' + \
+            'uint8 batches are 4 times smaller than float32 batches, the model has to cast them to float in its first layer ' + \
+            '(eg. a model built with input_dtype=\'uint8\')',
+            valid_options = [None, 'uint8', 'float16', 'float32', 'float64']
+        )
+
+        self.add(
+            'manifest_path',
+            'Path of a .npz file written by keras_pipeline.datasets.manifest, ' + \
+            'images marked as unreadable or truncated in the manifest are left out. ' + \
+            'Requires the dataset to have the function get_image_path',
+            accepted_types = str
+        )
+
+        # Decoding parameters
+
+        self.add(
+            'decode_size_hint',
+            'Flag to pass the size an image will be resized to as dataset.load_image(image_index, size_hint=(width, height)), ' + \
+            'allowing JPEG images to be decoded at a reduced resolution (eg. with preprocessing.image.read_image). ' + \
+            'Requires the dataset to accept size_hint and have the function get_image_size returning (width, height)',
+            default = False,
+            accepted_types = bool
+        )
+
+        # Caching parameters
+
+        self.add(
+            'image_cache_size',
+            'Size in bytes of an in-memory least recently used cache of decoded images, ' + \
+            'used to avoid decoding images again every epoch, 0 disables the cache. ' + \
+            'If workers > 0, every worker process holds its own cache',
+            default = 0,
+            accepted_types = 'int-like',
+            condition = is_non_negative
+        )
+
+        # Parallel processing parameters
+
+        self.add(
+            'workers',
+            'Number of worker processes used to compute batches in parallel, ' + \
+            'if 0 batches are computed on the thread calling next',
+            default = 0,
+            accepted_types = 'int-like',
+            condition = is_non_negative
+        )
+
+        self.add(
+            'max_queue_size',
+            'Maximum number of batches prefetched by the worker processes, only used if workers > 0',
+            default = 10,
+            accepted_types = 'int-like',
+            condition = is_positive
+        )
+
+        self.add(
+            'use_shared_memory',
+            'Flag to have worker processes write batches into a ring of preallocated shared memory slots ' + \
+            'instead of sending them back pickled, only used if workers > 0. ' + \
+            'The ring has workers + 1 slots (so at most workers + 1 batches are prefetched), ' + \
+            'every slot is allocated in /dev/shm for a full batch (batch_size images and their targets). ' + \
+            'Batches are copied out of their slot unless shared_memory_zero_copy is True',
+            default = False,
+            accepted_types = bool
+        )
+
+        self.add(
+            'shared_memory_zero_copy',
+            'Flag to return batches as views into their shared memory slot instead of copies, only used if use_shared_memory is True. ' + \
+            'A slot is only written to again after generator.release_batch() is called, ' + \
+            'the consumer has to release every batch (in order) once it is no longer in use. ' + \
+            'Batches held by the consumer leave fewer slots to the workers, keras fit_generator never releases batches',
+            default = False,
+            accepted_types = bool
+        )
+
         # Transform Parameters
 
         self.add(
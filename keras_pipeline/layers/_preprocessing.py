@@ -3,7 +3,7 @@ import keras
 
 
 class InceptionPreprocess(keras.layers.Layer):
-    """Performs preprocessing for a inception backbone"""
+    """Performs preprocessing for a inception backbone (inputs of any dtype are cast to floatx first)"""
     def __init__(self, *args, **kwargs):
         _INCEPTION_SCALE = 1 / 127.5
         _INCEPTION_BIAS  = -1
@@ -12,7 +12,8 @@ class InceptionPreprocess(keras.layers.Layer):
         super(InceptionPreprocess, self).__init__(*args, **kwargs)
 
     def call(self, inputs, **kwargs):
-        x = inputs * self.scale + self.bias
+        x = keras.backend.cast(inputs, keras.backend.floatx())
+        x = x * self.scale + self.bias
         return x
 
     def compute_output_shape(self, input_shape):
@@ -20,14 +21,15 @@ class InceptionPreprocess(keras.layers.Layer):
 
 
 class ResNetPreprocess(keras.layers.Layer):
-    """Performs preprocessing for a resnet backbone"""
+    """Performs preprocessing for a resnet backbone (inputs of any dtype are cast to floatx first)"""
     def __init__(self, *args, **kwargs):
         _RESNET_MEAN = np.array([103.939, 116.779, 123.68], keras.backend.floatx())
         self.bias = keras.backend.constant(-_RESNET_MEAN)
         super(ResNetPreprocess, self).__init__(*args, **kwargs)
 
     def call(self, inputs, **kwargs):
-        x = inputs[..., ::-1]
+        x = keras.backend.cast(inputs, keras.backend.floatx())
+        x = x[..., ::-1]
         x = keras.backend.bias_add(x, self.bias)
         return x
 
@@ -66,3 +66,64 @@ def make_detection_smooth_l1_loss(sigma=3.0):
         return keras.backend.sum(regression_loss) / normalizer
 
     return detection_smooth_l1_loss
+
+
+def make_compact_detection_focal_loss(alpha=0.25, gamma=2.0):
+    """ Focal loss for compact classification targets
+    y_true should be of shape (batch, num_anchors, 2) holding [anchor_state, class] of every anchor,
+    the one-hot labels are expanded within the graph
+    """
+    focal_loss = make_detection_focal_loss(alpha=alpha, gamma=gamma)
+
+    def compact_detection_focal_loss(y_true, classification):
+        num_classes  = keras.backend.int_shape(classification)[-1]
+        anchor_state = keras.backend.cast(y_true[:, :, 0], keras.backend.floatx())
+        anchor_class = keras.backend.cast(y_true[:, :, 1], 'int32')
+
+        # expand into labels, -1 for ignore, 0 for background, 1 for object
+        labels = keras.backend.one_hot(anchor_class, num_classes)
+        labels = labels * keras.backend.expand_dims(keras.backend.cast(keras.backend.equal(anchor_state, 1), keras.backend.floatx()))
+        labels = labels - keras.backend.expand_dims(keras.backend.cast(keras.backend.equal(anchor_state, -1), keras.backend.floatx()))
+
+        return focal_loss(labels, classification)
+
+    return compact_detection_focal_loss
+
+
+def make_compact_detection_smooth_l1_loss(sigma=3.0):
+    """ Smooth l1 loss for compact regression targets
+    y_true should be of shape (batch, max_positives, 5) holding [anchor_index, regression] of positive anchors
+    (padded with anchor_index -1) while y_pred should be channel size 4
+    """
+    sigma_squared = sigma ** 2
+
+    def compact_detection_smooth_l1_loss(y_true, y_pred):
+        # filter out padding
+        indices           = backend.where(keras.backend.greater_equal(y_true[:, :, 0], 0))
+        y_true            = backend.gather_nd(y_true, indices)
+        regression_target = y_true[:, 1:]
+
+        # gather the regression of positive anchors
+        anchor_indices = keras.backend.stack([
+            keras.backend.cast(indices[:, 0], 'int32'),
+            keras.backend.cast(y_true[:, 0], 'int32')
+        ], axis=1)
+        regression = backend.gather_nd(y_pred, anchor_indices)
+
+        # compute smooth L1 loss
+        # f(x) = 0.5 * (sigma * x)^2          if |x| < 1 / sigma / sigma
+        #        |x| - 0.5 / sigma / sigma    otherwise
+        regression_diff = regression - regression_target
+        regression_diff = keras.backend.abs(regression_diff)
+        regression_loss = backend.where(
+            keras.backend.less(regression_diff, 1.0 / sigma_squared),
+            0.5 * sigma_squared * keras.backend.pow(regression_diff, 2),
+            regression_diff - 0.5 / sigma_squared
+        )
+
+        # compute the normalizer: the number of positive anchors
+        normalizer = keras.backend.maximum(1, keras.backend.shape(indices)[0])
+        normalizer = keras.backend.cast(normalizer, dtype=keras.backend.floatx())
+        return keras.backend.sum(regression_loss) / normalizer
+
+    return compact_detection_smooth_l1_loss
@@ -224,8 +224,12 @@ def __build_pyramid_features(C3, C4, C5, feature_size=256):
 
 def __compile_retinanet(training_model, config):
     """ Compiles a training retinanet model """
-    classification_loss = losses.make_detection_focal_loss(**config.classification_loss_options)
-    regression_loss = losses.make_detection_smooth_l1_loss(**config.regression_loss_options)
+    if config.compact_targets:
+        classification_loss = losses.make_compact_detection_focal_loss(**config.classification_loss_options)
+        regression_loss = losses.make_compact_detection_smooth_l1_loss(**config.regression_loss_options)
+    else:
+        classification_loss = losses.make_detection_focal_loss(**config.classification_loss_options)
+        regression_loss = losses.make_detection_smooth_l1_loss(**config.regression_loss_options)
     optimizer = getattr(keras.optimizers, config.optimizer_name)(**config.optimizer_options)
 
     training_model.compile(
@@ -253,7 +257,7 @@ def RetinaNetTrain(config, compile=True):
 
     # Generate pyramid features
     backbone = load_backbone(
-        input_tensor    = keras.Input(shape=config.input_shape),
+        input_tensor    = keras.Input(shape=config.input_shape, dtype=config.input_dtype),
         backbone_name   = config.backbone_name,
         freeze_backbone = config.freeze_backbone
     )
@@ -366,21 +370,28 @@ def LoadRetinaNet(file_path, backbone_name, config=None):
 
     """
     # Load loss configs if config object is provided
-    detection_focal_loss = losses.make_detection_focal_loss()
-    detection_smooth_l1_loss = losses.make_detection_smooth_l1_loss()
+    classification_loss_options = {}
+    regression_loss_options = {}
     if config is not None:
-        detection_focal_loss = losses.make_detection_focal_loss(**config.classification_loss_options)
-        detection_smooth_l1_loss = losses.make_detection_smooth_l1_loss(**config.regression_loss_options)
+        classification_loss_options = config.classification_loss_options
+        regression_loss_options = config.regression_loss_options
+
+    detection_focal_loss = losses.make_detection_focal_loss(**classification_loss_options)
+    detection_smooth_l1_loss = losses.make_detection_smooth_l1_loss(**regression_loss_options)
+    compact_detection_focal_loss = losses.make_compact_detection_focal_loss(**classification_loss_options)
+    compact_detection_smooth_l1_loss = losses.make_compact_detection_smooth_l1_loss(**regression_loss_options)
 
     # Dictionary of custom layers used in the RetinaNet
     custom_objects = {
-        'ResizeTo'                 : layers.ResizeTo,
-        'RegressBoxes'             : layers.RegressBoxes,
-        'FilterDetections'         : layers.FilterDetections,
-        'Anchors'                  : layers.Anchors,
-        'ClipBoxes'                : layers.ClipBoxes,
-        'detection_focal_loss'     : detection_focal_loss,
-        'detection_smooth_l1_loss' : detection_smooth_l1_loss,
+        'ResizeTo'                         : layers.ResizeTo,
+        'RegressBoxes'                     : layers.RegressBoxes,
+        'FilterDetections'                 : layers.FilterDetections,
+        'Anchors'                          : layers.Anchors,
+        'ClipBoxes'                        : layers.ClipBoxes,
+        'detection_focal_loss'             : detection_focal_loss,
+        'detection_smooth_l1_loss'         : detection_smooth_l1_loss,
+        'compact_detection_focal_loss'     : compact_detection_focal_loss,
+        'compact_detection_smooth_l1_loss' : compact_detection_smooth_l1_loss,
     }
 
     # Get backbone custom objects
@@ -46,6 +46,14 @@ class RetinaNetConfig(ConfigTemplate):
             condition = is_valid_input_tensor
         )
 
+        self.add(
+            'input_dtype',
+            'Data type of the input images, defaults to keras.backend.floatx(). ' + \
+            'Use uint8 to feed the uint8 image batches of a generator with image_dtype=\'uint8\', ' + \
+            'images are cast to float by the preprocessing layer of the backbone',
+            valid_options = [None, 'uint8', 'float16', 'float32', 'float64']
+        )
+
         # Loss and optimizer config
 
         self.add(
@@ -60,6 +68,14 @@ class RetinaNetConfig(ConfigTemplate):
             default = {}
         )
 
+        self.add(
+            'compact_targets',
+            'Flag to compile the model with losses that take the compact targets computed by ' + \
+            'a DetectionGenerator with compact_targets',
+            default = False,
+            accepted_types = bool
+        )
+
         self.add(
             'optimizer_name',
             'The name of a keras available optimizer from https://keras.io/optimizers/, default adam',
@@ -155,15 +171,18 @@ class RetinaNetConfig(ConfigTemplate):
         # Anchor strides and sizes must be the same size
         assert len(self.anchor_sizes) == len(self.anchor_strides)
 
-        # Assign proper input_shape and input_tensor
+        # Assign proper input_shape, input_dtype and input_tensor
         if self.input_tensor is None:
+            if self.input_dtype is None:
+                self.input_dtype = keras.backend.floatx()
             if self.input_shape is None:
                 self.input_shape  = (None, None, 3)
-                self.input_tensor = keras.Input(shape=(None, None, 3))
+                self.input_tensor = keras.Input(shape=(None, None, 3), dtype=self.input_dtype)
             else:
-                self.input_tensor = keras.Input(shape=self.input_shape)
+                self.input_tensor = keras.Input(shape=self.input_shape, dtype=self.input_dtype)
         else:
             self.input_shape = tuple(self.input_tensor.shape[1:].as_list())
+            self.input_dtype = self.input_tensor.dtype.name
 
         # Load compute_pyramid_feature_shapes_for_img_shape function
         self.compute_pyramid_feature_shapes_for_img_shape = \
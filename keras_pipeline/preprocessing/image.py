@@ -3,14 +3,32 @@
 from __future__ import division
 
 import os
+import math
 import struct
 
 import numpy as np
 from PIL import Image
 
 
-def read_image(path):
-    return np.asarray(Image.open(path).convert('RGB'))
+def read_image(path, size_hint=None):
+    """ Reads an image as a RGB uint8 array
+
+    Args
+        path      : Path (or file object) of the image
+        size_hint : Optional (width, height) the image will be resized down to afterwards.
+                    JPEG images are then decoded at a reduced resolution (1/2, 1/4 or 1/8)
+                    which is never smaller than size_hint
+
+    Returns
+        The image as a np.ndarray of shape (height, width, 3)
+
+    """
+    image = Image.open(path)
+
+    if size_hint is not None:
+        image.draft('RGB', tuple(int(math.ceil(s)) for s in size_hint))
+
+    return np.asarray(image.convert('RGB'))
 
 
 ###############################################################################
@@ -22,6 +40,47 @@ class UnknownImageFormat(Exception):
     pass
 
 
+# Number of bytes read at once while parsing image headers
+_HEADER_CHUNK_SIZE = 64 * 1024
+
+# JPEG start of frame markers (which hold the image size)
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# JPEG markers without a length field
+_JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01}
+
+
+def _get_jpeg_size(input, data):
+    """ Finds the size of a JPEG in its start of frame segment
+    The file is parsed from a buffer which is extended in chunks as needed instead of reading single bytes
+    """
+    offset = 2
+    while True:
+        # A marker and the start of a start of frame segment are at most 9 bytes long
+        while len(data) < offset + 9:
+            chunk = input.read(_HEADER_CHUNK_SIZE)
+            if not chunk:
+                raise UnknownImageFormat('Reached end of file before the start of frame of the JPEG')
+            data += chunk
+
+        if data[offset] != 0xFF:
+            raise UnknownImageFormat('Invalid marker in JPEG')
+
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+        elif marker in _JPEG_SOF_MARKERS:
+            h, w = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return int(w), int(h)
+        elif marker == 0xDA:
+            raise UnknownImageFormat('Reached start of scan before the start of frame of the JPEG')
+        elif marker in _JPEG_STANDALONE_MARKERS:
+            offset += 2
+        else:
+            offset += 2 + struct.unpack('>H', data[offset + 2:offset + 4])[0]
+
+
 def get_image_size(file_path):
     """
     Efficiently determine the dimensions of a given image
@@ -29,7 +88,21 @@ def get_image_size(file_path):
     Args:
         file_path (str): path to an image file
     Returns:
-        Image: (path, type, file_size, width, height)
+        (width, height) of the image
+    """
+    _, _, width, height = get_image_info(file_path)
+    return width, height
+
+
+def get_image_info(file_path):
+    """
+    Efficiently determine the format, file size and dimensions of a given image
+    Only the image header is read
+
+    Args:
+        file_path (str): path to an image file
+    Returns:
+        (format, file_size, width, height) where format is one of gif, png, jpeg, bmp, tiff, ico
     """
     size = os.path.getsize(file_path)
 
@@ -37,46 +110,35 @@ def get_image_size(file_path):
     with open(file_path, "rb") as input:
         height = -1
         width = -1
-        data = input.read(26)
+        data = input.read(_HEADER_CHUNK_SIZE)
         msg = " raised while trying to decode as JPEG."
 
         if (size >= 10) and data[:6] in (b'GIF87a', b'GIF89a'):
             # GIFs
+            image_format = 'gif'
             w, h = struct.unpack("<HH", data[6:10])
             width = int(w)
             height = int(h)
         elif ((size >= 24) and data.startswith(b'\211PNG\r\n\032\n')
               and (data[12:16] == b'IHDR')):
             # PNGs
+            image_format = 'png'
             w, h = struct.unpack(">LL", data[16:24])
             width = int(w)
             height = int(h)
         elif (size >= 16) and data.startswith(b'\211PNG\r\n\032\n'):
             # older PNGs
+            image_format = 'png'
             w, h = struct.unpack(">LL", data[8:16])
             width = int(w)
             height = int(h)
         elif (size >= 2) and data.startswith(b'\377\330'):
             # JPEG
-            input.seek(0)
-            input.read(2)
-            b = input.read(1)
+            image_format = 'jpeg'
             try:
-                while (b and ord(b) != 0xDA):
-                    while (ord(b) != 0xFF):
-                        b = input.read(1)
-                    while (ord(b) == 0xFF):
-                        b = input.read(1)
-                    if (ord(b) >= 0xC0 and ord(b) <= 0xC3):
-                        input.read(3)
-                        h, w = struct.unpack(">HH", input.read(4))
-                        break
-                    else:
-                        input.read(
-                            int(struct.unpack(">H", input.read(2))[0]) - 2)
-                    b = input.read(1)
-                width = int(w)
-                height = int(h)
+                width, height = _get_jpeg_size(input, data)
+            except UnknownImageFormat as e:
+                raise UnknownImageFormat(str(e) + msg)
             except struct.error:
                 raise UnknownImageFormat("StructError" + msg)
             except ValueError:
@@ -85,6 +147,7 @@ def get_image_size(file_path):
                 raise UnknownImageFormat(e.__class__.__name__ + msg)
         elif (size >= 26) and data.startswith(b'BM'):
             # BMP
+            image_format = 'bmp'
             headersize = struct.unpack("<I", data[14:18])[0]
             if headersize == 12:
                 w, h = struct.unpack("<HH", data[18:22])
@@ -103,8 +166,9 @@ def get_image_size(file_path):
             # Standard TIFF, big- or little-endian
             # BigTIFF and other different but TIFF-like formats are not
             # supported currently
+            image_format = 'tiff'
             byteOrder = data[:2]
-            boChar = ">" if byteOrder == "MM" else "<"
+            boChar = ">" if byteOrder == b"MM" else "<"
             # maps TIFF type id to size (in bytes)
             # and python format char for struct
             tiffTypes = {
@@ -159,12 +223,13 @@ def get_image_size(file_path):
                 raise UnknownImageFormat(str(e))
         elif size >= 2:
             # see http://en.wikipedia.org/wiki/ICO_(file_format)
+            image_format = 'ico'
             input.seek(0)
             reserved = input.read(2)
             if 0 != struct.unpack("<H", reserved)[0]:
                 raise UnknownImageFormat("Sorry, don't know how to get size for this file.")
-            format = input.read(2)
-            assert 1 == struct.unpack("<H", format)[0]
+            ico_type = input.read(2)
+            assert 1 == struct.unpack("<H", ico_type)[0]
             num = input.read(2)
             num = struct.unpack("<H", num)[0]
             if num > 1:
@@ -178,4 +243,30 @@ def get_image_size(file_path):
         else:
             raise UnknownImageFormat("Sorry, don't know how to get size for this file.")
 
-    return width, height
+    return image_format, size, width, height
+
+
+def get_image_file_stats(dataset, image_ids):
+    """
+    Returns the (path, file size, modification time) of the file of every image,
+    used to notice images which were replaced under the same image id
+
+    Args:
+        dataset: dataset with the function get_image_path
+        image_ids: the image ids of the images
+    Returns:
+        a list of (path, file size, modification time), (path, -1, -1) for missing files
+        or None if the dataset does not have the function get_image_path
+    """
+    if not hasattr(dataset, 'get_image_path'):
+        return None
+
+    stats = []
+    for image_index in image_ids:
+        path = os.path.abspath(dataset.get_image_path(image_index))
+        try:
+            stat = os.stat(path)
+            stats.append((path, stat.st_size, stat.st_mtime))
+        except OSError:
+            stats.append((path, -1, -1))
+    return stats
@@ -0,0 +1,190 @@
+""" A persistent store of pre-resized images backed by a memory mapped file
+
+Images are decoded and resized with resize_image_1 once, then stored as concatenated uint8 pixels.
+Loading an image from the store returns a zero-copy slice of the memory mapped file.
+
+A store is a directory containing
+    data.bin   : Concatenated uint8 pixels of every resized image
+    index.npy  : Offset, height, width and resize scale of every image
+    meta.json  : Resize parameters and the key used to validate the store
+
+The key covers the image ids and resize parameters, and the path, size and modification time
+of every image file if the dataset has the function get_image_path (replaced images are only noticed then).
+"""
+
+import os
+import json
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from .image import get_image_file_stats
+from .image_transform import resize_image_1
+
+
+_STORE_VERSION = 2
+
+_INDEX_DTYPE = np.dtype([
+    ('offset', np.int64),
+    ('height', np.int32),
+    ('width' , np.int32),
+    ('scale' , np.float64),
+])
+
+
+def compute_store_key(image_ids, min_side, max_side, file_stats=None):
+    """ Computes the key of a store, the key changes if the image ids, image files or resize parameters change
+    file_stats are the stats of the image files (see get_image_file_stats), image files are not tracked if None
+    """
+    key = json.dumps({
+        'version'    : _STORE_VERSION,
+        'min_side'   : min_side,
+        'max_side'   : max_side,
+        'image_ids'  : [str(image_id) for image_id in image_ids],
+        'file_stats' : file_stats,
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class ResizedImageStore(object):
+    """ Reader of a store created with build_resized_image_store
+
+    Args
+        path      : Directory of the store
+        image_ids : The image ids the store was built with (in the same order)
+
+    """
+    def __init__(self, path, image_ids):
+        self.path      = path
+        self.image_ids = image_ids
+        self._open()
+
+    def _open(self):
+        with open(os.path.join(self.path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        self.key      = meta['key']
+        self.min_side = meta['min_side']
+        self.max_side = meta['max_side']
+
+        self.index = np.load(os.path.join(self.path, 'index.npy'))
+        self.rows  = {image_id: row for row, image_id in enumerate(self.image_ids)}
+        assert len(self.rows) == len(self.index), 'Store has {} images, expected {}'.format(len(self.index), len(self.rows))
+
+        if os.path.getsize(os.path.join(self.path, 'data.bin')):
+            self.data = np.memmap(os.path.join(self.path, 'data.bin'), dtype=np.uint8, mode='r')
+        else:
+            self.data = np.zeros((0,), dtype=np.uint8)
+
+    def load_image(self, image_index):
+        """ Returns a read-only view of the resized image """
+        entry  = self.index[self.rows[image_index]]
+        offset = int(entry['offset'])
+        shape  = (int(entry['height']), int(entry['width']), 3)
+        return self.data[offset:offset + shape[0] * shape[1] * 3].reshape(shape)
+
+    def get_scale(self, image_index):
+        """ Returns the scale the image was resized with """
+        return float(self.index[self.rows[image_index]]['scale'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getstate__(self):
+        # The memory map is opened again instead of being copied
+        return {'path': self.path, 'image_ids': self.image_ids}
+
+    def __setstate__(self, state):
+        self.path      = state['path']
+        self.image_ids = state['image_ids']
+        self._open()
+
+
+def build_resized_image_store(dataset, path, min_side=800, max_side=1333, workers=4, image_ids=None):
+    """ Decodes and resizes every image in a dataset once and writes them into a store
+
+    Args
+        dataset   : Dataset with the functions list_all_image_index and load_image
+        path      : Directory to write the store to
+        min_side  : Minimum length of side for image (as in resize_image_1)
+        max_side  : Maximum length of side for image (as in resize_image_1)
+        workers   : Number of threads used to decode and resize images
+        image_ids : The images to store (defaults to dataset.list_all_image_index()),
+                    eg. the image ids of a generator which left out invalid images
+
+    Returns
+        A ResizedImageStore of the newly written store
+
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    if image_ids is None:
+        image_ids = dataset.list_all_image_index()
+    index = np.zeros((len(image_ids),), dtype=_INDEX_DTYPE)
+
+    # Files are checked before they are read so that files changed during the build are noticed next time
+    file_stats = get_image_file_stats(dataset, image_ids)
+
+    # Remove meta first so that an interrupted build is never considered valid
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+
+    def load_resized_image(image_index):
+        image, scale = resize_image_1(dataset.load_image(image_index), min_side=min_side, max_side=max_side)
+        return np.ascontiguousarray(image, dtype=np.uint8), scale
+
+    pool = ThreadPool(workers)
+    try:
+        offset = 0
+        with open(os.path.join(path, 'data.bin'), 'wb') as f:
+            # imap returns images in order so they can be written sequentially
+            for row, (image, scale) in enumerate(pool.imap(load_resized_image, image_ids, chunksize=16)):
+                f.write(image.tobytes())
+                index[row] = (offset, image.shape[0], image.shape[1], scale)
+                offset += image.nbytes
+    finally:
+        pool.close()
+        pool.join()
+
+    np.save(os.path.join(path, 'index.npy'), index)
+
+    with open(meta_path, 'w') as f:
+        json.dump({
+            'key'      : compute_store_key(image_ids, min_side, max_side, file_stats),
+            'min_side' : min_side,
+            'max_side' : max_side,
+        }, f)
+
+    return ResizedImageStore(path, image_ids)
+
+
+def open_resized_image_store(dataset, path, min_side=800, max_side=1333, workers=4, image_ids=None):
+    """ Opens a store, (re)building it if it does not exist or was built for other images or resize parameters
+    Image files are only checked for changes if the dataset has the function get_image_path
+
+    Args
+        dataset   : Dataset with the functions list_all_image_index and load_image
+        path      : Directory of the store
+        min_side  : Minimum length of side for image (as in resize_image_1)
+        max_side  : Maximum length of side for image (as in resize_image_1)
+        workers   : Number of threads used to decode and resize images if the store has to be built
+        image_ids : The images to store (defaults to dataset.list_all_image_index())
+
+    Returns
+        A ResizedImageStore
+
+    """
+    if image_ids is None:
+        image_ids = dataset.list_all_image_index()
+    meta_path = os.path.join(path, 'meta.json')
+
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r') as f:
+            key = json.load(f)['key']
+        if key == compute_store_key(image_ids, min_side, max_side, get_image_file_stats(dataset, image_ids)):
+            return ResizedImageStore(path, image_ids)
+
+    return build_resized_image_store(dataset, path, min_side=min_side, max_side=max_side, workers=workers, image_ids=image_ids)
@@ -85,7 +85,7 @@ class TransformParameters:
             return cv2.INTER_LANCZOS4
 
 
-def apply_transform(matrix, image, params):
+def apply_transform(matrix, image, params, output_shape=None, output=None):
     """
     Apply a transformation to an image.
 
@@ -95,17 +95,24 @@ def apply_transform(matrix, image, params):
     Mathematically speaking, that means that the matrix is a transformation from the transformed image space to the original image space.
 
     Parameters:
-      matrix: A homogeneous 3 by 3 matrix holding representing the transformation to apply.
-      image:  The image to transform.
-      params: The transform parameters (see TransformParameters)
+      matrix:       A homogeneous 3 by 3 matrix holding representing the transformation to apply.
+      image:        The image to transform.
+      params:       The transform parameters (see TransformParameters)
+      output_shape: The (height, width) of the generated image, defaults to the shape of image
+      output:       Optional array to write the generated image into (channels last and of the same dtype as image)
     """
     if params.channel_axis != 2:
-        image = np.moveaxis(image, params.channel_axis, 2)
+        image  = np.moveaxis(image, params.channel_axis, 2)
+        output = None
+
+    if output_shape is None:
+        output_shape = image.shape[:2]
 
     output = cv2.warpAffine(
         image,
         matrix[:2, :],
-        dsize       = (image.shape[1], image.shape[0]),
+        dsize       = (output_shape[1], output_shape[0]),
+        dst         = output,
         flags       = params.cvInterpolation(),
         borderMode  = params.cvBorderMode(),
         borderValue = params.cval,
@@ -116,9 +123,20 @@ def apply_transform(matrix, image, params):
     return output
 
 
-def resize_image_1(img, min_side=800, max_side=1333):
-    rows, cols = img.shape[:2]
+def compute_resize_transform(scale):
+    """ Computes the homogeneous 3 by 3 matrix which resizes an image by scale
+    Pixel centers are mapped the same way as cv2.resize, x' = scale * (x + 0.5) - 0.5
+    """
+    offset = 0.5 * scale - 0.5
+    return np.array([
+        [scale, 0    , offset],
+        [0    , scale, offset],
+        [0    , 0    , 1     ]
+    ])
+
 
+def compute_resize_scale(rows, cols, min_side=800, max_side=1333):
+    """ Computes the scale resize_image_1 resizes an image of shape (rows, cols) with """
     smallest_side = min(rows, cols)
 
     # rescale the image so the smallest side is min_side
@@ -130,6 +148,15 @@ def resize_image_1(img, min_side=800, max_side=1333):
     if largest_side * scale > max_side:
         scale = max_side / largest_side
 
+    return scale
+
+
+def resize_image_1(img, min_side=800, max_side=1333):
+    rows, cols = img.shape[:2]
+
+    # compute the scale to resize the image with
+    scale = compute_resize_scale(rows, cols, min_side=min_side, max_side=max_side)
+
     # resize the image with the computed scale
     img = cv2.resize(img, None, fx=scale, fy=scale)
 
@@ -138,7 +165,7 @@ def resize_image_1(img, min_side=800, max_side=1333):
 def resize_image_2(img, width=224, height=224, stretch_to_fill=False):
     if stretch_to_fill:
         # If to fill to maximum width and height
-        img = cv2.resize(img, dize=(width, height))
+        img = cv2.resize(img, dsize=(width, height))
 
     else:
         # Else we identify which axis to scale against
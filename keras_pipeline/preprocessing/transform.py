@@ -38,6 +38,35 @@ def transform_aabb(transform, aabb):
     return [min_corner[0], min_corner[1], max_corner[0], max_corner[1]]
 
 
+def transform_aabbs(transform, aabbs):
+    """ Apply a transformation to an array of axis aligned bounding boxes.
+
+    Same as transform_aabb applied to every AABB, computed with a single matrix multiplication.
+
+    # Arguments
+        transform: The transformation to apply.
+        aabbs:     (N, 4) array of AABBs as (x1, y1, x2, y2).
+    # Returns
+        The new AABBs as a (N, 4) array
+    """
+    aabbs = np.asarray(aabbs)
+    x1, y1, x2, y2 = aabbs[:, 0], aabbs[:, 1], aabbs[:, 2], aabbs[:, 3]
+
+    # Transform all 4 corners of every AABB, corners are of shape (3, 4 * N)
+    corners = np.stack([
+        np.concatenate([x1, x2, x1, x2]),
+        np.concatenate([y1, y2, y2, y1]),
+        np.ones(4 * aabbs.shape[0]),
+    ])
+    points = transform.dot(corners)[:2].reshape((2, 4, -1))
+
+    # Extract the min and max corners again.
+    min_corner = points.min(axis=1)
+    max_corner = points.max(axis=1)
+
+    return np.stack([min_corner[0], min_corner[1], max_corner[0], max_corner[1]], axis=1)
+
+
 def _random_vector(min, max, prng=DEFAULT_PRNG):
     """ Construct a random vector between min and max.
     # Arguments
@@ -233,6 +262,58 @@ def random_transform(
     ])
 
 
+def random_transform_batch(
+    n,
+    min_rotation=0,
+    max_rotation=0,
+    min_translation=(0, 0),
+    max_translation=(0, 0),
+    min_shear=0,
+    max_shear=0,
+    min_scaling=(1, 1),
+    max_scaling=(1, 1),
+    flip_x_chance=0,
+    flip_y_chance=0,
+    prng=DEFAULT_PRNG
+):
+    """ Create n random transformations at once.
+
+    Same as calling random_transform n times, but every component is sampled for all transformations
+    with a single prng call and the matrices are composed with a batched matrix multiplication.
+
+    # Arguments
+        n: The number of transformations to create.
+        The other arguments are the same as for random_transform.
+    # Returns
+        The transformations as a (n, 3, 3) array
+    """
+    angles       = prng.uniform(min_rotation, max_rotation, size=n)
+    translations = prng.uniform(min_translation, max_translation, size=(n, 2))
+    shears       = prng.uniform(min_shear, max_shear, size=n)
+    scales       = prng.uniform(min_scaling, max_scaling, size=(n, 2))
+    flips        = prng.uniform(0, 1, size=(n, 2)) < (flip_x_chance, flip_y_chance)
+
+    # Flips are applied as scaling by -1
+    scales = scales * (1 - 2 * flips)
+
+    rotations = np.zeros((n, 3, 3))
+    rotations[:, 0, 0] =  np.cos(angles)
+    rotations[:, 0, 1] = -np.sin(angles)
+    rotations[:, 1, 0] =  np.sin(angles)
+    rotations[:, 1, 1] =  np.cos(angles)
+    rotations[:, 2, 2] =  1
+
+    # translation, shear and scaling combined
+    linear = np.zeros((n, 3, 3))
+    linear[:, 0, 0] =  scales[:, 0]
+    linear[:, 0, 1] = -np.sin(shears) * scales[:, 1]
+    linear[:, 1, 1] =  np.cos(shears) * scales[:, 1]
+    linear[:, :2, 2] = translations
+    linear[:, 2, 2] =  1
+
+    return np.matmul(rotations, linear)
+
+
 def random_transform_generator(prng=None, **kwargs):
     """ Create a random transform generator.
 
@@ -25,3 +25,11 @@ def is_valid_input_tensor(input_tensor):
     valid_len  = len(input_tensor) == 3
 
     return valid_type & valid_len
+
+
+def is_positive(x):
+    return x > 0
+
+
+def is_non_negative(x):
+    return x >= 0
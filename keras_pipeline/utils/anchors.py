@@ -1,12 +1,16 @@
+import threading
+from collections import OrderedDict, namedtuple
+
 import numpy as np
 
 
-def compute_overlap(a, b):
+def compute_overlap(a, b, a_area=None):
     """
     Parameters
     ----------
     a: (N, 4) ndarray of float
     b: (K, 4) ndarray of float
+    a_area: (N,) ndarray of float, precomputed areas of a (optional)
     Returns
     -------
     overlaps: (N, K) ndarray of overlap between boxes and query_boxes
@@ -19,7 +23,10 @@ def compute_overlap(a, b):
     iw = np.maximum(iw, 0)
     ih = np.maximum(ih, 0)
 
-    ua = np.expand_dims((a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), axis=1) + area - iw * ih
+    if a_area is None:
+        a_area = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+
+    ua = np.expand_dims(a_area, axis=1) + area - iw * ih
 
     ua = np.maximum(ua, np.finfo(float).eps)
 
@@ -126,7 +133,12 @@ def generate_anchors(base_size=16, ratios=None, scales=None):
     return anchors
 
 
-def compute_all_anchors(
+# Grid of anchors of a single pyramid level, the anchors of the level are found at
+# offset + (y * shape[1] + x) * len(anchors) + a for the feature map location (y, x) and base anchor a
+AnchorLevel = namedtuple('AnchorLevel', ['offset', 'shape', 'stride', 'anchors'])
+
+
+def compute_anchor_levels(
     image_shape,
     sizes           = [8, 16, 32, 64, 128],
     strides         = [32, 64, 128, 256, 512],
@@ -134,18 +146,13 @@ def compute_all_anchors(
     scales          = [2. ** 0., 2. ** (1. / 3.), 2 ** (2. / 3.)],
     shapes_callback = None,
 ):
-    """ Generate all anchors based on image_shape as well as anchor configs and pyramid_levels
+    """ Compute the anchor grid of every pyramid level of image_shape
 
     Args
-        image_shape     : (height, width) of an image
-        sizes           : List of sizes to use. Each size corresponds to one feature level
-        strides         : List of strides to use. Each stride corresponds to one feature level
-        ratios          : List of ratios to use per location in a feature map
-        scales          : List of scales to use per location in a feature map
-        shapes_callback : A function that calculates the pyramid_feature_shapes given an image_shape
+        Same as compute_all_anchors
 
     Returns
-        All anchors for image_shape
+        List of AnchorLevel, one per pyramid level
 
     """
 
@@ -161,56 +168,420 @@ def compute_all_anchors(
 
     image_shapes = shapes_callback(image_shape)
 
-    # compute anchors over all pyramid levels
-    all_anchors = np.zeros((0, 4))
+    levels = []
+    offset = 0
     for idx in range(len(sizes)):
-        anchors         = generate_anchors(base_size=sizes[idx], ratios=ratios, scales=scales)
-        shifted_anchors = shift(image_shapes[idx], strides[idx], anchors)
-        all_anchors     = np.append(all_anchors, shifted_anchors, axis=0)
+        anchors = generate_anchors(base_size=sizes[idx], ratios=ratios, scales=scales)
+        shape   = tuple(int(x) for x in image_shapes[idx][:2])
+        levels.append(AnchorLevel(offset=offset, shape=shape, stride=strides[idx], anchors=anchors))
+        offset += shape[0] * shape[1] * anchors.shape[0]
 
-    return all_anchors
+    return levels
 
 
-def anchor_targets_bbox(
+def compute_all_anchors(
     image_shape,
+    sizes           = [8, 16, 32, 64, 128],
+    strides         = [32, 64, 128, 256, 512],
+    ratios          = [0.5, 1., 2.],
+    scales          = [2. ** 0., 2. ** (1. / 3.), 2 ** (2. / 3.)],
+    shapes_callback = None,
+):
+    """ Generate all anchors based on image_shape as well as anchor configs and pyramid_levels
+
+    Args
+        image_shape     : (height, width) of an image
+        sizes           : List of sizes to use. Each size corresponds to one feature level
+        strides         : List of strides to use. Each stride corresponds to one feature level
+        ratios          : List of ratios to use per location in a feature map
+        scales          : List of scales to use per location in a feature map
+        shapes_callback : A function that calculates the pyramid_feature_shapes given an image_shape
+
+    Returns
+        All anchors for image_shape
+
+    """
+    levels = compute_anchor_levels(
+        image_shape,
+        sizes           = sizes,
+        strides         = strides,
+        ratios          = ratios,
+        scales          = scales,
+        shapes_callback = shapes_callback,
+    )
+    return shift_anchor_levels(levels)
+
+
+def shift_anchor_levels(levels):
+    """ Computes the anchors of every location of every AnchorLevel """
+    return np.concatenate([shift(level.shape, level.stride, level.anchors) for level in levels], axis=0)
+
+
+# Anchors of an image shape along with values derived from them
+# (levels is None if the anchors are not known to be laid out as AnchorLevel grids)
+AnchorSet = namedtuple('AnchorSet', ['anchors', 'centers', 'areas', 'levels'])
+
+
+def compute_anchor_set(anchors, levels=None):
+    """ Computes the centers (N, 2) and areas (N,) of anchors and returns them as a read-only AnchorSet """
+    centers = np.vstack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2]).T
+    areas   = (anchors[:, 2] - anchors[:, 0]) * (anchors[:, 3] - anchors[:, 1])
+
+    for array in [anchors, centers, areas]:
+        array.flags.writeable = False
+
+    return AnchorSet(anchors=anchors, centers=centers, areas=areas, levels=levels)
+
+
+class AnchorCache(object):
+    """ Thread safe least recently used cache of the anchors of image shapes
+
+    Anchors only depend on the (height, width) of the (padded) image and the anchor config,
+    so every image of a batch and every batch of the same shape can share the same anchors.
+
+    Args
+        max_size        : Maximum number of image shapes to hold anchors of, 0 disables caching
+        sizes           : List of sizes to use. Each size corresponds to one feature level
+        strides         : List of strides to use. Each stride corresponds to one feature level
+        ratios          : List of ratios to use per location in a feature map
+        scales          : List of scales to use per location in a feature map
+        shapes_callback : A function that calculates the pyramid_feature_shapes given an image_shape
+
+    """
+    def __init__(
+        self,
+        max_size,
+        sizes           = [8, 16, 32, 64, 128],
+        strides         = [32, 64, 128, 256, 512],
+        ratios          = [0.5, 1., 2.],
+        scales          = [2. ** 0., 2. ** (1. / 3.), 2 ** (2. / 3.)],
+        shapes_callback = None,
+    ):
+        self.max_size        = max_size
+        self.sizes           = sizes
+        self.strides         = strides
+        self.ratios          = ratios
+        self.scales          = scales
+        self.shapes_callback = shapes_callback
+        self._reset()
+
+    def _reset(self):
+        self.lock        = threading.Lock()
+        self.anchor_sets = OrderedDict()
+        self.config_key  = (
+            tuple(self.sizes),
+            tuple(self.strides),
+            tuple(self.ratios),
+            tuple(self.scales),
+            self.shapes_callback
+        )
+
+    def compute(self, image_shape):
+        """ Computes the AnchorSet of image_shape without using the cache """
+        levels = compute_anchor_levels(
+            image_shape,
+            sizes           = self.sizes,
+            strides         = self.strides,
+            ratios          = self.ratios,
+            scales          = self.scales,
+            shapes_callback = self.shapes_callback,
+        )
+        return compute_anchor_set(shift_anchor_levels(levels), levels=levels)
+
+    def get(self, image_shape):
+        """ Returns the AnchorSet of image_shape, computing it if it is not cached """
+        if not self.max_size:
+            return self.compute(image_shape)
+
+        key = (tuple(int(x) for x in image_shape[:2]), self.config_key)
+
+        with self.lock:
+            anchor_set = self.anchor_sets.pop(key, None)
+            if anchor_set is not None:
+                # Move anchor set to the most recently used position
+                self.anchor_sets[key] = anchor_set
+                return anchor_set
+
+        anchor_set = self.compute(image_shape)
+
+        with self.lock:
+            self.anchor_sets[key] = anchor_set
+            while len(self.anchor_sets) > self.max_size:
+                self.anchor_sets.popitem(last=False)
+
+        return anchor_set
+
+    def __len__(self):
+        return len(self.anchor_sets)
+
+    def __getstate__(self):
+        # Cached anchors are not sent along to other processes
+        state = self.__dict__.copy()
+        for attr in ['lock', 'anchor_sets', 'config_key']:
+            state.pop(attr)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+
+def compute_candidate_pairs(levels, boxes):
+    """ Finds the anchors which can overlap with each box based on the regular grid of every level
+    Returns a superset of the (anchor, box) pairs with a non zero overlap
+
+    Args
+        levels : List of AnchorLevel
+        boxes  : (K, 4) array of boxes as [x1, y1, x2, y2]
+
+    Returns
+        anchor_indices, box_indices of the candidate pairs
+
+    """
+    anchor_indices = []
+    box_indices    = []
+
+    for level in levels:
+        num_base = level.anchors.shape[0]
+        height, width = level.shape
+
+        for base_index, base_anchor in enumerate(level.anchors):
+            # an anchor centered at (cx, cy) overlaps with a box if
+            # box_x1 - anchor_x2 < cx < box_x2 - anchor_x1 (and likewise for cy)
+            # centers of the feature map locations are at (i + 0.5) * stride
+            x_start = np.clip(np.floor((boxes[:, 0] - base_anchor[2]) / level.stride - 0.5), 0, width ).astype(np.int64)
+            x_end   = np.clip(np.ceil ((boxes[:, 2] - base_anchor[0]) / level.stride - 0.5) + 1, 0, width ).astype(np.int64)
+            y_start = np.clip(np.floor((boxes[:, 1] - base_anchor[3]) / level.stride - 0.5), 0, height).astype(np.int64)
+            y_end   = np.clip(np.ceil ((boxes[:, 3] - base_anchor[1]) / level.stride - 0.5) + 1, 0, height).astype(np.int64)
+
+            num_x     = np.maximum(x_end - x_start, 0)
+            num_y     = np.maximum(y_end - y_start, 0)
+            num_cells = num_x * num_y
+            if num_cells.sum() == 0:
+                continue
+
+            # enumerate the locations within the range of every box
+            cell_boxes = np.repeat(np.arange(boxes.shape[0]), num_cells)
+            cell_ranks = np.arange(num_cells.sum()) - np.repeat(np.cumsum(num_cells) - num_cells, num_cells)
+            cell_y     = y_start[cell_boxes] + cell_ranks // num_x[cell_boxes]
+            cell_x     = x_start[cell_boxes] + cell_ranks %  num_x[cell_boxes]
+
+            anchor_indices.append(level.offset + (cell_y * width + cell_x) * num_base + base_index)
+            box_indices.append(cell_boxes)
+
+    if not anchor_indices:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+
+    return np.concatenate(anchor_indices), np.concatenate(box_indices)
+
+
+def compute_max_overlaps(anchor_set, annotations):
+    """ Computes for every anchor the index and the overlap of the annotation it overlaps the most with
+    Same as taking the argmax and max of compute_overlap(anchors, annotations) along axis 1,
+    but if the anchor set has levels, only anchor and annotation pairs that can overlap are scored
+
+    Args
+        anchor_set  : AnchorSet of the (padded) image
+        annotations : (K, 5) array of annotations as [x1, y1, x2, y2, label]
+
+    Returns
+        argmax_overlaps_inds, max_overlaps
+
+    """
+    anchors = anchor_set.anchors
+
+    if anchor_set.levels is None:
+        overlaps             = compute_overlap(anchors, annotations, a_area=anchor_set.areas)
+        argmax_overlaps_inds = np.argmax(overlaps, axis=1)
+        max_overlaps         = overlaps[np.arange(overlaps.shape[0]), argmax_overlaps_inds]
+        return argmax_overlaps_inds, max_overlaps
+
+    anchor_indices, box_indices = compute_candidate_pairs(anchor_set.levels, annotations)
+
+    # compute overlaps of candidate pairs only (in the same way as compute_overlap)
+    a    = anchors[anchor_indices]
+    b    = annotations[box_indices]
+    area = (annotations[:, 2] - annotations[:, 0]) * (annotations[:, 3] - annotations[:, 1])
+
+    iw = np.maximum(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0)
+    ih = np.maximum(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0)
+
+    ua = anchor_set.areas[anchor_indices] + area[box_indices] - iw * ih
+    ua = np.maximum(ua, np.finfo(float).eps)
+
+    overlaps = iw * ih / ua
+
+    # keep the largest overlap of each anchor
+    max_overlaps = np.zeros((anchors.shape[0],))
+    np.maximum.at(max_overlaps, anchor_indices, overlaps)
+
+    # ties go to the first annotation like np.argmax
+    # anchors without any overlap are assigned the first annotation as well
+    is_max = np.logical_and(overlaps == max_overlaps[anchor_indices], overlaps > 0)
+    argmax_overlaps_inds = np.full((anchors.shape[0],), annotations.shape[0], dtype=np.int64)
+    np.minimum.at(argmax_overlaps_inds, anchor_indices[is_max], box_indices[is_max])
+    argmax_overlaps_inds[argmax_overlaps_inds == annotations.shape[0]] = 0
+
+    return argmax_overlaps_inds, max_overlaps
+
+
+def compute_anchor_states(
+    anchor_set,
     annotations,
-    num_classes,
-    mask_shape=None,
+    mask_shape,
     negative_overlap=0.4,
-    positive_overlap=0.5,
-    compute_anchors=compute_all_anchors,
-    **kwargs
+    positive_overlap=0.5
 ):
-    anchors = compute_anchors(image_shape)
+    """ Assigns every anchor a state and the annotation it overlaps the most with
+
+    Args
+        anchor_set       : AnchorSet of the (padded) image
+        annotations      : (K, 5) array of annotations as [x1, y1, x2, y2, label]
+        mask_shape       : Shape of the image without padding, anchors centered outside of it are ignored
+        negative_overlap : IoU below which anchors are negative
+        positive_overlap : IoU above which anchors are positive
+
+    Returns
+        anchor_states : (N,) int8 array, -1 for ignore, 0 for negative and 1 for positive anchors
+        annotations   : (N, 5) array of the annotation assigned to every anchor
+
+    """
+    anchors = anchor_set.anchors
 
-    # label: 1 is positive, 0 is negative, -1 is dont care
-    labels = np.ones((anchors.shape[0], num_classes)) * -1
+    # state: 1 is positive, 0 is negative, -1 is dont care
+    anchor_states = np.full((anchors.shape[0],), -1, dtype=np.int8)
 
     if annotations.shape[0]:
         # obtain indices of gt annotations with the greatest overlap
-        overlaps             = compute_overlap(anchors, annotations)
-        argmax_overlaps_inds = np.argmax(overlaps, axis=1)
-        max_overlaps         = overlaps[np.arange(overlaps.shape[0]), argmax_overlaps_inds]
+        argmax_overlaps_inds, max_overlaps = compute_max_overlaps(anchor_set, annotations)
 
-        # assign bg labels first so that positive labels can clobber them
-        labels[max_overlaps < negative_overlap, :] = 0
+        # assign bg states first so that positive states can clobber them
+        anchor_states[max_overlaps < negative_overlap] = 0
+
+        # fg state: above threshold IOU
+        anchor_states[max_overlaps >= positive_overlap] = 1
 
         # compute box regression targets
         annotations = annotations[argmax_overlaps_inds]
-
-        # fg label: above threshold IOU
-        positive_indices = max_overlaps >= positive_overlap
-        labels[positive_indices, :] = 0
-        labels[positive_indices, annotations[positive_indices, 4].astype(int)] = 1
     else:
         # no annotations? then everything is background
-        labels[:] = 0
+        anchor_states[:] = 0
         annotations = np.zeros((anchors.shape[0], annotations.shape[1]))
 
     # ignore annotations outside of image
-    mask_shape         = image_shape if mask_shape is None else mask_shape
-    anchors_centers    = np.vstack([(anchors[:, 0] + anchors[:, 2]) / 2, (anchors[:, 1] + anchors[:, 3]) / 2]).T
-    indices            = np.logical_or(anchors_centers[:, 0] >= mask_shape[1], anchors_centers[:, 1] >= mask_shape[0])
-    labels[indices, :] = -1
+    anchors_centers = anchor_set.centers
+    indices         = np.logical_or(anchors_centers[:, 0] >= mask_shape[1], anchors_centers[:, 1] >= mask_shape[0])
+    anchor_states[indices] = -1
+
+    return anchor_states, annotations
+
+
+def compute_anchor_labels(anchor_states, annotations, num_classes, labels=None):
+    """ Computes the classification targets of anchors from their states
+
+    Args
+        anchor_states : (N,) array of anchor states as returned by compute_anchor_states
+        annotations   : (N, 5) array of the annotation assigned to every anchor
+        num_classes   : Number of classes
+        labels        : Optional (N, num_classes) array the labels are written into
+
+    Returns
+        (N, num_classes) labels, 1 is positive, 0 is negative, -1 is dont care
+
+    """
+    if labels is None:
+        labels = np.empty((anchor_states.shape[0], num_classes))
+
+    labels[...] = 0
+    labels[anchor_states == -1, :] = -1
+
+    positive_indices = np.flatnonzero(anchor_states == 1)
+    labels[positive_indices, annotations[positive_indices, 4].astype(int)] = 1
+
+    return labels
+
+
+def anchor_targets_bbox(
+    image_shape,
+    annotations,
+    num_classes,
+    mask_shape=None,
+    negative_overlap=0.4,
+    positive_overlap=0.5,
+    compute_anchors=compute_all_anchors,
+    anchor_set=None,
+    **kwargs
+):
+    """ Computes the classification and regression targets of the anchors of an image
+
+    Args
+        image_shape      : Shape of the (padded) image the anchors are computed for
+        annotations      : (K, 5) array of annotations as [x1, y1, x2, y2, label]
+        num_classes      : Number of classes
+        mask_shape       : Shape of the image without padding, anchors centered outside of it are ignored
+        negative_overlap : IoU below which anchors are negative
+        positive_overlap : IoU above which anchors are positive
+        compute_anchors  : Function which computes the anchors of image_shape, used if anchor_set is None
+        anchor_set       : Precomputed AnchorSet of image_shape (eg. from an AnchorCache)
+
+    Returns
+        labels, annotations assigned to every anchor and the anchors
+
+    """
+    if anchor_set is None:
+        anchor_set = compute_anchor_set(compute_anchors(image_shape))
+
+    anchor_states, annotations = compute_anchor_states(
+        anchor_set,
+        annotations,
+        image_shape if mask_shape is None else mask_shape,
+        negative_overlap = negative_overlap,
+        positive_overlap = positive_overlap
+    )
+
+    labels = compute_anchor_labels(anchor_states, annotations, num_classes)
+
+    return labels, annotations, anchor_set.anchors
+
+
+def compact_anchor_targets_bbox(
+    image_shape,
+    annotations,
+    mask_shape=None,
+    negative_overlap=0.4,
+    positive_overlap=0.5,
+    compute_anchors=compute_all_anchors,
+    anchor_set=None
+):
+    """ Computes the targets of the anchors of an image in a compact form
+    where regression targets are only computed for positive anchors
+
+    Args
+        Same as anchor_targets_bbox
+
+    Returns
+        anchor_states    : (N,) int8 array, -1 for ignore, 0 for negative and 1 for positive anchors
+        anchor_classes   : (N,) int array of the class of every anchor (0 for non positive anchors)
+        positive_indices : (P,) indices of the positive anchors
+        regression       : (P, 4) regression targets of the positive anchors
+
+    """
+    if anchor_set is None:
+        anchor_set = compute_anchor_set(compute_anchors(image_shape))
+
+    anchor_states, annotations = compute_anchor_states(
+        anchor_set,
+        annotations,
+        image_shape if mask_shape is None else mask_shape,
+        negative_overlap = negative_overlap,
+        positive_overlap = positive_overlap
+    )
+
+    positive_indices = np.flatnonzero(anchor_states == 1)
+
+    anchor_classes = np.zeros((anchor_states.shape[0],), dtype=np.int32)
+    anchor_classes[positive_indices] = annotations[positive_indices, 4]
+
+    regression = bbox_transform(anchor_set.anchors[positive_indices], annotations[positive_indices])
 
-    return labels, annotations, anchors
+    return anchor_states, anchor_classes, positive_indices, regression
@@ -0,0 +1,175 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUArrayCache(object):
+    """ Thread safe least recently used cache of numpy arrays bounded by their total size in bytes
+
+    Cached arrays are made read-only as they are shared between all users of the cache.
+    Hits, misses and evictions are counted and available as attributes.
+
+    Args
+        max_bytes : Maximum total size in bytes of the arrays in the cache
+
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def _reset(self):
+        self.lock      = threading.Lock()
+        self.arrays    = OrderedDict()
+        self.num_bytes = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Returns the array stored under key or None if it is not cached """
+        with self.lock:
+            array = self.arrays.pop(key, None)
+            if array is None:
+                self.misses += 1
+                return None
+
+            # Move array to the most recently used position
+            self.arrays[key] = array
+            self.hits += 1
+
+        return array
+
+    def put(self, key, array):
+        """ Stores an array under key, evicting the least recently used arrays if the cache is full
+        Arrays larger than max_bytes are not cached
+        """
+        if array.nbytes > self.max_bytes:
+            return
+
+        array.flags.writeable = False
+
+        with self.lock:
+            old_array = self.arrays.pop(key, None)
+            if old_array is not None:
+                self.num_bytes -= old_array.nbytes
+
+            while self.num_bytes + array.nbytes > self.max_bytes:
+                _, evicted_array = self.arrays.popitem(last=False)
+                self.num_bytes -= evicted_array.nbytes
+                self.evictions += 1
+
+            self.arrays[key] = array
+            self.num_bytes += array.nbytes
+
+    def get_stats(self):
+        """ Returns the cache counters as a dict """
+        with self.lock:
+            return {
+                'hits'      : self.hits,
+                'misses'    : self.misses,
+                'evictions' : self.evictions,
+                'size'      : len(self.arrays),
+                'num_bytes' : self.num_bytes,
+            }
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def __getstate__(self):
+        # Cached arrays are not sent along to other processes
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.max_bytes = state['max_bytes']
+        self._reset()
+
+
+class BatchBufferPool(object):
+    """ Thread safe pool of preallocated batch arrays, reused for arrays of the same shape and dtype
+
+    An array is only handed out again after its consumer has given it back with release,
+    arrays which are never released are simply left to the garbage collector.
+    If no released array of a shape and dtype is available a new one is allocated.
+    Every shape and dtype keeps at most max_free_buffers released arrays,
+    free arrays are evicted least recently used once more than max_keys shapes are in use.
+
+    Arrays are not initialized, users of the pool have to overwrite every element.
+
+    Args
+        max_free_buffers : Maximum number of released arrays kept for every shape and dtype
+        max_keys         : Maximum number of shapes and dtypes to keep released arrays for
+
+    """
+    def __init__(self, max_free_buffers=2, max_keys=64):
+        self.max_free_buffers = max_free_buffers
+        self.max_keys         = max_keys
+        self._reset()
+
+    def _reset(self):
+        self.lock        = threading.Lock()
+        self.free_arrays = OrderedDict()
+        self.allocations = 0
+        self.reuses      = 0
+        self.evictions   = 0
+
+    @staticmethod
+    def _key(shape, dtype):
+        return (tuple(int(d) for d in shape), np.dtype(dtype).str)
+
+    def get(self, shape, dtype):
+        """ Returns a released array of shape and dtype, or a newly allocated one if none is available """
+        key = self._key(shape, dtype)
+
+        with self.lock:
+            free_arrays = self.free_arrays.get(key)
+            if free_arrays:
+                self.reuses += 1
+                return free_arrays.pop()
+            self.allocations += 1
+
+        return np.empty(key[0], dtype=key[1])
+
+    def release(self, array):
+        """ Gives an array back to the pool, the array must no longer be used by its consumer
+        Arrays which do not own their memory (eg. views of shared memory) are not kept
+        """
+        if not array.flags.owndata:
+            return
+
+        key = self._key(array.shape, array.dtype)
+
+        with self.lock:
+            free_arrays = self.free_arrays.pop(key, [])
+            while len(self.free_arrays) >= self.max_keys:
+                self.free_arrays.popitem(last=False)
+                self.evictions += 1
+
+            # Move free arrays to the most recently used position
+            self.free_arrays[key] = free_arrays
+
+            # An array released twice must not be handed out twice
+            if len(free_arrays) < self.max_free_buffers and not any(a is array for a in free_arrays):
+                free_arrays.append(array)
+
+    def get_stats(self):
+        """ Returns the pool counters as a dict """
+        with self.lock:
+            return {
+                'allocations' : self.allocations,
+                'reuses'      : self.reuses,
+                'evictions'   : self.evictions,
+                'size'        : len(self.free_arrays),
+            }
+
+    def __len__(self):
+        return len(self.free_arrays)
+
+    def __getstate__(self):
+        # Buffers are not sent along to other processes
+        return {'max_free_buffers': self.max_free_buffers, 'max_keys': self.max_keys}
+
+    def __setstate__(self, state):
+        self.max_free_buffers = state['max_free_buffers']
+        self.max_keys         = state['max_keys']
+        self._reset()
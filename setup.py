@@ -17,6 +17,7 @@ setuptools.setup(
         'keras_pipeline.callbacks',
         'keras_pipeline.evaluation',
         'keras_pipeline.preprocessing',
-        'keras_pipeline.generators'
+        'keras_pipeline.generators',
+        'keras_pipeline.datasets'
     ]
 )
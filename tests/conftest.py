@@ -0,0 +1,130 @@
+import io
+import os
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def compute_pyramid_feature_shapes_for_img_shape(image_shape):
+    image_shape = np.array(image_shape[:2])
+    return [np.ceil(image_shape / 2 ** level).astype(int) for level in range(3, 8)]
+
+
+class ModelConfig(object):
+    """ The anchor parameters of a RetinaNet model without building one """
+    anchor_sizes   = [32, 64, 128, 256, 512]
+    anchor_strides = [8, 16, 32, 64, 128]
+    anchor_ratios  = np.array([0.5, 1, 2])
+    anchor_scales  = np.array([2 ** 0, 2 ** (1.0 / 3.0), 2 ** (2.0 / 3.0)])
+    compute_pyramid_feature_shapes_for_img_shape = staticmethod(compute_pyramid_feature_shapes_for_img_shape)
+
+
+class DetectionDataset(object):
+    """ In memory detection dataset of images of random sizes filled with their image index """
+    def __init__(self, num_images=12, num_classes=3, seed=0):
+        prng = np.random.RandomState(seed)
+        self.num_classes = num_classes
+        self.shapes      = [(int(prng.randint(100, 400)), int(prng.randint(100, 400))) for _ in range(num_images)]
+        self.annotations = []
+        for height, width in self.shapes:
+            x1 = prng.uniform(0, width / 2, size=4)
+            y1 = prng.uniform(0, height / 2, size=4)
+            x2 = x1 + prng.uniform(10, width / 2, size=4)
+            y2 = y1 + prng.uniform(10, height / 2, size=4)
+            labels = prng.randint(0, num_classes, size=4)
+            self.annotations.append(np.stack([x1, y1, x2, y2, labels], axis=1))
+
+    def list_all_image_index(self):
+        return list(range(len(self.shapes)))
+
+    def get_size(self):
+        return len(self.shapes)
+
+    def get_num_classes(self):
+        return self.num_classes
+
+    def get_image_aspect_ratio(self, image_index):
+        height, width = self.shapes[image_index]
+        return float(width) / height
+
+    def get_image_size(self, image_index):
+        height, width = self.shapes[image_index]
+        return width, height
+
+    def load_image(self, image_index, size_hint=None):
+        height, width = self.shapes[image_index]
+        return np.full((height, width, 3), image_index, dtype=np.uint8)
+
+    def get_annotations_array(self, image_index):
+        return self.annotations[image_index].copy()
+
+    def label_to_name(self, label):
+        return str(label)
+
+    def name_to_label(self, name):
+        return int(name)
+
+
+class FileDataset(object):
+    """ Dataset of png files in a directory """
+    def __init__(self, directory, num_images=3):
+        self.directory = directory
+        for image_index in range(num_images):
+            self.write_image(image_index, image_index)
+
+    def write_image(self, image_index, value, shape=(40, 60)):
+        Image.fromarray(np.full(shape + (3,), value, dtype=np.uint8)).save(self.get_image_path(image_index))
+
+    def list_all_image_index(self):
+        return sorted(int(name.split('.')[0]) for name in os.listdir(self.directory))
+
+    def get_image_path(self, image_index):
+        return os.path.join(self.directory, '{}.png'.format(image_index))
+
+    def load_image(self, image_index):
+        return np.asarray(Image.open(self.get_image_path(image_index)).convert('RGB'))
+
+
+def random_image(shape, seed=0):
+    return Image.fromarray((np.random.RandomState(seed).rand(*shape) * 255).astype(np.uint8))
+
+
+def jpeg_bytes(shape, **kwargs):
+    data = io.BytesIO()
+    random_image(shape).save(data, 'JPEG', **kwargs)
+    return data.getvalue()
+
+
+def insert_app1_segment(jpeg, payload):
+    """ Inserts an APP1 segment (eg. EXIF) right after the start of image marker """
+    return jpeg[:2] + b'\xff\xe1' + struct.pack('>H', 2 + len(payload)) + payload + jpeg[2:]
+
+
+@pytest.fixture
+def dataset():
+    return DetectionDataset()
+
+
+@pytest.fixture
+def make_detection_generator(dataset):
+    """ Returns a function creating a DetectionGenerator of the dataset fixture with small images """
+    from keras_pipeline.generators import DetectionGeneratorConfig, DetectionGenerator
+
+    def make_detection_generator(**kwargs):
+        kwargs.setdefault('image_min_side', 128)
+        kwargs.setdefault('image_max_side', 256)
+        config = DetectionGeneratorConfig(dataset=dataset, model_config=ModelConfig(), **kwargs)
+        return DetectionGenerator(config)
+
+    return make_detection_generator
+
+
+def assert_batches_equal(batch, expected_batch):
+    """ Asserts that two (inputs, targets) batches hold the same arrays """
+    inputs, targets = batch
+    expected_inputs, expected_targets = expected_batch
+    np.testing.assert_array_equal(inputs, expected_inputs)
+    for target, expected_target in zip(targets, expected_targets):
+        np.testing.assert_array_equal(target, expected_target)
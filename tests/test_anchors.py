@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from keras_pipeline.utils.anchors import (
+    AnchorCache,
+    anchor_targets_bbox,
+    bbox_transform,
+    compact_anchor_targets_bbox,
+    compute_anchor_set,
+    compute_max_overlaps,
+    compute_overlap
+)
+
+from .conftest import ModelConfig, compute_pyramid_feature_shapes_for_img_shape
+
+
+def make_anchor_cache(max_size=0):
+    return AnchorCache(
+        max_size,
+        sizes           = ModelConfig.anchor_sizes,
+        strides         = ModelConfig.anchor_strides,
+        ratios          = ModelConfig.anchor_ratios,
+        scales          = ModelConfig.anchor_scales,
+        shapes_callback = compute_pyramid_feature_shapes_for_img_shape
+    )
+
+
+def random_annotations(prng, image_shape, num_annotations):
+    """ Random boxes, some of them tiny, degenerate or partly outside of the image """
+    height, width = image_shape[:2]
+    x1 = prng.uniform(-50, width, size=num_annotations)
+    y1 = prng.uniform(-50, height, size=num_annotations)
+    x2 = x1 + prng.choice([0, 1, 8, 64, 256, 600], size=num_annotations) * prng.uniform(0.5, 1.5, size=num_annotations)
+    y2 = y1 + prng.choice([0, 1, 8, 64, 256, 600], size=num_annotations) * prng.uniform(0.5, 1.5, size=num_annotations)
+    labels = prng.randint(0, 3, size=num_annotations)
+    return np.stack([x1, y1, x2, y2, labels], axis=1)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_sparse_max_overlaps_match_dense(seed):
+    prng        = np.random.RandomState(seed)
+    image_shape = (int(prng.randint(64, 800)), int(prng.randint(64, 800)), 3)
+    annotations = random_annotations(prng, image_shape, int(prng.randint(1, 20)))
+
+    sparse_set = make_anchor_cache().compute(image_shape)
+    dense_set  = compute_anchor_set(sparse_set.anchors.copy())
+
+    argmax_inds, max_overlaps = compute_max_overlaps(sparse_set, annotations)
+    expected_argmax_inds, expected_max_overlaps = compute_max_overlaps(dense_set, annotations)
+
+    np.testing.assert_array_equal(max_overlaps, expected_max_overlaps)
+    np.testing.assert_array_equal(argmax_inds, expected_argmax_inds)
+
+    # the dense path is compute_overlap itself
+    overlaps = compute_overlap(dense_set.anchors, annotations)
+    np.testing.assert_array_equal(expected_argmax_inds, np.argmax(overlaps, axis=1))
+
+
+def test_anchor_cache_reuses_anchor_sets():
+    cache = make_anchor_cache(max_size=2)
+
+    anchor_set = cache.get((256, 320, 3))
+    assert cache.get((256, 320, 3)) is anchor_set
+    assert not anchor_set.anchors.flags.writeable
+
+    cache.get((128, 128, 3))
+    cache.get((64, 64, 3))
+    assert len(cache) == 2
+    assert cache.get((256, 320, 3)) is not anchor_set
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_compact_targets_match_full_targets(seed):
+    prng        = np.random.RandomState(seed)
+    image_shape = (int(prng.randint(64, 512)), int(prng.randint(64, 512)), 3)
+    mask_shape  = (image_shape[0] - int(prng.randint(0, 32)), image_shape[1] - int(prng.randint(0, 32)), 3)
+    annotations = random_annotations(prng, mask_shape, int(prng.randint(1, 10)))
+    anchor_set  = make_anchor_cache().compute(image_shape)
+
+    labels, assigned_annotations, anchors = anchor_targets_bbox(
+        image_shape, annotations, 3, mask_shape=mask_shape, anchor_set=anchor_set)
+    anchor_states, anchor_classes, positive_indices, regression = compact_anchor_targets_bbox(
+        image_shape, annotations, mask_shape=mask_shape, anchor_set=anchor_set)
+
+    # states are -1 exactly where labels are ignored, positive anchors have a single positive class
+    np.testing.assert_array_equal(anchor_states == -1, np.all(labels == -1, axis=1))
+    np.testing.assert_array_equal(anchor_states == 1, np.any(labels == 1, axis=1))
+    np.testing.assert_array_equal(np.argmax(labels[positive_indices], axis=1), anchor_classes[positive_indices])
+    assert np.all(anchor_classes[anchor_states != 1] == 0)
+
+    # regression targets are the same as the full ones at the positive anchors
+    np.testing.assert_array_equal(positive_indices, np.flatnonzero(anchor_states == 1))
+    np.testing.assert_allclose(regression, bbox_transform(anchors, assigned_annotations)[positive_indices])
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+
+@pytest.mark.parametrize('group_method', ['ratio', 'bucket'])
+def test_vectorized_shape_prediction_matches_predict_resized_shape(dataset, make_detection_generator, group_method):
+    generator = make_detection_generator(group_method=group_method, bucket_stride=32)
+    sizes     = [dataset.get_image_size(image_index) for image_index in dataset.list_all_image_index()]
+
+    heights, widths = generator.predict_snapped_shapes([h for _, h in sizes], [w for w, _ in sizes])
+    expected = [generator.snap_shape(generator.predict_resized_shape(i)) for i in dataset.list_all_image_index()]
+    assert list(zip(heights.tolist(), widths.tolist())) == expected
+
+
+def test_max_batch_size_from_image_index(make_detection_generator, tmpdir):
+    budget   = 3 * 128 * 256
+    expected = make_detection_generator(batch_pixel_budget=budget).max_batch_size
+
+    generator = make_detection_generator(batch_pixel_budget=budget, image_index_path=str(tmpdir.join('index.npz')))
+    assert generator.max_batch_size == expected
+
+    # Every group fits in the pixel budget and in max_batch_size
+    for group in generator._group_image_ids():
+        shapes = [generator.predict_resized_shape(image_index) for image_index in group]
+        height = max(shape[0] for shape in shapes)
+        width  = max(shape[1] for shape in shapes)
+        assert len(group) <= generator.max_batch_size
+        assert len(group) == 1 or len(group) * height * width <= budget
+
+
+def test_bucket_grouping_pads_to_the_bucket_stride(make_detection_generator):
+    generator = make_detection_generator(group_method='bucket', batch_size=2)
+    assert generator.bucket_stride == 32
+
+    for _ in range(len(generator._group_image_ids())):
+        image_batch, _ = generator.next()
+        assert image_batch.shape[1] % 32 == 0 and image_batch.shape[2] % 32 == 0
+
+    # A finer stride wastes less padding than the largest anchor stride
+    coarse = make_detection_generator(group_method='bucket', batch_size=2, bucket_stride=128)
+    coarse._group_image_ids()
+    assert generator.padding_efficiency > coarse.padding_efficiency
+
+
+@pytest.mark.parametrize('group_method', ['ratio', 'bucket'])
+def test_fused_transform_matches_unfused(make_detection_generator, group_method):
+    fused   = make_detection_generator(group_method=group_method, batch_size=3, fused_transform=True)
+    unfused = make_detection_generator(group_method=group_method, batch_size=3, fused_transform=False)
+
+    for group in unfused._group_image_ids():
+        inputs, targets = fused._get_batches_of_transformed_samples(group)
+        expected_inputs, expected_targets = unfused._get_batches_of_transformed_samples(group)
+
+        # images are filled with their index, only the interpolation at their border differs
+        assert inputs.shape == expected_inputs.shape
+        np.testing.assert_allclose(inputs[:, 2:-2, 2:-2], expected_inputs[:, 2:-2, 2:-2], atol=1)
+        for target, expected_target in zip(targets, expected_targets):
+            np.testing.assert_allclose(target, expected_target, rtol=1e-5, atol=1e-5)
+
+
+def test_compact_targets_match_full_targets(make_detection_generator):
+    compact = make_detection_generator(batch_size=3, compact_targets=True)
+    full    = make_detection_generator(batch_size=3, compact_targets=False)
+
+    for group in full._group_image_ids():
+        _, (labels_batch, regression_batch) = compact._get_batches_of_transformed_samples(group)
+        _, (expected_labels, expected_regression) = full._get_batches_of_transformed_samples(group)
+
+        anchor_states = labels_batch[..., 0]
+        np.testing.assert_array_equal(anchor_states, expected_regression[..., 4])
+
+        for index in range(len(group)):
+            positive_indices = np.flatnonzero(anchor_states[index] == 1)
+            np.testing.assert_array_equal(
+                expected_labels[index, positive_indices].argmax(axis=1),
+                labels_batch[index, positive_indices, 1]
+            )
+
+            # positive anchors first, padded with anchor index -1
+            rows = regression_batch[index]
+            np.testing.assert_array_equal(rows[:len(positive_indices), 0], positive_indices)
+            assert np.all(rows[len(positive_indices):, 0] == -1)
+            np.testing.assert_allclose(
+                rows[:len(positive_indices), 1:],
+                expected_regression[index, positive_indices, :4],
+                rtol=1e-5
+            )
@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('tqdm')
+
+from keras_pipeline.evaluation.eval import (
+    _compute_ap_from_matches,
+    _match_detections,
+    evaluate_detection,
+    evaluate_detection_coco
+)
+from keras_pipeline.utils.anchors import compute_overlap
+
+
+def match_detections_loop(detections, annotations, iou_threshold):
+    """ Matches detections one at a time, the way evaluate_detection used to """
+    true_positives       = np.zeros((detections.shape[0],), dtype=bool)
+    detected_annotations = []
+
+    for index, d in enumerate(detections):
+        if annotations.shape[0] == 0:
+            continue
+
+        overlaps            = compute_overlap(np.expand_dims(d, axis=0), annotations)
+        assigned_annotation = np.argmax(overlaps, axis=1)[0]
+        max_overlap         = overlaps[0, assigned_annotation]
+
+        if max_overlap >= iou_threshold and assigned_annotation not in detected_annotations:
+            true_positives[index] = True
+            detected_annotations.append(assigned_annotation)
+
+    return true_positives
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_match_detections_matches_loop(seed):
+    prng            = np.random.RandomState(seed)
+    num_annotations = int(prng.randint(0, 8))
+    num_detections  = int(prng.randint(0, 30))
+
+    xy1         = prng.uniform(0, 200, size=(num_annotations, 2))
+    annotations = np.hstack([xy1, xy1 + prng.uniform(5, 100, size=(num_annotations, 2))])
+
+    # detections around the annotations (with duplicates) and random ones, sorted by score
+    if num_annotations:
+        centers = annotations[prng.randint(0, num_annotations, size=num_detections)]
+    else:
+        centers = np.tile([0., 0., 50., 50.], (num_detections, 1))
+    boxes      = centers + prng.normal(0, 10, size=(num_detections, 4))
+    scores     = np.sort(prng.uniform(size=(num_detections, 1)), axis=0)[::-1]
+    detections = np.hstack([boxes, scores])
+
+    iou_thresholds = np.linspace(0.5, 0.95, 10)
+    true_positives, _ = _match_detections(detections, annotations, iou_thresholds)
+
+    for t, iou_threshold in enumerate(iou_thresholds):
+        np.testing.assert_array_equal(true_positives[t], match_detections_loop(detections, annotations, iou_threshold))
+
+
+def test_average_precision_of_perfect_detections():
+    true_positives = np.ones((5,), dtype=bool)
+    assert _compute_ap_from_matches(true_positives, ~true_positives, 5) == pytest.approx(1.0)
+    assert _compute_ap_from_matches(true_positives, ~true_positives, 10) == pytest.approx(0.5)
+
+
+class AnnotationModel(object):
+    """ Model which predicts the (optionally jittered) annotations of every image and optionally a false positive,
+    padded with -1 like the detection outputs of a RetinaNet model
+    """
+    def __init__(self, generator, dataset, noise=0.0, false_positives=True):
+        self.generator       = generator
+        self.dataset         = dataset
+        self.noise           = noise
+        self.false_positives = false_positives
+
+    def predict_on_batch(self, inputs):
+        boxes_batch  = []
+        scores_batch = []
+        labels_batch = []
+        for image in inputs:
+            # images are filled with their index
+            image_index   = int(round(image[0, 0, 0]))
+            width, height = self.dataset.get_image_size(image_index)
+            resized_size  = self.generator.compute_size_hint(image_index)
+            scale         = np.array([resized_size[0] / width, resized_size[1] / height] * 2)
+
+            annotations = self.dataset.get_annotations_array(image_index)
+            prng        = np.random.RandomState(image_index)
+            boxes       = annotations[:, :4] * scale + prng.normal(0, self.noise, size=(len(annotations), 4))
+
+            scores = prng.uniform(0.5, 1, size=len(annotations))
+            labels = annotations[:, 4]
+            if self.false_positives:
+                boxes  = np.vstack([boxes, [[0, 0, 20, 20]]])
+                scores = np.r_[scores, 0.7]
+                labels = np.r_[labels, labels[0]]
+
+            boxes_batch.append(np.vstack([boxes, -np.ones((2, 4))]))
+            scores_batch.append(np.r_[scores, -1, -1])
+            labels_batch.append(np.r_[labels, -1, -1].astype(int))
+
+        return np.array(boxes_batch), np.array(scores_batch), np.array(labels_batch)
+
+
+def test_coco_ap_of_exact_detections(dataset, make_detection_generator):
+    generator = make_detection_generator(group_method=None)
+    model     = AnnotationModel(generator, dataset, false_positives=False)
+
+    results = evaluate_detection_coco(generator, model, max_plots=0, workers=1)
+
+    assert results['average_precisions']['all'].shape == (generator.num_classes, 10)
+    for key in ['mAP', 'AP50', 'AP75', 'APmedium', 'APlarge']:
+        assert results[key] == pytest.approx(1.0)
+
+    # every annotation is still found at every threshold, only the false positives lower the AP
+    results = evaluate_detection_coco(generator, AnnotationModel(generator, dataset), max_plots=0, workers=1)
+    assert 0.5 < results['mAP'] < 1.0
+    assert results['mAP'] == pytest.approx(results['AP50'])
+    assert results['AP50'] == pytest.approx(results['AP75'])
+
+
+def test_coco_ap50_matches_evaluate_detection(dataset, make_detection_generator):
+    generator = make_detection_generator(group_method=None)
+    model     = AnnotationModel(generator, dataset, noise=4.0)
+
+    average_precisions = evaluate_detection(generator, model, iou_threshold=0.5, max_plots=0, workers=1)
+    results            = evaluate_detection_coco(generator, model, iou_thresholds=[0.5, 0.75], max_plots=0, workers=1)
+
+    expected = [average_precisions[label] for label in range(generator.num_classes)]
+    np.testing.assert_allclose(results['average_precisions']['all'][:, 0], expected)
+    assert results['AP50'] == pytest.approx(np.mean(expected))
+    assert results['AP75'] < results['AP50']
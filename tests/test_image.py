@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip('keras')
+
+from keras_pipeline.preprocessing.image import get_image_info, get_image_size, read_image
+
+from .conftest import insert_app1_segment, jpeg_bytes, random_image
+
+
+@pytest.mark.parametrize('image_format, extension, kwargs', [
+    ('jpeg', 'jpg' , {}),
+    ('jpeg', 'jpg' , {'progressive': True}),
+    ('png' , 'png' , {}),
+    ('bmp' , 'bmp' , {}),
+    ('gif' , 'gif' , {}),
+    ('tiff', 'tif' , {}),
+    ('tiff', 'tif' , {'compression': 'tiff_deflate'}),
+])
+def test_get_image_info_matches_pil(tmpdir, image_format, extension, kwargs):
+    path = str(tmpdir.join('image.' + extension))
+    random_image((123, 321, 3)).save(path, **kwargs)
+
+    info = get_image_info(path)
+    assert info == (image_format, tmpdir.join('image.' + extension).size(), 321, 123)
+    assert get_image_size(path) == Image.open(path).size
+
+
+def test_jpeg_size_skips_embedded_thumbnail(tmpdir):
+    # The start of frame of the thumbnail comes first but is inside the APP1 segment
+    thumbnail = jpeg_bytes((40, 50, 3))
+    path      = tmpdir.join('image.jpg')
+    path.write_binary(insert_app1_segment(jpeg_bytes((300, 400, 3)), b'Exif\x00\x00' + thumbnail))
+    assert get_image_size(str(path)) == (400, 300)
+
+
+def test_jpeg_size_after_segments_larger_than_a_read_chunk(tmpdir):
+    path = tmpdir.join('image.jpg')
+    jpeg = jpeg_bytes((30, 70, 3))
+    for _ in range(3):
+        jpeg = insert_app1_segment(jpeg, b'\x00' * 65000)
+    path.write_binary(jpeg)
+    assert get_image_size(str(path)) == (70, 30)
+
+
+@pytest.mark.parametrize('size_hint, expected_shape', [
+    ((400, 300), (300, 400, 3)),
+    ((201, 150), (300, 400, 3)),
+    ((200, 150), (150, 200, 3)),
+    ((99.5, 74), (75, 100, 3)),
+    ((20, 10)  , (38, 50, 3)),
+])
+def test_read_image_with_size_hint_is_never_smaller_than_the_hint(tmpdir, size_hint, expected_shape):
+    # JPEGs are decoded at the smallest of 1, 1/2, 1/4 or 1/8 of their size which is not smaller than the hint
+    path = tmpdir.join('image.jpg')
+    path.write_binary(jpeg_bytes((300, 400, 3)))
+
+    image = read_image(str(path), size_hint=size_hint)
+    assert image.shape == expected_shape and image.dtype == np.uint8
+
+    # Other formats are not reduced
+    path = tmpdir.join('image.png')
+    random_image((300, 400, 3)).save(str(path))
+    assert read_image(str(path), size_hint=size_hint).shape == (300, 400, 3)
@@ -0,0 +1,68 @@
+import pickle
+
+import pytest
+
+pytest.importorskip('keras')
+
+from .conftest import assert_batches_equal
+
+
+def test_pickled_generator_continues_from_the_start(make_detection_generator):
+    generator = make_detection_generator(batch_size=2)
+    expected  = [generator.next() for _ in range(3)]
+
+    # A generator which already handed out batches is pickled as a fresh copy
+    copy = pickle.loads(pickle.dumps(generator))
+    for expected_batch in expected:
+        assert_batches_equal(copy.next(), expected_batch)
+
+
+def test_pickled_generator_rebuilds_its_worker_pool(make_detection_generator):
+    generator = make_detection_generator(batch_size=2, workers=2, use_shared_memory=True)
+    try:
+        expected = [generator.next() for _ in range(3)]
+        copy = pickle.loads(pickle.dumps(generator))
+    finally:
+        generator.close()
+
+    assert copy.pool is None and copy.batch_ring is None
+    try:
+        for expected_batch in expected:
+            assert_batches_equal(copy.next(), expected_batch)
+    finally:
+        copy.close()
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'use_shared_memory': True},
+    {'use_shared_memory': True, 'shared_memory_zero_copy': True},
+])
+def test_worker_pool_batches_match_serial_batches(make_detection_generator, kwargs):
+    expected  = make_detection_generator(batch_size=2)
+    generator = make_detection_generator(batch_size=2, workers=2, max_queue_size=4, **kwargs)
+    try:
+        # Two epochs, batches come back in group order
+        for _ in range(2 * len(expected._group_image_ids())):
+            assert_batches_equal(generator.next(), expected.next())
+            if kwargs.get('shared_memory_zero_copy'):
+                generator.release_batch()
+    finally:
+        generator.close()
+
+
+def test_shared_memory_ring_has_a_slot_per_worker(make_detection_generator):
+    generator = make_detection_generator(batch_size=2, workers=2, use_shared_memory=True, shared_memory_zero_copy=True)
+    try:
+        batches = [generator.next() for _ in range(3)]
+        assert generator.batch_ring.num_slots == 3
+
+        # Every slot is held by the consumer
+        with pytest.raises(RuntimeError):
+            generator.next()
+
+        # Released slots are computed into again
+        generator.release_batch()
+        batches = batches[1:] + [generator.next()]
+    finally:
+        generator.close()
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+pytest.importorskip('keras')
+
+from keras_pipeline.datasets.image_index import open_image_index
+
+from .conftest import FileDataset
+
+
+def test_index_is_rebuilt_if_an_image_file_changes(tmpdir):
+    dataset    = FileDataset(str(tmpdir.mkdir('images')))
+    index_path = str(tmpdir.join('index.npz'))
+
+    image_index = open_image_index(dataset, index_path, workers=2)
+    assert image_index.get_image_size(1) == (60, 40)
+
+    # Replace an image under the same image id
+    time.sleep(0.01)
+    dataset.write_image(1, 1, shape=(50, 20))
+    image_index = open_image_index(dataset, index_path, workers=2)
+    assert image_index.get_image_size(1) == (20, 50)
+
+
+def test_ratio_order_matches_dataset_aspect_ratios(dataset, make_detection_generator, tmpdir):
+    generator = make_detection_generator(group_method='ratio', image_index_path=str(tmpdir.join('index.npz')))
+    expected  = sorted(dataset.list_all_image_index(), key=dataset.get_image_aspect_ratio)
+
+    assert generator.image_index.ratio_order == expected
+    assert generator._sort_image_ids_by_ratio(dataset.list_all_image_index()) == expected
+    assert generator._sort_image_ids_by_ratio(expected[::2][::-1]) == expected[::2]
+
+    # The cached order is not changed by the groups built from it
+    generator._group_image_ids()
+    assert generator.image_index.ratio_order == expected
@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+pytest.importorskip('keras')
+
+from keras_pipeline.preprocessing.image_store import open_resized_image_store
+
+from .conftest import FileDataset
+
+
+def test_store_is_rebuilt_if_an_image_file_changes(tmpdir):
+    dataset    = FileDataset(str(tmpdir.mkdir('images')))
+    store_path = str(tmpdir.join('store'))
+
+    store = open_resized_image_store(dataset, store_path, min_side=20, max_side=40)
+    assert store.load_image(1).shape == (20, 30, 3)
+    assert store.load_image(1).max() == 1
+    key = store.key
+
+    # Reopening an unchanged dataset reuses the store
+    assert open_resized_image_store(dataset, store_path, min_side=20, max_side=40).key == key
+
+    # Replace an image under the same image id
+    time.sleep(0.01)
+    dataset.write_image(1, 7)
+    store = open_resized_image_store(dataset, store_path, min_side=20, max_side=40)
+    assert store.key != key
+    assert store.load_image(1).max() == 7
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from keras_pipeline.datasets.manifest import Manifest, build_manifest, scan_image
+
+from .conftest import insert_app1_segment, jpeg_bytes, random_image
+
+
+def jpeg_cases():
+    jpeg      = jpeg_bytes((300, 400, 3))
+    with_exif = insert_app1_segment(jpeg, b'Exif\x00\x00' + jpeg_bytes((40, 50, 3)))
+    trailing  = np.random.RandomState(0).bytes(5000).replace(b'\xff\xd9', b'\x00\x00')
+    return [
+        ('complete'         , jpeg                         , True),
+        ('truncated'        , jpeg[:len(jpeg) // 2]        , False),
+        ('trailing_data'    , jpeg + trailing              , True),
+        ('exif'             , with_exif                    , True),
+        ('exif_trailing'    , with_exif + b'\x00' * 4000   , True),
+        # the end of image marker of the thumbnail must not be taken for the one of the image
+        ('exif_truncated'   , with_exif[:-3000]            , False),
+        ('exif_header_only' , with_exif[:len(with_exif) - len(jpeg) + 600], False),
+    ]
+
+
+@pytest.mark.parametrize('case', jpeg_cases(), ids=lambda case: case[0])
+def test_scan_jpeg(tmpdir, case):
+    name, data, valid = case
+    path = tmpdir.join(name + '.jpg')
+    path.write_binary(data)
+    assert scan_image(str(path)) == ('jpeg', len(data), 400, 300, valid)
+
+
+def test_scan_png_and_unreadable_files(tmpdir):
+    path = str(tmpdir.join('image.png'))
+    random_image((20, 30, 3)).save(path)
+    data = tmpdir.join('image.png').read_binary()
+    assert scan_image(path) == ('png', len(data), 30, 20, True)
+
+    tmpdir.join('truncated.png').write_binary(data[:-20])
+    assert scan_image(str(tmpdir.join('truncated.png')))[4] is False
+
+    tmpdir.join('text.png').write_binary(b'not an image')
+    assert scan_image(str(tmpdir.join('text.png'))) == ('unknown', 12, -1, -1, False)
+
+
+def test_manifest_round_trip(tmpdir):
+    paths = []
+    for name, data, _ in jpeg_cases():
+        path = tmpdir.join(name + '.jpg')
+        path.write_binary(data)
+        paths.append(str(path))
+
+    manifest = build_manifest(paths, workers=4)
+    manifest.save(str(tmpdir.join('manifest.npz')))
+    loaded = Manifest.load(str(tmpdir.join('manifest.npz')))
+
+    assert len(loaded) == len(paths)
+    np.testing.assert_array_equal(loaded.valid, manifest.valid)
+    assert sorted(loaded.get_invalid_paths()) == sorted(
+        str(tmpdir.join(name + '.jpg')) for name, _, valid in jpeg_cases() if not valid)
+    assert loaded.is_valid(paths[0]) and not loaded.is_valid(paths[1])
+    assert loaded.is_valid(str(tmpdir.join('unknown.jpg')))